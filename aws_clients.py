@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from instrumentation import instrument_client
+
+DEFAULT_ROLE_NAME = 'OrganizationAccountAccessRole'
+ROLE_SESSION_NAME = 'sg-audit'
+# 'adaptive' also rate-limits client-side once AWS starts throttling
+RETRY_MODE = os.environ.get('SG_AUDIT_RETRY_MODE', 'adaptive')
+MAX_ATTEMPTS = int(os.environ.get('SG_AUDIT_MAX_ATTEMPTS', '10'))
+# Enough connections for the parallel modes not to queue on the urllib3 pool
+MAX_POOL_CONNECTIONS = int(os.environ.get('SG_AUDIT_MAX_POOL_CONNECTIONS', '50'))
+CREDENTIAL_REFRESH_MARGIN = timedelta(minutes=5)
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown',
+    'LimitExceededException', 'ProvisionedThroughputExceededException', 'BandwidthLimitExceeded'
+}
+
+_lock = threading.Lock()
+_sessions = {}  # (account_id, role_name) -> (session, expiration)
+_clients = {}  # (account_id, role_name, region, service) -> client
+_client_config = None
+_caller_account_id = None
+throttle_counts = Counter()  # (service, operation) -> throttled attempts
+
+
+def client_config():
+    """Returns the shared botocore Config (retry mode, attempts, connection pool size)."""
+    global _client_config
+    if _client_config is None:
+        from botocore.config import Config
+        _client_config = Config(
+            retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+            max_pool_connections=MAX_POOL_CONNECTIONS
+        )
+    return _client_config
+
+
+def _count_throttles(response=None, operation=None, **kwargs):
+    """needs-retry hook: counts throttled attempts per (service, operation), never alters retries."""
+    if response is None or operation is None:
+        return None
+    code = response[1].get('Error', {}).get('Code') if response[1] else None
+    if code in THROTTLE_CODES:
+        with _lock:
+            throttle_counts[(operation.service_model.service_name, operation.name)] += 1
+    return None
+
+
+def get_session(account_id=None, role_name=DEFAULT_ROLE_NAME):
+    """
+    Returns a cached boto3 session, for the default credentials or for
+    role_name assumed in account_id. Assumed-role sessions are renewed
+    shortly before their credentials expire.
+    """
+    import boto3
+
+    key = (account_id, role_name if account_id else None)
+    with _lock:
+        cached = _sessions.get(key)
+        if cached and (cached[1] is None or cached[1] - CREDENTIAL_REFRESH_MARGIN > datetime.now(timezone.utc)):
+            return cached[0]
+
+    if account_id is None:
+        session, expiration = boto3.Session(), None
+    else:
+        sts = get_client('sts')
+        credentials = sts.assume_role(
+            RoleArn=f"arn:aws:iam::{account_id}:role/{role_name}",
+            RoleSessionName=ROLE_SESSION_NAME
+        )['Credentials']
+        session = boto3.Session(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+        expiration = credentials['Expiration']
+
+    with _lock:
+        _sessions[key] = (session, expiration)
+        # Clients built from a replaced session hold stale credentials
+        for client_key in [k for k in _clients if k[:2] == key]:
+            del _clients[client_key]
+    return session
+
+
+def get_client(service, region=None, account_id=None, role_name=DEFAULT_ROLE_NAME):
+    """
+    Returns a cached client for service in region (and account_id, if given).
+
+    Clients are created on first use, shared across threads (boto3 clients
+    are thread-safe) and count throttled calls into throttle_counts.
+    """
+    # Cheap when cached; renews assumed-role sessions and drops their stale clients
+    session = get_session(account_id, role_name)
+    key = (account_id, role_name if account_id else None, region, service)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = session.client(service, region_name=region, config=client_config())
+            client.meta.events.register('needs-retry', _count_throttles)
+            instrument_client(client, THROTTLE_CODES)
+            _clients[key] = client
+        return client
+
+
+def caller_account_id(account_id=None):
+    """Returns account_id, or the account of the default credentials (looked up once)."""
+    global _caller_account_id
+    if account_id is not None:
+        return account_id
+    if _caller_account_id is None:
+        _caller_account_id = get_client('sts').get_caller_identity()['Account']
+    return _caller_account_id
+
+
+def list_regions(account_id=None, role_name=DEFAULT_ROLE_NAME):
+    """Returns the EC2 regions enabled for the account."""
+    ec2 = get_client('ec2', 'us-east-1', account_id, role_name)
+    return sorted(region['RegionName'] for region in ec2.describe_regions()['Regions'])
+
+
+def throttle_summary():
+    """Returns 'service.Operation: count' lines for every throttled operation."""
+    with _lock:
+        return [f"{service}.{operation}: {count}" for (service, operation), count in sorted(throttle_counts.items())]
@@ -0,0 +1,277 @@
+"""
+Offline benchmarks for the scripts' hot paths.
+
+AWS calls are answered by botocore Stubber clients preloaded with synthetic
+responses (see synthetic.py), so no credentials or network are needed.
+Every benchmark runs in a fresh process so its peak RSS is its own.
+
+    python benchmarks/run_benchmarks.py --save baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json
+    python benchmarks/run_benchmarks.py --scale 0.1 --only analyze_changes
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+from report_writers import write_report  # noqa: E402
+
+REGION = 'us-east-1'
+REGRESSION_TOLERANCE = 0.15  # slower or larger than the baseline by more than this is flagged
+
+
+class Stages:
+    """Wall-clock time per named stage of a benchmark."""
+
+    def __init__(self):
+        self.times = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.perf_counter() - start
+
+
+def stubbed_client(service, calls, region=REGION):
+    """Returns an activated Stubber-backed client answering calls, a list of (operation, response)."""
+    import boto3
+    from botocore.stub import Stubber
+
+    client = boto3.client(service, region_name=region, aws_access_key_id='bench', aws_secret_access_key='bench')
+    stubber = Stubber(client)
+    for operation, response in calls:
+        stubber.add_response(operation, response)
+    stubber.activate()
+    return client
+
+
+def install_client(service, client, region):
+    """Makes aws_clients.get_client(service, region) return client."""
+    import aws_clients
+    aws_clients.get_session()
+    aws_clients._clients[(None, None, region, service)] = client
+
+
+def bench_get_ec2_instances(scale, stages, workdir):
+    import getlistInstanceName_Sg as inventory
+
+    count = int(50000 * scale)
+    sg_ids = [synthetic.sg_id(i) for i in range(20)]
+    pages = synthetic.instance_pages(count, sg_ids)
+    install_client('ec2', stubbed_client('ec2', [('describe_instances', page) for page in pages]), REGION)
+    with stages.stage('fetch'):
+        rows = list(inventory.iter_ec2_instances(sg_ids, [REGION], max_workers=1))
+    with stages.stage('write'):
+        write_report(rows, os.path.join(workdir, 'instances.csv'), list(rows[0]) if rows else [])
+    return len(rows)
+
+
+def bench_fetch_inbound_rules(scale, stages, workdir):
+    import getinboundrule
+
+    count = int(10000 * scale)
+    batches = synthetic.security_group_batches(count)
+    install_client('ec2', stubbed_client('ec2', [('describe_security_groups', batch) for batch in batches]),
+                   getinboundrule.aws_region)
+    with stages.stage('fetch'):
+        rows = list(getinboundrule.iter_inbound_rules([synthetic.sg_id(i) for i in range(count)]))
+    with stages.stage('write'):
+        write_report(rows, os.path.join(workdir, 'rules.csv'), getinboundrule.RULE_ROW_FIELDS)
+    return len(rows)
+
+
+def bench_analyze_changes(scale, stages, workdir):
+    import modify_sg_changes_v1 as changes
+
+    count = int(100000 * scale)
+    events = synthetic.cloudtrail_events(count)
+    with stages.stage('parse'):
+        records = [record for record in map(changes.to_change_record, events) if record]
+    with stages.stage('analyze'):
+        analyzed = changes.analyze_changes(records)
+    with stages.stage('write'):
+        return changes.write_to_csv(analyzed, os.path.join(workdir, 'changes.csv'))
+
+
+def bench_query_logs(scale, stages, workdir):
+    import vpc_flow_reject_v4 as flows
+
+    count = int(9999 * min(scale, 1))
+    calls = [
+        ('start_query', {'queryId': 'bench-query'}),
+        ('get_query_results', {'status': 'Complete', 'results': synthetic.insights_results(count),
+                               'statistics': {'recordsMatched': float(count)}}),
+    ]
+    install_client('logs', stubbed_client('logs', calls), flows.AWS_REGION)
+    private_ips = [synthetic.private_ip(i) for i in range(500)]
+    with stages.stage('query'):
+        logs = flows.query_log_groups(['bench-log-group'], private_ips)
+    with stages.stage('write'):
+        rows = ({field['field']: field.get('value', '') for field in log} for log in logs)
+        write_report(rows, os.path.join(workdir, 'flows.csv'), [field['field'] for field in logs[0]] if logs else [])
+    return len(logs)
+
+
+def bench_flow_log_analyzer(scale, stages, workdir):
+    import flow_log_analyzer
+
+    count = int(2000000 * scale)
+    path = os.path.join(workdir, 'flows.log')
+    synthetic.write_flow_log(path, count)
+    with stages.stage('aggregate'):
+        counts = flow_log_analyzer.analyze_file(path)
+    with stages.stage('rows'):
+        flow_log_analyzer.to_result_rows(counts)
+    return sum(counts.values())
+
+
+def bench_flow_store(scale, stages, workdir):
+    import flow_store
+
+    count = int(2000000 * scale)
+    path = os.path.join(workdir, 'flows.log')
+    synthetic.write_flow_log(path, count)
+    with stages.stage('load'):
+        store = flow_store.FlowStore().add_flow_log_file(path)
+    with stages.stage('top'):
+        store.top_dst_ports(10)
+        store.top_sources(10)
+    return len(store)
+
+
+def _bench_writer(extension):
+    def bench(scale, stages, workdir):
+        count = int(1000000 * scale)
+        fields = list(next(synthetic.report_rows(1)))
+        with stages.stage('write'):
+            return write_report(synthetic.report_rows(count), os.path.join(workdir, f"report.{extension}"), fields)
+    return bench
+
+
+BENCHMARKS = {
+    'get_ec2_instances': bench_get_ec2_instances,
+    'fetch_inbound_rules': bench_fetch_inbound_rules,
+    'analyze_changes': bench_analyze_changes,
+    'query_logs': bench_query_logs,
+    'flow_log_analyzer': bench_flow_log_analyzer,
+    'flow_store': bench_flow_store,
+    'write_csv': _bench_writer('csv'),
+    'write_jsonl': _bench_writer('jsonl'),
+    'write_parquet': _bench_writer('parquet'),
+}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_benchmark(name, scale):
+    """
+    Runs one benchmark (in the current process) and returns its result dict.
+
+    Benchmarks return the number of items they actually produced; none at
+    all means the stubbed calls or the code under test broke, which must
+    not pass for a fast run.
+    """
+    stages = Stages()
+    output = io.StringIO()
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(output):
+        items = BENCHMARKS[name](scale, stages, workdir)
+    if not items:
+        raise RuntimeError(f"{name} produced no items; its output was:\n{output.getvalue()}")
+    total = sum(stages.times.values())
+    return {
+        'items': items,
+        'seconds': round(total, 4),
+        'items_per_second': round(items / total, 1) if total else None,
+        'stages': {stage: round(seconds, 4) for stage, seconds in stages.times.items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_isolated(name, scale):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_benchmark, name, scale).result()
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Returns report lines comparing results with a saved baseline; regressions are marked."""
+    lines = []
+    for name, result in results.items():
+        before = baseline.get('benchmarks', {}).get(name)
+        if not before or 'seconds' not in before or 'seconds' not in result:
+            lines.append(f"{name}: no baseline")
+            continue
+        parts = []
+        for metric in ('seconds', 'peak_rss_mb'):
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            ratio = new / old
+            flag = ' REGRESSION' if ratio > 1 + tolerance else (' improved' if ratio < 1 - tolerance else '')
+            parts.append(f"{metric} {old} -> {new} ({ratio:.2f}x){flag}")
+        lines.append(f"{name}: " + '; '.join(parts))
+    return lines
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument('--only', type=str, help=f"Comma-separated benchmarks ({', '.join(BENCHMARKS)})")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplier for every benchmark's data size")
+    parser.add_argument('--save', type=str, help="Write the results to this JSON file (e.g. a new baseline)")
+    parser.add_argument('--compare', type=str, help="Baseline JSON to compare the results with")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help="Relative slowdown/growth reported as a regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    results = {}
+    for name in names:
+        try:
+            results[name] = run_isolated(name, args.scale)
+        except Exception as e:
+            print(f"Error running benchmark {name}: {e}")
+            results[name] = {'error': str(e)}
+            continue
+        result = results[name]
+        stages = ', '.join(f"{stage} {seconds:.3f}s" for stage, seconds in result['stages'].items())
+        print(f"{name}: {result['items']} items in {result['seconds']:.3f}s "
+              f"({result['items_per_second']}/s), peak RSS {result['peak_rss_mb']} MB [{stages}]")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print('\n'.join(compare(results, json.load(f), args.tolerance)))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'scale': args.scale,
+                'benchmarks': results,
+            }, f, indent=2)
+        print(f"Results saved to {args.save}")
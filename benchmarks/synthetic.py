@@ -0,0 +1,146 @@
+"""Synthetic AWS responses and flow logs, shaped like the real ones and sized for benchmarking."""
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+RULE_EVENT_NAMES = ['AuthorizeSecurityGroupIngress', 'RevokeSecurityGroupIngress',
+                    'AuthorizeSecurityGroupEgress', 'ModifySecurityGroupRules']
+OTHER_EVENT_NAMES = ['CreateTags', 'DescribeSecurityGroups', 'CreateSecurityGroup']
+
+
+def sg_id(i):
+    return f"sg-{i:017x}"
+
+
+def private_ip(i):
+    return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+def instance_pages(count, sg_ids, page_size=1000, seed=1):
+    """describe_instances pages with one instance per reservation, each in one or two of sg_ids."""
+    rng = random.Random(seed)
+    pages = []
+    for start in range(0, count, page_size):
+        reservations = []
+        for i in range(start, min(start + page_size, count)):
+            groups = rng.sample(sg_ids, min(len(sg_ids), rng.choice((1, 2))))
+            reservations.append({
+                'OwnerId': '123456789012',
+                'Instances': [{
+                    'InstanceId': f"i-{i:017x}",
+                    'PrivateIpAddress': private_ip(i),
+                    'NetworkInterfaces': [{'NetworkInterfaceId': f"eni-{i:017x}"}],
+                    'SecurityGroups': [{'GroupId': group, 'GroupName': f"name-{group}"} for group in groups],
+                    'Tags': [{'Key': 'Name', 'Value': f"host-{i}"}, {'Key': 'env', 'Value': 'bench'}],
+                }]
+            })
+        page = {'Reservations': reservations}
+        if start + page_size < count:
+            page['NextToken'] = f"token-{start}"
+        pages.append(page)
+    return pages
+
+
+def security_group(i, rules_per_group=6, seed=None):
+    rng = random.Random(i if seed is None else seed)
+    permissions = []
+    for _ in range(rules_per_group):
+        port = rng.choice((22, 80, 443, 3306, 5432, 8080))
+        permissions.append({
+            'IpProtocol': 'tcp', 'FromPort': port, 'ToPort': port,
+            'IpRanges': [{'CidrIp': f"10.{rng.randrange(256)}.0.0/16", 'Description': 'bench'}],
+            'UserIdGroupPairs': [{'GroupId': sg_id(rng.randrange(10000))}],
+        })
+    return {
+        'GroupId': sg_id(i), 'GroupName': f"name-{i}", 'Description': 'bench', 'VpcId': 'vpc-0123456789abcdef0',
+        'OwnerId': '123456789012', 'IpPermissions': permissions,
+        'IpPermissionsEgress': [{'IpProtocol': '-1', 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}],
+    }
+
+
+def security_group_batches(count, batch_size=200):
+    """describe_security_groups responses for count SG IDs requested in batches of batch_size."""
+    return [
+        {'SecurityGroups': [security_group(i) for i in range(start, min(start + batch_size, count))]}
+        for start in range(0, count, batch_size)
+    ]
+
+
+def _permission(rng):
+    port = rng.choice((22, 443, 8080))
+    return {
+        'ipProtocol': 'tcp', 'fromPort': port, 'toPort': port,
+        'ipRanges': {'items': [{'cidrIp': f"10.{rng.randrange(256)}.{rng.randrange(256)}.0/24"}]},
+        'groups': {'items': [{'groupId': sg_id(rng.randrange(1000))}]},
+    }
+
+
+def cloudtrail_events(count, rule_share=0.6, seed=1):
+    """LookupEvents entries: rule_share of them SG rule changes, the rest other EC2 calls."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    events = []
+    for i in range(count):
+        event_time = start + timedelta(seconds=i * 7)
+        group = sg_id(rng.randrange(1000))
+        if rng.random() < rule_share:
+            name = rng.choice(RULE_EVENT_NAMES)
+            if name == 'ModifySecurityGroupRules':
+                params = {'ModifySecurityGroupRulesRequest': {'GroupId': group, 'SecurityGroupRule': {
+                    'SecurityGroupRuleId': f"sgr-{i:017x}",
+                    'SecurityGroupRule': {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22, 'CidrIpv4': '0.0.0.0/0'}
+                }}}
+            else:
+                params = {'groupId': group, 'ipPermissions': {'items': [_permission(rng), _permission(rng)]}}
+        else:
+            name = rng.choice(OTHER_EVENT_NAMES)
+            params = {'resourcesSet': {'items': [{'resourceId': group}]}}
+        record = {
+            'eventVersion': '1.08', 'eventID': f"{i:032x}", 'eventTime': event_time.isoformat(),
+            'eventSource': 'ec2.amazonaws.com', 'eventName': name, 'awsRegion': 'us-east-1',
+            'sourceIPAddress': '198.51.100.7', 'userAgent': 'bench',
+            'userIdentity': {'type': 'AssumedRole', 'arn': 'arn:aws:sts::123456789012:assumed-role/bench/user'},
+            'requestParameters': params, 'responseElements': {'_return': True},
+        }
+        events.append({
+            'EventId': record['eventID'], 'EventName': name, 'EventTime': event_time,
+            'CloudTrailEvent': json.dumps(record),
+        })
+    return events
+
+
+def insights_results(count, seed=1):
+    """GetQueryResults rows for the REJECT stats query."""
+    rng = random.Random(seed)
+    return [
+        [
+            {'field': 'srcAddr', 'value': private_ip(rng.randrange(5000))},
+            {'field': 'srcPort', 'value': str(rng.randrange(1024, 65535))},
+            {'field': 'dstAddr', 'value': private_ip(rng.randrange(5000))},
+            {'field': 'dstPort', 'value': str(rng.choice((22, 443, 3306)))},
+            {'field': 'protocol', 'value': '6'},
+            {'field': 'count(*)', 'value': str(rng.randrange(1, 50))},
+        ]
+        for _ in range(count)
+    ]
+
+
+def write_flow_log(path, lines, seed=1):
+    """Writes a version 2 flow log file of lines records, about a third of them REJECTs."""
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        for i in range(lines):
+            action = 'REJECT' if rng.random() < 0.33 else 'ACCEPT'
+            f.write(f"2 123456789012 eni-0123456789abcdef0 {private_ip(rng.randrange(2000))} "
+                    f"{private_ip(rng.randrange(2000))} {rng.randrange(1024, 65535)} {rng.choice((22, 443, 3306))} "
+                    f"6 {rng.randrange(1, 20)} {rng.randrange(40, 9000)} {1700000000 + i // 100} "
+                    f"{1700000060 + i // 100} {action} OK\n")
+
+
+def report_rows(count):
+    return (
+        {'InstanceName': f"host-{i}", 'InstanceID': f"i-{i:017x}", 'PrivateIPAddress': private_ip(i),
+         'NIC_Count': 1, 'SG_GroupID': sg_id(i % 1000), 'SG_GroupName': f"name-{i % 1000}",
+         'Region': 'us-east-1', 'AccountID': '123456789012'}
+        for i in range(count)
+    )
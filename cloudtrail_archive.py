@@ -0,0 +1,177 @@
+import argparse
+import gzip
+import os
+import re
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from cloudtrail_parser import loads, may_contain_rule_event, to_change_record, CHANGE_ROW_FIELDS
+from report_writers import write_report
+from sg_state import to_epoch
+
+ARCHIVE_SUFFIXES = ('.json.gz', '.json', '.jsonl', '.jsonl.gz')
+# Org trails write many small files; hand them to the workers in batches
+FILES_PER_TASK = 64
+# CloudTrail names its files ..._CloudTrail_<region>_<YYYYMMDDTHHMM>Z_<id>.json.gz
+DELIVERY_TIME = re.compile(r'_(\d{8}T\d{4})Z_')
+
+
+def read_archive_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return gzip.decompress(data) if path.endswith('.gz') else data
+
+
+def iter_raw_records(data):
+    """
+    Yields CloudTrail records from one archive file.
+
+    Files delivered by CloudTrail ({"Records": [...]}) are decoded whole, and
+    only when the byte prefilter finds a rule event name in them; JSON Lines
+    files are prefiltered line by line.
+    """
+    if not may_contain_rule_event(data):
+        return
+    if data.lstrip()[:1] == b'{' and b'"Records"' in data[:64]:
+        yield from loads(data).get('Records', [])
+        return
+    for line in data.splitlines():
+        if line.strip() and may_contain_rule_event(line):
+            yield loads(line)
+
+
+def _event_sg_ids(change):
+    """SG IDs a change record concerns: the changed groups and any referenced peer groups."""
+    sg_ids = set()
+    for rule_change in change['RuleChanges']:
+        sg_ids.add(rule_change.rule.group_id)
+        if rule_change.rule.peer_type == 'security_group':
+            sg_ids.add(rule_change.rule.peer)
+    sg_ids.discard(None)
+    return sg_ids
+
+
+def scan_file(path, sg_ids=None, start=None, end=None):
+    """
+    Returns (sg_id, change) pairs for the SG rule changes in one archive file,
+    as modify_sg_changes_v1.iter_sg_changes yields them from LookupEvents.
+    start and end are epoch seconds (or None for an open end).
+    """
+    try:
+        data = read_archive_file(path)
+    except (OSError, EOFError) as e:
+        print(f"Error reading {path}: {e}")
+        return []
+    results = []
+    for record in iter_raw_records(data):
+        change = to_change_record(record)
+        if change is None:
+            continue
+        event_time = to_epoch(change['EventTime'])
+        if (start is not None and event_time < start) or (end is not None and event_time > end):
+            continue
+        for sg_id in sorted(_event_sg_ids(change)):
+            if sg_ids is None or sg_id in sg_ids:
+                results.append((sg_id, change))
+    return results
+
+
+def _change_order(item):
+    return to_epoch(item[1]['EventTime']), item[0]
+
+
+def _scan_files(paths, sg_ids, start, end):
+    results = [result for path in paths for result in scan_file(path, sg_ids, start, end)]
+    return sorted(results, key=_change_order)
+
+
+def _delivery_order(path):
+    """Sorts CloudTrail files by delivery time across regions; other files keep their path order first."""
+    match = DELIVERY_TIME.search(os.path.basename(path))
+    return (match.group(1) if match else '', path)
+
+
+def find_archive_files(paths):
+    """Expands directories (e.g. an `aws s3 sync` of the trail bucket) into CloudTrail archive files."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if name.endswith(ARCHIVE_SUFFIXES):
+                    yield os.path.join(root, name)
+
+
+def iter_archive_changes(paths, sg_ids=None, start_time=None, end_time=None, processes=None):
+    """
+    Yields (sg_id, change) pairs from local CloudTrail archive files, scanned
+    in a process pool. Unlike LookupEvents there is no 90-day limit, rate
+    limit or one-SG-per-call restriction.
+
+    Files are scanned in batches in delivery order and each batch is yielded,
+    sorted by event time, as soon as it and the batches before it are done;
+    only a few batches are in flight, so memory stays flat however many
+    files there are. Pairs are therefore only ordered within a batch.
+    """
+    files = sorted(find_archive_files(paths), key=_delivery_order)
+    if not files:
+        return
+    sg_ids = set(sg_ids) if sg_ids is not None else None
+    start = to_epoch(start_time) if start_time is not None else None
+    end = to_epoch(end_time) if end_time is not None else None
+    batches = (files[i:i + FILES_PER_TASK] for i in range(0, len(files), FILES_PER_TASK))
+    in_flight = 2 * (processes or os.cpu_count() or 1)
+    scan = partial(_scan_files, sg_ids=sg_ids, start=start, end=end)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(executor.submit(scan, batch))
+                if len(pending) >= in_flight:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def iter_unique_changes(pairs):
+    """
+    Drops the repeats of changes that concern several SGs from (sg_id, change)
+    pairs as iter_archive_changes yields them. A change's pairs come from one
+    file and sit together in time order, so only the current second's
+    changes are remembered.
+    """
+    seen, seen_time = set(), None
+    for _, change in pairs:
+        if change['EventTime'] != seen_time:
+            seen, seen_time = set(), change['EventTime']
+        key = (change['EventId'], change['EventTime'])
+        if key not in seen:
+            seen.add(key)
+            yield change
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="Extract SG rule changes from CloudTrail archive files.")
+    parser.add_argument('paths', nargs='+', help="CloudTrail archive files or directories (.json.gz, .json, .jsonl)")
+    parser.add_argument('--sg_ids', type=str, help="Comma-separated SG IDs to keep (default: all)")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--output', type=str, default='sg_rule_changes_archive.csv',
+                        help="Output file (.csv, .jsonl, .parquet or .arrow)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    sg_ids = args.sg_ids.split(',') if args.sg_ids else None
+    rows = (
+        rule_change.to_row()
+        for change in iter_unique_changes(iter_archive_changes(args.paths, sg_ids, processes=args.processes))
+        for rule_change in change['RuleChanges']
+    )
+    count = write_report(rows, args.output, CHANGE_ROW_FIELDS)
+    print(f"{count} rule changes written to {args.output}")
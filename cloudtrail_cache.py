@@ -0,0 +1,192 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from cloudtrail_lookup import iter_lookup_events_parallel
+from instrumentation import timed
+
+# LookupEvents can surface events up to ~15 minutes after they happen, so
+# every delta fetch re-reads this much history and relies on EventId dedup.
+DELIVERY_OVERLAP = timedelta(minutes=20)
+
+# Events and high-water marks are kept per scope ('account/region'): an SG ID
+# only means something in its own account and region, and a region that
+# does not own an SG must not mark it as synced for the one that does.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    scope TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    sg_id TEXT NOT NULL,
+    event_time REAL NOT NULL,
+    event_name TEXT,
+    cloudtrail_event TEXT,
+    PRIMARY KEY (scope, event_id, sg_id)
+);
+CREATE INDEX IF NOT EXISTS events_by_sg_time ON events (scope, sg_id, event_time);
+CREATE TABLE IF NOT EXISTS high_water (
+    scope TEXT NOT NULL,
+    sg_id TEXT NOT NULL,
+    synced_from REAL NOT NULL,
+    synced_until REAL NOT NULL,
+    PRIMARY KEY (scope, sg_id)
+);
+"""
+
+
+def _to_epoch(value):
+    """Converts a datetime (naive values are treated as UTC) to epoch seconds."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _from_epoch(value):
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+def cache_scope(cloudtrail_client, account_id=None):
+    """Returns the 'account/region' scope that cloudtrail_client's events are cached under."""
+    from aws_clients import caller_account_id
+    return f"{caller_account_id(account_id)}/{cloudtrail_client.meta.region_name}"
+
+
+class CloudTrailEventCache:
+    """
+    On-disk store of CloudTrail events keyed by EventId and SG.
+
+    Each SG keeps the time range that has already been synced, so repeated
+    runs only ask LookupEvents for the delta since the last run. One file
+    can hold several scopes; an instance only reads and writes its own.
+    """
+
+    def __init__(self, path, scope=''):
+        self.path = path
+        self.scope = scope
+        self.conn = sqlite3.connect(path)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(high_water)")]
+        if columns and 'scope' not in columns:
+            # Caches from before scoping cannot tell regions apart; they are rebuilt from CloudTrail
+            self.conn.executescript("DROP TABLE IF EXISTS events; DROP TABLE IF EXISTS high_water;")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def synced_range(self, sg_id):
+        """Returns the (synced_from, synced_until) datetimes for sg_id, or None."""
+        row = self.conn.execute(
+            "SELECT synced_from, synced_until FROM high_water WHERE scope = ? AND sg_id = ?", (self.scope, sg_id)
+        ).fetchone()
+        if row is None:
+            return None
+        return _from_epoch(row[0]), _from_epoch(row[1])
+
+    def delta_start(self, sg_id, start_time):
+        """Returns where the next fetch for sg_id has to start to cover start_time."""
+        synced = self.synced_range(sg_id)
+        if synced is None or _to_epoch(start_time) < _to_epoch(synced[0]):
+            return start_time
+        resume = synced[1] - DELIVERY_OVERLAP
+        if start_time.tzinfo is None:
+            resume = resume.replace(tzinfo=None)
+        return max(start_time, resume)
+
+    def merge(self, sg_id, events):
+        """Inserts LookupEvents entries for sg_id, skipping known EventIds. Returns the insert count."""
+        before = self.conn.total_changes
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO events (scope, event_id, sg_id, event_time, event_name, cloudtrail_event) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (self.scope, event['EventId'], sg_id, _to_epoch(event['EventTime']),
+                 event.get('EventName'), event.get('CloudTrailEvent'))
+                for event in events
+            )
+        )
+        return self.conn.total_changes - before
+
+    def mark_synced(self, sg_id, start_time, end_time):
+        """
+        Records that sg_id is complete between start_time and end_time.
+
+        Only one contiguous range is kept per SG: a window that overlaps or
+        touches it extends it, a disjoint later window replaces it, and a
+        disjoint earlier window leaves it alone (events in a gap between two
+        windows were never fetched, so the range must not span it).
+        """
+        synced = self.synced_range(sg_id)
+        synced_from = _to_epoch(start_time)
+        synced_until = _to_epoch(end_time)
+        if synced is not None:
+            old_from, old_until = _to_epoch(synced[0]), _to_epoch(synced[1])
+            if synced_from <= old_until and synced_until >= old_from:
+                synced_from = min(synced_from, old_from)
+                synced_until = max(synced_until, old_until)
+            elif synced_until < old_from:
+                return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO high_water (scope, sg_id, synced_from, synced_until) VALUES (?, ?, ?, ?)",
+            (self.scope, sg_id, synced_from, synced_until)
+        )
+
+    @timed('cloudtrail.cache_sync')
+    def sync(self, cloudtrail_client, sg_ids, start_time, end_time, max_workers=4):
+        """
+        Fetches only the events newer than each SG's high-water mark and merges them in.
+
+        Raises fanout.FanoutError if some SGs could not be fetched; the SGs
+        that were are still merged and marked synced.
+        """
+        sg_ids = list(sg_ids)
+        start_times = {sg_id: self.delta_start(sg_id, start_time) for sg_id in sg_ids}
+        completed = []
+        inserted = 0
+
+        events = iter_lookup_events_parallel(
+            cloudtrail_client, sg_ids, start_time, end_time,
+            max_workers=max_workers, start_times=start_times, on_complete=completed.append
+        )
+        try:
+            for sg_id, event in events:
+                inserted += self.merge(sg_id, [event])
+        finally:
+            # Keep what the SGs that did finish fetched, even when others failed (FanoutError)
+            for sg_id in completed:
+                self.mark_synced(sg_id, start_times[sg_id], end_time)
+            self.conn.commit()
+        return inserted
+
+    def iter_events(self, sg_id, start_time, end_time):
+        """Yields cached events for sg_id in the window, shaped like LookupEvents entries."""
+        rows = self.conn.execute(
+            "SELECT event_id, event_time, event_name, cloudtrail_event FROM events "
+            "WHERE scope = ? AND sg_id = ? AND event_time >= ? AND event_time <= ? ORDER BY event_time DESC",
+            (self.scope, sg_id, _to_epoch(start_time), _to_epoch(end_time))
+        )
+        for event_id, event_time, event_name, cloudtrail_event in rows:
+            yield {
+                'EventId': event_id,
+                'EventTime': _from_epoch(event_time),
+                'EventName': event_name,
+                'CloudTrailEvent': cloudtrail_event
+            }
+
+
+def iter_cached_events(cache_path, cloudtrail_client, sg_ids, start_time, end_time, max_workers=4, scope=None):
+    """
+    Syncs the cache at cache_path with CloudTrail, then yields (sg_id, event) pairs from it.
+
+    scope defaults to the account and region of cloudtrail_client.
+    """
+    sg_ids = list(sg_ids)
+    scope = scope if scope is not None else cache_scope(cloudtrail_client)
+    with CloudTrailEventCache(cache_path, scope) as cache:
+        inserted = cache.sync(cloudtrail_client, sg_ids, start_time, end_time, max_workers=max_workers)
+        print(f"CloudTrail cache {cache_path}: {inserted} new events")
+        for sg_id in sg_ids:
+            for event in cache.iter_events(sg_id, start_time, end_time):
+                yield sg_id, event
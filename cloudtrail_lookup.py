@@ -0,0 +1,80 @@
+import threading
+import time
+from fanout import iter_fanout
+from instrumentation import timed
+
+# CloudTrail allows 2 LookupEvents calls per second per account and region
+LOOKUP_EVENTS_TPS = 2
+LOOKUP_PAGE_SIZE = 50  # LookupEvents maximum
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to pace API calls."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then consumes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@timed('cloudtrail.lookup_events')
+def iter_lookup_events(cloudtrail_client, sg_id, start_time, end_time, rate_limiter=None):
+    """Yields every CloudTrail event recorded for sg_id, following NextToken."""
+    kwargs = {
+        'LookupAttributes': [
+            {'AttributeKey': 'ResourceName', 'AttributeValue': sg_id}
+        ],
+        'StartTime': start_time,
+        'EndTime': end_time,
+        'MaxResults': LOOKUP_PAGE_SIZE
+    }
+    while True:
+        if rate_limiter:
+            rate_limiter.acquire()
+        response = cloudtrail_client.lookup_events(**kwargs)
+        for event in response.get('Events', []):
+            yield event
+
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        kwargs['NextToken'] = next_token
+
+
+def iter_lookup_events_parallel(cloudtrail_client, sg_ids, start_time, end_time,
+                                max_workers=4, rate=LOOKUP_EVENTS_TPS, buffer_size=500,
+                                start_times=None, on_complete=None):
+    """
+    Yields (sg_id, event) pairs for all sg_ids, one worker per SG.
+
+    Workers share a single token bucket so the account stays under the
+    LookupEvents limit, and hand events over through a bounded queue so
+    memory stays flat no matter how many events each SG has.
+
+    start_times optionally overrides start_time per SG, and on_complete is
+    called with each sg_id whose pages were all fetched without error. If
+    any SG fails, fanout.FanoutError is raised after the others are done.
+    """
+    rate_limiter = TokenBucket(rate)
+
+    def worker(sg_id):
+        sg_start_time = (start_times or {}).get(sg_id, start_time)
+        return iter_lookup_events(cloudtrail_client, sg_id, sg_start_time, end_time, rate_limiter)
+
+    return iter_fanout(worker, sg_ids, max_workers=max_workers, buffer_size=buffer_size,
+                       on_complete=on_complete, describe=lambda sg_id: f"CloudTrail events for {sg_id}")
@@ -0,0 +1,202 @@
+import json
+from collections import namedtuple
+from datetime import datetime
+from instrumentation import timed
+from sg_rules import SecurityGroupRule, iter_permission_rules, rule_from_spec, DESCRIBE_RULE_KEYS
+
+try:
+    import orjson
+except ImportError:  # the standard library decoder is ~3-5x slower on large trails
+    orjson = None
+
+# (ChangeType, direction) of each rule-mutating EC2 API call
+RULE_EVENTS = {
+    'AuthorizeSecurityGroupIngress': ('Added', 'Inbound'),
+    'AuthorizeSecurityGroupEgress': ('Added', 'Outbound'),
+    'RevokeSecurityGroupIngress': ('Removed', 'Inbound'),
+    'RevokeSecurityGroupEgress': ('Removed', 'Outbound'),
+}
+MODIFY_RULES_EVENT = 'ModifySecurityGroupRules'
+SG_RULE_EVENT_NAMES = frozenset(RULE_EVENTS) | {MODIFY_RULES_EVENT}
+# Every rule event name contains one of these, so raw records without them can be skipped undecoded
+_RAW_MARKERS = (b'SecurityGroupIngress', b'SecurityGroupEgress', b'SecurityGroupRules')
+
+_ChangeBase = namedtuple('RuleChange', [
+    'event_id', 'event_time', 'event_name', 'change_type', 'user', 'source_ip', 'rule', 'rule_id'
+])
+
+
+class RuleChange(_ChangeBase):
+    """
+    One SG rule added, removed or modified by a CloudTrail event.
+
+    rule is a normalized SecurityGroupRule; its direction is None for
+    ModifySecurityGroupRules, which only names the rule by rule_id.
+    """
+    __slots__ = ()
+
+    def to_row(self):
+        return {
+            'EventTime': self.event_time,
+            'EventName': self.event_name,
+            'GroupId': self.rule.group_id,
+            'ChangeType': self.change_type,
+            'Direction': self.rule.direction,
+            'Protocol': self.rule.protocol,
+            'PortRange': self.rule.port_range,
+            'Peer': self.rule.peer,
+            'Description': self.rule.description,
+            'RuleId': self.rule_id,
+            'User': self.user,
+        }
+
+
+CHANGE_ROW_FIELDS = ['EventTime', 'EventName', 'GroupId', 'ChangeType', 'Direction', 'Protocol',
+                     'PortRange', 'Peer', 'Description', 'RuleId', 'User']
+
+
+def loads(data):
+    """Decodes a CloudTrail JSON document (str or bytes), with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def may_contain_rule_event(raw):
+    """Cheap byte-level prefilter: False means raw (bytes) holds no SG rule event."""
+    return any(marker in raw for marker in _RAW_MARKERS)
+
+
+def _items(value):
+    """CloudTrail wraps request lists as {"items": [...]}; also accepts bare lists."""
+    if isinstance(value, dict):
+        return value.get('items') or []
+    return value or []
+
+
+def _request_permission(permission):
+    """Converts a CloudTrail ipPermissions item to the describe_security_groups IpPermission shape."""
+    return {
+        'IpProtocol': permission.get('ipProtocol'),
+        'FromPort': permission.get('fromPort'),
+        'ToPort': permission.get('toPort'),
+        'IpRanges': [{'CidrIp': r.get('cidrIp'), 'Description': r.get('description')}
+                     for r in _items(permission.get('ipRanges'))],
+        'Ipv6Ranges': [{'CidrIpv6': r.get('cidrIpv6'), 'Description': r.get('description')}
+                       for r in _items(permission.get('ipv6Ranges'))],
+        'PrefixListIds': [{'PrefixListId': r.get('prefixListId'), 'Description': r.get('description')}
+                          for r in _items(permission.get('prefixListIds'))],
+        'UserIdGroupPairs': [{'GroupId': r.get('groupId') or r.get('groupName'), 'Description': r.get('description')}
+                             for r in _items(permission.get('groups'))],
+    }
+
+
+# Field names of the flat rule shapes in ModifySecurityGroupRules requests and Authorize responses
+_MODIFY_KEYS = dict(DESCRIBE_RULE_KEYS, group='ReferencedGroupId')
+_RESPONSE_KEYS = {
+    'rule_id': 'securityGroupRuleId', 'protocol': 'ipProtocol', 'from': 'fromPort', 'to': 'toPort',
+    'description': 'description', 'cidr': 'cidrIpv4', 'cidr_ipv6': 'cidrIpv6', 'prefix_list': 'prefixListId',
+    'group': 'referencedGroupInfo',
+}
+
+
+def iter_event_rules(event_name, params, response=None):
+    """
+    Yields (ChangeType, rule, rule_id) for each rule an SG rule event touches.
+
+    Authorize calls use the rules echoed in the response when present (they
+    carry rule IDs); otherwise rules come from the request's ipPermissions.
+    """
+    params = params or {}
+    if event_name == MODIFY_RULES_EVENT:
+        request = params.get('ModifySecurityGroupRulesRequest', params)
+        group_id = request.get('GroupId')
+        entries = request.get('SecurityGroupRule') or []
+        for entry in [entries] if isinstance(entries, dict) else entries:
+            spec = dict(entry.get('SecurityGroupRule') or {}, SecurityGroupRuleId=entry.get('SecurityGroupRuleId'))
+            rule_id, rule = rule_from_spec(group_id, None, spec, _MODIFY_KEYS)
+            if rule is not None:
+                yield 'Modified', rule, rule_id
+        return
+
+    change_type, direction = RULE_EVENTS[event_name]
+    group_id = params.get('groupId') or params.get('groupName')
+    if change_type == 'Added' and response:
+        created = _items(response.get('securityGroupRuleSet'))
+        if created:
+            for spec in created:
+                rule_id, rule = rule_from_spec(spec.get('groupId', group_id), direction, spec, _RESPONSE_KEYS)
+                if rule is not None:
+                    yield change_type, rule, rule_id
+            return
+
+    permissions = [_request_permission(p) for p in _items(params.get('ipPermissions'))]
+    if not permissions and (params.get('cidrIp') or params.get('ipProtocol')):
+        # Legacy shorthand: a single CIDR rule given at the top level of the request
+        permissions = [_request_permission(dict(params, ipRanges=[{'cidrIp': params.get('cidrIp')}]))]
+    for permission in permissions:
+        for rule in iter_permission_rules(group_id, '', None, direction, permission):
+            yield change_type, rule, None
+    # Revokes by rule ID only name the rule; its content is unknown here
+    for item in _items(params.get('securityGroupRuleIds')):
+        rule_id = item.get('securityGroupRuleId') if isinstance(item, dict) else item
+        yield change_type, SecurityGroupRule(group_id, '', None, direction, None, None, None, None, None, 'N/A'), rule_id
+
+
+@timed('cloudtrail.parse_event')
+def parse_event(event):
+    """
+    Returns the RuleChanges of one event: a LookupEvents entry (with
+    EventName and a CloudTrailEvent JSON string) or a CloudTrail record
+    dict as stored in S3. Other events, and failed calls, give [].
+
+    LookupEvents entries whose EventName is not a rule event are skipped
+    without decoding their CloudTrailEvent blob.
+    """
+    if 'CloudTrailEvent' in event:
+        if event.get('EventName') not in SG_RULE_EVENT_NAMES:
+            return []
+        record = loads(event['CloudTrailEvent'])
+    else:
+        record = event
+    event_name = record.get('eventName')
+    if event_name not in SG_RULE_EVENT_NAMES or record.get('errorCode'):
+        return []
+
+    event_id = record.get('eventID')
+    event_time = event.get('EventTime')
+    if event_time is None and record.get('eventTime'):
+        # S3 records carry ISO-8601 strings; LookupEvents already returns datetimes
+        event_time = datetime.fromisoformat(record['eventTime'].replace('Z', '+00:00'))
+    user = (record.get('userIdentity') or {}).get('arn', 'N/A')
+    source_ip = record.get('sourceIPAddress', 'N/A')
+    return [
+        RuleChange(event_id, event_time, event_name, change_type, user, source_ip, rule, rule_id)
+        for change_type, rule, rule_id in iter_event_rules(
+            event_name, record.get('requestParameters'), record.get('responseElements'))
+    ]
+
+
+def to_change_record(event):
+    """
+    Converts a CloudTrail LookupEvents entry (or S3 record) into a change
+    record (a dict with all its RuleChanges), or None for other events.
+    """
+    rule_changes = parse_event(event)
+    if not rule_changes:
+        return None
+    first = rule_changes[0]
+    return {
+        'EventTime': first.event_time,
+        'EventName': first.event_name,
+        'EventId': first.event_id,
+        'RuleChanges': rule_changes,
+        'UserIdentity': first.user,
+        'SourceIPAddress': first.source_ip,
+    }
+
+
+def iter_rule_changes(events):
+    """Yields the RuleChanges of every event in events."""
+    for event in events:
+        yield from parse_event(event)
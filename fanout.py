@@ -0,0 +1,73 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FanoutError(Exception):
+    """Raised by iter_fanout after the other workers finished; failures maps each failed item to its exception."""
+
+    def __init__(self, failures, describe=str):
+        self.failures = failures
+        details = '; '.join(f"{describe(item)}: {error}" for item, error in failures.items())
+        super().__init__(f"{len(failures)} of the parallel tasks failed ({details})")
+
+
+def iter_fanout(worker, items, max_workers=8, buffer_size=500, on_complete=None, describe=str):
+    """
+    Runs worker(item) for every item in a thread pool and yields (item, result) pairs.
+
+    worker returns an iterable; its results are handed over through a bounded
+    queue as they are produced, so memory stays flat however much each worker
+    yields. A worker that raises is reported and the others carry on; once
+    they are all done, FanoutError is raised so a caller never mistakes the
+    partial results for complete ones. on_complete is called with each item
+    whose worker finished without error.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    results = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    done = object()
+    failures = {}
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                results.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(item):
+        try:
+            for result in worker(item):
+                if not put((item, result)):
+                    return
+            if on_complete:
+                on_complete(item)
+        except Exception as e:
+            print(f"Error processing {describe(item)}: {e}")
+            failures[item] = e
+        finally:
+            put(done)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        for item in items:
+            executor.submit(run, item)
+
+        remaining = len(items)
+        while remaining:
+            entry = results.get()
+            if entry is done:
+                remaining -= 1
+                continue
+            yield entry
+        if failures:
+            raise FanoutError(failures, describe)
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
@@ -0,0 +1,179 @@
+import argparse
+import gzip
+import mmap
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from report_writers import write_report
+from instrumentation import timed
+
+try:
+    import numpy as np
+except ImportError:  # pure-Python parsing still works, just slower
+    np = None
+
+# Default (version 2) VPC flow log record format
+DEFAULT_FIELDS = [
+    'version', 'account-id', 'interface-id', 'srcaddr', 'dstaddr', 'srcport', 'dstport',
+    'protocol', 'packets', 'bytes', 'start', 'end', 'action', 'log-status'
+]
+# Aggregation key, in the same order and naming as the Insights query output
+KEY_FIELDS = ['srcaddr', 'srcport', 'dstaddr', 'dstport', 'protocol']
+RESULT_FIELDS = ['srcAddr', 'srcPort', 'dstAddr', 'dstPort', 'protocol']
+CHUNK_SIZE = 64 * 1024 * 1024
+NO_PROTOCOL = (b'-', b'-1')
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yields blocks of whole lines from a plain (memory-mapped) or gzip flow log file."""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            rest = b''
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                data = rest + data
+                cut = data.rfind(b'\n') + 1
+                rest = data[cut:]
+                if cut:
+                    yield data[:cut]
+            if rest:
+                yield rest
+        return
+
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < len(mm):
+            end = mm.find(b'\n', min(start + chunk_size, len(mm)) - 1)
+            end = len(mm) if end == -1 else end + 1
+            yield mm[start:end]
+            start = end
+
+
+def _split_header(chunk, fields):
+    """Strips a leading header line (as written by S3 exports) and returns (chunk, fields)."""
+    first_line, _, rest = chunk.partition(b'\n')
+    names = first_line.split()
+    if b'srcaddr' in names and b'action' in names:
+        return rest, [name.decode() for name in names]
+    return chunk, fields
+
+
+def _aggregate_python(chunk, fields, src_ips, counts):
+    columns = [fields.index(name) for name in KEY_FIELDS]
+    src, protocol, action = fields.index('srcaddr'), fields.index('protocol'), fields.index('action')
+    width = len(fields)
+    for line in chunk.splitlines():
+        parts = line.split()
+        if len(parts) != width or parts[action] != b'REJECT' or parts[protocol] in NO_PROTOCOL:
+            continue
+        if src_ips is not None and parts[src] not in src_ips:
+            continue
+        counts[tuple(parts[i] for i in columns)] += 1
+
+
+def _aggregate_numpy(chunk, fields, src_ips, counts):
+    """Vectorised version of _aggregate_python; falls back to it for ragged chunks."""
+    tokens = chunk.split()
+    width = len(fields)
+    if len(tokens) % width or len(tokens) // width != chunk.count(b'\n') + (not chunk.endswith(b'\n')):
+        _aggregate_python(chunk, fields, src_ips, counts)
+        return
+    if not tokens:
+        return
+
+    records = np.array(tokens).reshape(-1, width)
+    protocol = records[:, fields.index('protocol')]
+    mask = (records[:, fields.index('action')] == b'REJECT') & (protocol != b'-') & (protocol != b'-1')
+    if src_ips is not None:
+        mask &= np.isin(records[:, fields.index('srcaddr')], np.array(sorted(src_ips)))
+
+    selected = records[mask][:, [fields.index(name) for name in KEY_FIELDS]]
+    if not len(selected):
+        return
+    keys, key_counts = np.unique(selected, axis=0, return_counts=True)
+    for key, count in zip(keys.tolist(), key_counts.tolist()):
+        counts[tuple(key)] += count
+
+
+def analyze_file(path, src_ips=None, fields=None):
+    """
+    Counts REJECTed, non-NODATA flows from src_ips in one flow log file.
+
+    Returns a Counter keyed by (srcaddr, srcport, dstaddr, dstport, protocol)
+    as bytes: the columns of vpc_flow_reject_v4.query_logs without its
+    @timestamp group, so each count covers the whole file rather than one
+    record timestamp and is not comparable row for row with Insights counts.
+    """
+    fields = list(fields or DEFAULT_FIELDS)
+    src_ips = {ip.encode() if isinstance(ip, str) else ip for ip in src_ips} if src_ips is not None else None
+    aggregate = _aggregate_numpy if np is not None else _aggregate_python
+    counts = Counter()
+    first = True
+    for chunk in iter_chunks(path):
+        if first:
+            chunk, fields = _split_header(chunk, fields)
+            first = False
+        aggregate(chunk, fields, src_ips, counts)
+    return counts
+
+
+def find_flow_log_files(paths):
+    """Expands directories into the flow log files (.log, .gz, .txt) they contain."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if name.endswith(('.gz', '.log', '.txt')):
+                    yield os.path.join(root, name)
+
+
+@timed('flow_logs.analyze_files')
+def analyze_files(paths, src_ips=None, fields=None, processes=None):
+    """Analyzes flow log files in a process pool and merges their counts."""
+    files = list(find_flow_log_files(paths))
+    total = Counter()
+    if not files:
+        return total
+    src_ips = set(src_ips) if src_ips is not None else None
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for counts in executor.map(analyze_file, files, [src_ips] * len(files), [fields] * len(files)):
+            total.update(counts)
+    return total
+
+
+def to_result_rows(counts):
+    """Converts aggregated counts into Insights-style result rows, busiest first."""
+    rows = []
+    for key, count in counts.most_common():
+        row = [{'field': name, 'value': value.decode()} for name, value in zip(RESULT_FIELDS, key)]
+        row.append({'field': 'count(*)', 'value': str(count)})
+        rows.append(row)
+    return rows
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="Aggregate REJECTed flows from exported VPC flow log files.")
+    parser.add_argument('paths', nargs='+', help="Flow log files or directories (plain or .gz)")
+    parser.add_argument('--src_ips', type=str, help="Comma-separated source IPs to keep (default: all)")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--output', type=str, default='vpc_flow_results_offline.csv',
+                        help="Output file (.csv, .jsonl, .parquet or .arrow)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    src_ips = args.src_ips.split(',') if args.src_ips else None
+    counts = analyze_files(args.paths, src_ips, processes=args.processes)
+    rows = to_result_rows(counts)
+
+    write_report(({field['field']: field['value'] for field in row} for row in rows),
+                 args.output, RESULT_FIELDS + ['count(*)'])
+    print(f"{len(rows)} REJECT flow groups written to {args.output}")
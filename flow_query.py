@@ -0,0 +1,75 @@
+import ipaddress
+
+# Insights rejects query strings over 10,000 characters; keep the address
+# filter well under that so the rest of the query always fits.
+MAX_FILTER_CHARS = 6000
+
+
+def collapse_ips(ips):
+    """Collapses IP addresses into the smallest exact set of networks, IPv4 first."""
+    v4, v6 = [], []
+    for ip in ips:
+        try:
+            network = ipaddress.ip_network(ip)
+        except (TypeError, ValueError):
+            continue
+        (v4 if network.version == 4 else v6).append(network)
+    return list(ipaddress.collapse_addresses(v4)) + list(ipaddress.collapse_addresses(v6))
+
+
+def build_ip_filter(networks, field='srcAddr'):
+    """
+    Builds an Insights filter matching field against the given networks.
+
+    Single hosts go into one set membership test and wider networks use
+    isIpv4InSubnet/isIpv6InSubnet, instead of one equality test per address.
+    """
+    hosts = [str(n.network_address) for n in networks if n.num_addresses == 1]
+    subnets = [n for n in networks if n.num_addresses > 1]
+
+    terms = []
+    if hosts:
+        terms.append(f"{field} in [{', '.join(repr(host) for host in hosts)}]")
+    for subnet in subnets:
+        function = 'isIpv4InSubnet' if subnet.version == 4 else 'isIpv6InSubnet'
+        terms.append(f"{function}({field}, '{subnet}')")
+    return " or ".join(terms)
+
+
+def batch_networks(networks, max_filter_chars=MAX_FILTER_CHARS, field='srcAddr'):
+    """Splits networks into batches whose filter text stays under max_filter_chars."""
+    batches = []
+    batch, size = [], 0
+    for network in networks:
+        # Upper bound on what this network adds to the filter text
+        cost = len(str(network)) + len(field) + 30
+        if batch and size + cost > max_filter_chars:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(network)
+        size += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_reject_query(private_ips):
+    """
+    Build the CloudWatch Insights query for REJECTed traffic from the given private IPs.
+    """
+    ip_filter = build_ip_filter(collapse_ips(private_ips))
+
+    return f"""
+        fields @timestamp, @message, @LogStream, @Log
+        | filter ({ip_filter}) and action = 'REJECT' and protocol != -1
+        | sort @timestamp desc
+        | stats count(*) by @timestamp, srcAddr, srcPort, dstAddr, dstPort, protocol
+        """
+
+
+def build_reject_queries(private_ips, max_filter_chars=MAX_FILTER_CHARS):
+    """
+    Build one REJECT query per batch of private IPs, keeping each query's size bounded.
+    """
+    batches = batch_networks(collapse_ips(private_ips), max_filter_chars)
+    return [build_reject_query([str(network) for network in batch]) for batch in batches]
@@ -0,0 +1,459 @@
+import argparse
+import ipaddress
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from flow_log_analyzer import DEFAULT_FIELDS, NO_PROTOCOL, RESULT_FIELDS, KEY_FIELDS, iter_chunks, \
+    _split_header, find_flow_log_files
+from report_writers import write_report
+from instrumentation import timed
+
+try:
+    import numpy as np
+except ImportError:  # the store is array-backed; install the 'fast' extra
+    np = None
+
+# Column name -> dtype; addresses are uint32 until an IPv6 address widens them to (hi, lo) uint64 pairs.
+# At about 38 bytes a row, 50M flow records take under 2 GB.
+COLUMNS = {
+    'srcaddr': 'address', 'dstaddr': 'address', 'srcport': 'uint16', 'dstport': 'uint16', 'protocol': 'uint8',
+    'action': 'uint8', 'start': 'int64', 'count': 'uint32', 'packets': 'uint32', 'bytes': 'uint64',
+}
+METRICS = ['count', 'packets', 'bytes']
+ACTIONS = {'ACCEPT': 1, 'REJECT': 2}  # 0 = unknown
+ACTION_NAMES = {code: name for name, code in ACTIONS.items()}
+# Insights result field -> column
+QUERY_FIELDS = {
+    'srcAddr': 'srcaddr', 'dstAddr': 'dstaddr', 'srcPort': 'srcport', 'dstPort': 'dstport',
+    'protocol': 'protocol', 'action': 'action', '@timestamp': 'start', 'count(*)': 'count',
+    'packets': 'packets', 'bytes': 'bytes',
+}
+OUTPUT_NAMES = {column: field for field, column in QUERY_FIELDS.items() if column not in METRICS}
+BATCH_ROWS = 100000
+FILE_CHUNK_SIZE = 16 * 1024 * 1024  # smaller than the analyzer's: the token lists are transient
+_V4_MAPPED = 0xffff << 32  # ::ffff:0:0/96
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("flow_store needs numpy (pip install 'sgaudit[fast]')")
+
+
+def parse_addresses(values):
+    """
+    Converts IP address strings (or bytes) to a uint32 array, or to an (n, 2)
+    uint64 array of 128-bit (hi, lo) halves when any of them is IPv6.
+    Unparseable values ('-') become 0.0.0.0.
+    """
+    values = np.asarray(values)
+    if not len(values):
+        return np.zeros(0, np.uint32)
+    # Flow logs repeat a few thousand addresses millions of times; parse each once
+    uniques, inverse = np.unique(values, return_inverse=True)
+    parsed = []
+    for value in uniques.tolist():
+        try:
+            parsed.append(ipaddress.ip_address(value.decode() if isinstance(value, bytes) else value))
+        except ValueError:
+            parsed.append(ipaddress.IPv4Address(0))
+    inverse = inverse.reshape(-1)
+    if all(address.version == 4 for address in parsed):
+        return np.array([int(address) for address in parsed], np.uint32)[inverse]
+    wide = np.array([_to_wide(address) for address in parsed], np.uint64).reshape(-1, 2)
+    return wide[inverse]
+
+
+def _to_wide(address):
+    value = int(address) | (_V4_MAPPED if address.version == 4 else 0)
+    return value >> 64, value & 0xffffffffffffffff
+
+
+def widen_addresses(values):
+    """Converts a uint32 IPv4 address array into IPv4-mapped (hi, lo) uint64 pairs."""
+    if values.ndim == 2:
+        return values
+    wide = np.zeros((len(values), 2), np.uint64)
+    wide[:, 1] = values.astype(np.uint64) | np.uint64(_V4_MAPPED)
+    return wide
+
+
+def format_addresses(values):
+    """Converts a parse_addresses array back to strings; IPv4-mapped pairs print as IPv4."""
+    if not len(values):
+        return []
+    uniques, inverse = np.unique(values if values.ndim == 1 else _address_keys(values), return_inverse=True)
+    if values.ndim == 1:
+        text = [str(ipaddress.IPv4Address(value)) for value in uniques.tolist()]
+    else:
+        text = []
+        for hi, lo in uniques.tolist():
+            if hi == 0 and lo >> 32 == 0xffff:
+                text.append(str(ipaddress.IPv4Address(lo & 0xffffffff)))
+            else:
+                text.append(str(ipaddress.IPv6Address(hi << 64 | lo)))
+    return [text[i] for i in inverse.reshape(-1).tolist()]
+
+
+def _parse_ints(values, dtype):
+    values = np.asarray(values)
+    try:
+        return values.astype(dtype)
+    except (TypeError, ValueError):  # '-' placeholders and Nones
+        texts = (value.decode() if isinstance(value, bytes) else str(value) for value in values.tolist())
+        return np.array([int(text) if text.isdigit() else 0 for text in texts], dtype)
+
+
+def _parse_times(values):
+    """Epoch seconds from epoch strings (flow logs) or '2024-01-01 00:00:00.000' timestamps (Insights)."""
+    values = np.asarray(values)
+    if values.dtype.kind in 'SU' and len(values) and not values[0].isdigit():
+        times = values.astype('datetime64[s]')
+        return np.where(np.isnat(times), 0, times.astype(np.int64))
+    return _parse_ints(values, np.int64)
+
+
+def _parse_actions(values):
+    values = np.asarray(values)
+    codes = np.zeros(len(values), np.uint8)
+    for name, code in ACTIONS.items():
+        codes[values == (name.encode() if values.dtype.kind == 'S' else name)] = code
+    return codes
+
+
+class FlowStore:
+    """
+    Columnar store of flow records (or Insights result rows) in NumPy arrays.
+
+    Rows are appended in batches and kept as chunks until a query needs
+    them; group_by then aggregates count/packets/bytes by any key columns
+    and returns the top groups as report rows.
+    """
+
+    def __init__(self, columns=None):
+        _require_numpy()
+        self._chunks = []
+        self._rows = 0
+        if columns is not None:
+            self.add_columns(**columns)
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for chunk in self._chunks for array in chunk.values())
+
+    def add_columns(self, **columns):
+        """Appends rows given as parsed column arrays; missing columns default to 0 (count to 1)."""
+        unknown = set(columns) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown flow store columns: {', '.join(sorted(unknown))}")
+        rows = len(next(iter(columns.values()))) if columns else 0
+        if not rows:
+            return
+        chunk = {}
+        for name, dtype in COLUMNS.items():
+            values = columns.get(name)
+            if values is None:
+                values = np.ones(rows, np.uint32) if name == 'count' else None
+            if values is None:
+                chunk[name] = np.zeros(rows, np.uint32 if dtype == 'address' else dtype)
+            elif dtype == 'address':
+                parsed = isinstance(values, np.ndarray) and values.dtype in (np.uint32, np.uint64)
+                chunk[name] = values if parsed else parse_addresses(values)
+            else:
+                chunk[name] = np.asarray(values, dtype)
+        self._chunks.append(chunk)
+        self._rows += rows
+
+    def extend(self, other):
+        """Appends the rows of another FlowStore."""
+        self._chunks.extend(other._chunks)
+        self._rows += len(other)
+
+    def columns(self):
+        """Returns the store's columns as one array each, merging the appended chunks."""
+        if not self._chunks:
+            return {name: np.zeros(0, np.uint32 if dtype == 'address' else dtype) for name, dtype in COLUMNS.items()}
+        if len(self._chunks) > 1:
+            merged = {}
+            for name, dtype in COLUMNS.items():
+                parts = [chunk.pop(name) for chunk in self._chunks]
+                if dtype == 'address' and any(part.ndim == 2 for part in parts):
+                    parts = [widen_addresses(part) for part in parts]
+                merged[name] = np.concatenate(parts)
+                del parts
+            self._chunks = [merged]
+        return self._chunks[0]
+
+    def add_query_results(self, results, action='REJECT'):
+        """
+        Appends Insights result rows (lists of {'field', 'value'} dicts), in
+        batches of BATCH_ROWS. Fields outside QUERY_FIELDS (enrichment) are
+        not stored; action applies to rows without an action field.
+        """
+        batch = []
+        for row in results:
+            batch.append(row)
+            if len(batch) >= BATCH_ROWS:
+                self._add_result_batch(batch, action)
+                batch = []
+        if batch:
+            self._add_result_batch(batch, action)
+        return self
+
+    def _add_result_batch(self, rows, action):
+        values = {}
+        for i, row in enumerate(rows):
+            for field in row:
+                column = QUERY_FIELDS.get(field['field'])
+                if column is not None:
+                    if column not in values:
+                        # Rows of non-stats queries are one flow record each
+                        values[column] = ['1' if column == 'count' else ''] * len(rows)
+                    values[column][i] = field.get('value') or values[column][i]
+        columns = {}
+        for column, column_values in values.items():
+            dtype = COLUMNS[column]
+            if dtype == 'address':
+                columns[column] = parse_addresses(column_values)
+            elif column == 'start':
+                columns[column] = _parse_times(column_values)
+            elif column == 'action':
+                columns[column] = _parse_actions(column_values)
+            else:
+                columns[column] = _parse_ints(column_values, dtype)
+        if 'action' not in columns and action:
+            columns['action'] = np.full(len(rows), ACTIONS.get(action, 0), np.uint8)
+        self.add_columns(**columns)
+
+    def add_flow_log_file(self, path, fields=None, src_ips=None, actions=None):
+        """
+        Appends the records of one flow log file (plain or .gz, optional header
+        line). NODATA/SKIPDATA records are skipped, and so are records whose
+        srcaddr is not in src_ips or action not in actions, when given.
+        """
+        fields = list(fields or DEFAULT_FIELDS)
+        src_ips = _as_bytes_array(src_ips)
+        actions = _as_bytes_array(actions)
+        first = True
+        for chunk in iter_chunks(path, FILE_CHUNK_SIZE):
+            if first:
+                chunk, fields = _split_header(chunk, fields)
+                first = False
+            self._add_flow_log_chunk(chunk, fields, src_ips, actions)
+        return self
+
+    def _add_flow_log_chunk(self, chunk, fields, src_ips, actions):
+        width = len(fields)
+        tokens = chunk.split()
+        if len(tokens) % width or len(tokens) // width != chunk.count(b'\n') + (not chunk.endswith(b'\n')):
+            # Ragged chunk: keep only the well-formed lines
+            tokens = [token for line in chunk.splitlines() for token in _well_formed(line, width)]
+        if not tokens:
+            return
+        records = np.array(tokens).reshape(-1, width)
+        del tokens
+        protocol = records[:, fields.index('protocol')]
+        keep = ~np.isin(protocol, np.array(NO_PROTOCOL))
+        if actions is not None:
+            keep &= np.isin(records[:, fields.index('action')], actions)
+        if src_ips is not None:
+            keep &= np.isin(records[:, fields.index('srcaddr')], src_ips)
+        records = records[keep]
+        if not len(records):
+            return
+
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            if column not in fields:
+                continue
+            values = records[:, fields.index(column)]
+            if dtype == 'address':
+                columns[column] = parse_addresses(values)
+            elif column == 'action':
+                columns[column] = _parse_actions(values)
+            else:
+                columns[column] = _parse_ints(values, dtype)
+        self.add_columns(**columns)
+
+    def filter(self, action=None, src_ips=None, dst_ips=None, dst_ports=None, protocols=None,
+               start_time=None, end_time=None):
+        """Returns a new FlowStore with the matching rows; times are epoch seconds."""
+        columns = self.columns()
+        mask = np.ones(len(self), bool)
+        if action is not None:
+            mask &= columns['action'] == ACTIONS.get(action, 0)
+        for column, values in (('srcaddr', src_ips), ('dstaddr', dst_ips)):
+            if values is not None:
+                mask &= _isin_addresses(columns[column], parse_addresses(list(values)))
+        if dst_ports is not None:
+            mask &= np.isin(columns['dstport'], np.array(list(dst_ports), np.uint16))
+        if protocols is not None:
+            mask &= np.isin(columns['protocol'], np.array(list(protocols), np.uint8))
+        if start_time is not None:
+            mask &= columns['start'] >= start_time
+        if end_time is not None:
+            mask &= columns['start'] < end_time
+        return FlowStore({name: values[mask] for name, values in columns.items()})
+
+    @timed('flow_store.group_by')
+    def group_by(self, keys, top=None, by='count'):
+        """
+        Aggregates count, packets and bytes per distinct combination of the
+        key columns and returns the groups, largest `by` first (at most top
+        of them), as dicts in the Insights field naming.
+        """
+        columns = self.columns()
+        if not len(self):
+            return []
+        codes = _group_codes([columns[key] for key in keys])
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_codes[1:] != sorted_codes[:-1])))
+        del codes, sorted_codes
+        first_rows = order[starts]
+        totals = {metric: np.add.reduceat(columns[metric][order].astype(np.uint64), starts) for metric in METRICS}
+        del order
+
+        ranking = totals[by]
+        if top is not None and top < len(ranking):
+            selected = np.argpartition(ranking, len(ranking) - top)[len(ranking) - top:]
+        else:
+            selected = np.arange(len(ranking))
+        # Largest first; ties keep key order
+        selected = selected[np.lexsort((selected, -ranking[selected].astype(np.float64)))]
+
+        rows = [{} for _ in range(len(selected))]
+        for key in keys:
+            for row, value in zip(rows, _format_column(key, columns[key][first_rows[selected]])):
+                row[OUTPUT_NAMES.get(key, key)] = value
+        for metric in METRICS:
+            for row, value in zip(rows, totals[metric][selected].tolist()):
+                row[metric] = value
+        return rows
+
+    def top_dst_ports(self, n=10, action='REJECT'):
+        """The n destination port/protocol pairs with the most (REJECTed) flows."""
+        store = self.filter(action=action) if action else self
+        return store.group_by(['dstport', 'protocol'], top=n)
+
+    def top_sources(self, n=10, action='REJECT'):
+        """The n noisiest source addresses by (REJECTed) flow count."""
+        store = self.filter(action=action) if action else self
+        return store.group_by(['srcaddr'], top=n)
+
+    def to_result_rows(self, top=None, keys=KEY_FIELDS):
+        """Groups by keys and returns Insights-style result rows (with count(*)), busiest first."""
+        rows = []
+        for group in self.group_by(keys, top=top):
+            row = [{'field': OUTPUT_NAMES[key], 'value': str(group[OUTPUT_NAMES[key]])} for key in keys]
+            row.append({'field': 'count(*)', 'value': str(group['count'])})
+            rows.append(row)
+        return rows
+
+
+def _well_formed(line, width):
+    parts = line.split()
+    return parts if len(parts) == width else ()
+
+
+def _as_bytes_array(values):
+    if values is None:
+        return None
+    return np.array([value.encode() if isinstance(value, str) else value for value in values])
+
+
+def _isin_addresses(values, wanted):
+    if values.ndim == 1 and wanted.ndim == 1:
+        return np.isin(values, wanted)
+    values, wanted = widen_addresses(values), widen_addresses(wanted)
+    return np.isin(_address_keys(values), _address_keys(wanted))
+
+
+def _address_keys(wide):
+    """One comparable value per 128-bit (hi, lo) address row."""
+    return np.ascontiguousarray(wide).view([('hi', np.uint64), ('lo', np.uint64)]).reshape(-1)
+
+
+def _group_codes(key_columns):
+    """
+    Returns one int64 code per row, equal exactly when all key columns are
+    equal: each column's distinct values are numbered and the numbers combined
+    in mixed radix, renumbered whenever the radix would overflow.
+    """
+    codes, radix = None, 1
+    for values in key_columns:
+        if values.ndim == 2:
+            values = _address_keys(values)
+        distinct, inverse = np.unique(values, return_inverse=True)
+        inverse = inverse.reshape(-1).astype(np.int64)
+        if codes is None:
+            codes, radix = inverse, len(distinct)
+            continue
+        if radix * len(distinct) >= 2 ** 62:
+            distinct_codes, codes = np.unique(codes, return_inverse=True)
+            codes, radix = codes.reshape(-1).astype(np.int64), len(distinct_codes)
+        codes = codes * len(distinct) + inverse
+        radix *= len(distinct)
+    return codes
+
+
+def _format_column(name, values):
+    if COLUMNS[name] == 'address':
+        return format_addresses(values)
+    if name == 'action':
+        return [ACTION_NAMES.get(code, '-') for code in values.tolist()]
+    return values.tolist()
+
+
+def _load_file(path, fields, src_ips, actions):
+    return FlowStore().add_flow_log_file(path, fields, src_ips, actions)
+
+
+@timed('flow_store.load_files')
+def load_flow_log_files(paths, fields=None, src_ips=None, actions=None, processes=None):
+    """Loads flow log files (or directories of them) into one FlowStore, a file per worker task."""
+    store = FlowStore()
+    files = list(find_flow_log_files(paths))
+    if not files:
+        return store
+    load = partial(_load_file, fields=fields, src_ips=src_ips, actions=actions)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for file_store in executor.map(load, files):
+            store.extend(file_store)
+    return store
+
+
+def print_top(title, rows, keys):
+    print(title)
+    for row in rows:
+        volume = f" {row['bytes']:>16,} bytes" if row['bytes'] else ''
+        print(f"  {' '.join(str(row[key]) for key in keys):<45} {row['count']:>12,} flows{volume}")
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="Load flow log files into a columnar store and rank REJECTs.")
+    parser.add_argument('paths', nargs='+', help="Flow log files or directories (plain or .gz)")
+    parser.add_argument('--src_ips', type=str, help="Comma-separated source IPs to keep (default: all)")
+    parser.add_argument('--all_actions', action='store_true', help="Keep ACCEPTed flows too (ranked as well)")
+    parser.add_argument('--top', type=int, default=10, help="Rows per ranking")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Also write the top flow groups (.csv, .jsonl, .parquet or .arrow)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    store = load_flow_log_files(args.paths, src_ips=args.src_ips.split(',') if args.src_ips else None,
+                                actions=None if args.all_actions else ['REJECT'], processes=args.processes)
+    print(f"{len(store):,} flow records in {store.nbytes / 1024 ** 2:,.1f} MB")
+    action = None if args.all_actions else 'REJECT'
+    print_top(f"Top {args.top} destination ports:", store.top_dst_ports(args.top, action), ['dstPort', 'protocol'])
+    print_top(f"Top {args.top} sources:", store.top_sources(args.top, action), ['srcAddr'])
+    if args.output:
+        rows = store.to_result_rows(top=args.top)
+        write_report(({field['field']: field['value'] for field in row} for row in rows),
+                     args.output, RESULT_FIELDS + ['count(*)'])
+        print(f"Top {len(rows)} flow groups written to {args.output}")
@@ -0,0 +1,349 @@
+import argparse
+import gzip
+import json
+import os
+import time
+from collections import Counter, deque
+from flow_log_analyzer import DEFAULT_FIELDS, NO_PROTOCOL
+from report_writers import open_report_writer, detect_format
+
+# Sliding-window key, in the naming of the Insights query output
+WINDOW_KEY_FIELDS = ['srcaddr', 'dstaddr', 'dstport', 'protocol']
+ALERT_FIELDS = ['AlertTime', 'srcAddr', 'dstAddr', 'dstPort', 'protocol', 'Count', 'WindowSeconds']
+ALERT_FORMATS = ('jsonl', 'csv')  # line-oriented, so each flushed alert is readable at once
+DEFAULT_WINDOW = 300  # seconds
+DEFAULT_BUCKET = 5  # seconds per window slot
+DEFAULT_THRESHOLD = 20  # REJECTs per key per window
+MAX_KEYS = 200000
+GET_RECORDS_INTERVAL = 0.2  # Kinesis allows 5 GetRecords calls per second per shard
+MAX_THROTTLE_BACKOFF = 5.0  # seconds
+
+
+class SlidingWindowCounter:
+    """
+    Per-key event counts over the last `window` seconds, kept in fixed-width
+    time buckets so expiring old events costs one Counter subtraction per
+    bucket. At most max_keys keys are tracked; past that the rarest keys are
+    dropped, which can only delay alerts for keys too rare to matter.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, bucket=DEFAULT_BUCKET, max_keys=MAX_KEYS):
+        self.window = window
+        self.bucket = bucket
+        self.max_keys = max_keys
+        self.buckets = deque()  # (bucket start, Counter)
+        self.totals = Counter()
+
+    def advance(self, now):
+        """Expires the buckets that fell out of the window; returns the keys whose counts dropped."""
+        horizon = now - self.window
+        dropped = set()
+        while self.buckets and self.buckets[0][0] + self.bucket <= horizon:
+            _, counts = self.buckets.popleft()
+            self.totals.subtract(counts)
+            dropped.update(counts)
+        for key in dropped:
+            if self.totals[key] <= 0:
+                del self.totals[key]
+        return dropped
+
+    def add(self, key, when, count=1):
+        """
+        Counts key at time when. Returns key's count over the window and the
+        keys evicted to stay within max_keys (usually none).
+        """
+        start = when - when % self.bucket
+        if not self.buckets or self.buckets[-1][0] < start:
+            self.buckets.append((start, Counter()))
+        # Late events land in the newest bucket rather than reopening an old one
+        self.buckets[-1][1][key] += count
+        self.totals[key] += count
+        evicted = self._evict() if len(self.totals) > self.max_keys else []
+        return self.totals.get(key, 0), evicted
+
+    def _evict(self):
+        keep = self.max_keys * 9 // 10
+        evicted = [key for key, _ in self.totals.most_common()[keep:]]
+        for key in evicted:
+            del self.totals[key]
+            for _, counts in self.buckets:
+                counts.pop(key, None)
+        return evicted
+
+    def __len__(self):
+        return len(self.totals)
+
+
+class RejectDetector:
+    """
+    Feeds flow log lines into a SlidingWindowCounter and reports each
+    (srcaddr, dstaddr, dstport, protocol) whose REJECT count reaches
+    threshold within the window. A key alerts once, and can alert again
+    only after its count has fallen back below the threshold.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW, bucket=DEFAULT_BUCKET,
+                 src_ips=None, fields=None, max_keys=MAX_KEYS):
+        self.threshold = threshold
+        self.counter = SlidingWindowCounter(window, bucket, max_keys)
+        self.src_ips = {ip.encode() if isinstance(ip, str) else ip for ip in src_ips} if src_ips else None
+        self.alerted = set()
+        self.now = 0
+        self.set_fields(fields or DEFAULT_FIELDS)
+
+    def set_fields(self, fields):
+        self.fields = list(fields)
+        self._width = len(self.fields)
+        self._key_columns = [self.fields.index(name) for name in WINDOW_KEY_FIELDS]
+        self._src = self.fields.index('srcaddr')
+        self._action = self.fields.index('action')
+        self._protocol = self.fields.index('protocol')
+        self._end = self.fields.index('end') if 'end' in self.fields else None
+
+    def feed(self, line):
+        """Processes one flow log line (bytes or str); returns the alert dicts it triggers."""
+        if isinstance(line, str):
+            line = line.encode()
+        parts = line.split()
+        if len(parts) != self._width:
+            if b'srcaddr' in parts and b'action' in parts:
+                self.set_fields(name.decode() for name in parts)
+            return []
+        if parts[self._action] != b'REJECT' or parts[self._protocol] in NO_PROTOCOL:
+            return []
+        if self.src_ips is not None and parts[self._src] not in self.src_ips:
+            return []
+
+        when = int(parts[self._end]) if self._end is not None and parts[self._end].isdigit() else int(time.time())
+        alerts = []
+        if when > self.now:
+            self.now = when
+            for key in self.counter.advance(when):
+                if key in self.alerted and self.counter.totals.get(key, 0) < self.threshold:
+                    self.alerted.discard(key)
+
+        key = tuple(parts[i] for i in self._key_columns)
+        count, evicted = self.counter.add(key, when)
+        # Evicted keys no longer expire through advance(), so forget their alerts here
+        self.alerted.difference_update(evicted)
+        if count >= self.threshold and key not in self.alerted:
+            self.alerted.add(key)
+            alerts.append(self._alert(key, count, when))
+        return alerts
+
+    def _alert(self, key, count, when):
+        src, dst, port, protocol = (value.decode() for value in key)
+        return {
+            'AlertTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(when)),
+            'srcAddr': src, 'dstAddr': dst, 'dstPort': port, 'protocol': protocol,
+            'Count': count, 'WindowSeconds': self.counter.window
+        }
+
+
+def _open_log(path):
+    f = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    return f, os.fstat(f.fileno()).st_ino if not path.endswith('.gz') else None
+
+
+def tail_files(paths, from_start=False, poll_interval=1.0, follow=True):
+    """
+    Yields lines appended to flow log files, like `tail -F`: truncated or
+    rotated (replaced) files are reopened from their start. With from_start
+    existing content is read first; without follow the files are read once.
+    """
+    handles = {}
+    for path in paths:
+        f, inode = _open_log(path)
+        if not from_start and inode is not None:
+            f.seek(0, os.SEEK_END)
+        handles[path] = [f, inode, b'']
+
+    try:
+        while True:
+            idle = True
+            for path, state in handles.items():
+                f, inode, partial = state
+                data = f.read()
+                if data:
+                    idle = False
+                    lines = (partial + data).split(b'\n')
+                    state[2] = lines.pop()
+                    yield from (line for line in lines if line)
+                    continue
+                if inode is None:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_ino != inode or stat.st_size < f.tell():
+                    f.close()
+                    state[0], state[1] = _open_log(path)
+                    state[2] = b''
+                    idle = False
+            if idle:
+                if not follow:
+                    return
+                time.sleep(poll_interval)
+    finally:
+        for f, _, _ in handles.values():
+            f.close()
+
+
+def decode_subscription_payload(data):
+    """
+    Returns the flow log lines in one CloudWatch Logs subscription payload
+    (gzipped JSON, as delivered to Kinesis); control messages give [].
+    """
+    payload = json.loads(gzip.decompress(data))
+    if payload.get('messageType') != 'DATA_MESSAGE':
+        return []
+    return [event['message'] for event in payload.get('logEvents', [])]
+
+
+def _error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def _list_shard_ids(kinesis_client, stream_name):
+    shard_ids = []
+    for page in kinesis_client.get_paginator('list_shards').paginate(StreamName=stream_name):
+        shard_ids.extend(shard['ShardId'] for shard in page['Shards'])
+    return shard_ids
+
+
+def tail_kinesis(kinesis_client, stream_name, poll_interval=1.0, iterator_type='LATEST'):
+    """
+    Yields flow log lines from a Kinesis stream fed by a Logs subscription filter, shard by shard.
+
+    Each shard is read at most once per GET_RECORDS_INTERVAL. A shard closed
+    by a reshard hands over to its children (from the response's ChildShards,
+    or by listing the shards again), which are read from their start.
+    Throttled reads back off, and expired iterators are renewed after the
+    last record read.
+    """
+    def shard_iterator(shard_id, position, sequence_number=None):
+        kwargs = {'StreamName': stream_name, 'ShardId': shard_id, 'ShardIteratorType': position}
+        if sequence_number:
+            kwargs['StartingSequenceNumber'] = sequence_number
+        return kinesis_client.get_shard_iterator(**kwargs)['ShardIterator']
+
+    known = set(_list_shard_ids(kinesis_client, stream_name))
+    start_types = dict.fromkeys(known, iterator_type)
+    iterators = {shard_id: shard_iterator(shard_id, iterator_type) for shard_id in known}
+    last_sequence = {}
+    backoff = GET_RECORDS_INTERVAL
+    while iterators:
+        started = time.monotonic()
+        idle = True
+        throttled = False
+        for shard_id, iterator in list(iterators.items()):
+            try:
+                response = kinesis_client.get_records(ShardIterator=iterator, Limit=1000)
+            except Exception as e:
+                code = _error_code(e)
+                if code == 'ProvisionedThroughputExceededException':
+                    throttled = True
+                    continue
+                if code != 'ExpiredIteratorException':
+                    raise
+                sequence_number = last_sequence.get(shard_id)
+                if sequence_number:
+                    iterators[shard_id] = shard_iterator(shard_id, 'AFTER_SEQUENCE_NUMBER', sequence_number)
+                else:
+                    iterators[shard_id] = shard_iterator(shard_id, start_types[shard_id])
+                continue
+            for record in response['Records']:
+                idle = False
+                last_sequence[shard_id] = record['SequenceNumber']
+                yield from decode_subscription_payload(record['Data'])
+            next_iterator = response.get('NextShardIterator')
+            if next_iterator:
+                iterators[shard_id] = next_iterator
+                continue
+            # Closed by a reshard: its records now go to its children
+            del iterators[shard_id]
+            children = [child['ShardId'] for child in response.get('ChildShards') or []]
+            for child_id in children or _list_shard_ids(kinesis_client, stream_name):
+                if child_id not in known:
+                    known.add(child_id)
+                    start_types[child_id] = 'TRIM_HORIZON'
+                    iterators[child_id] = shard_iterator(child_id, 'TRIM_HORIZON')
+        if throttled:
+            backoff = min(backoff * 2, MAX_THROTTLE_BACKOFF)
+            time.sleep(backoff)
+            continue
+        backoff = GET_RECORDS_INTERVAL
+        pause = poll_interval if idle else GET_RECORDS_INTERVAL
+        time.sleep(max(pause - (time.monotonic() - started), 0))
+
+
+def run_detector(lines, detector, sinks):
+    """Feeds lines to detector and hands every alert to each sink (a callable taking the alert dict)."""
+    alerts = 0
+    for line in lines:
+        for alert in detector.feed(line):
+            alerts += 1
+            for sink in sinks:
+                sink(alert)
+    return alerts
+
+
+def print_alert(alert):
+    print(f"ALERT {alert['AlertTime']}: {alert['Count']} REJECTs {alert['srcAddr']} -> "
+          f"{alert['dstAddr']}:{alert['dstPort']} proto {alert['protocol']} in {alert['WindowSeconds']}s")
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="Continuously detect bursts of REJECTed VPC flows.")
+    parser.add_argument('paths', nargs='*', help="Flow log files to follow")
+    parser.add_argument('--kinesis_stream', type=str, help="Kinesis stream fed by a flow log subscription filter")
+    parser.add_argument('--region', type=str, default=None, help="AWS region of the Kinesis stream")
+    parser.add_argument('--src_ips', type=str, help="Comma-separated source IPs to watch (default: all)")
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD, help="REJECTs per key per window")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="Window length in seconds")
+    parser.add_argument('--from_start', action='store_true', help="Read existing file content first")
+    parser.add_argument('--alerts', type=str, default='flow_reject_alerts.jsonl',
+                        help="Alert log (.jsonl or .csv), flushed after every alert")
+    parser.add_argument('--notify', action='store_true', help="Email each alert (SG_AUDIT_SMTP_* settings)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    # Parquet and Arrow files are only readable once closed, which a tail never is
+    if detect_format(args.alerts, default=None) not in ALERT_FORMATS:
+        raise SystemExit(f"--alerts must be a .jsonl or .csv file, not {args.alerts}")
+    if args.kinesis_stream:
+        from aws_clients import get_client
+        lines = tail_kinesis(get_client('kinesis', args.region), args.kinesis_stream)
+    elif args.paths:
+        lines = tail_files(args.paths, from_start=args.from_start)
+    else:
+        raise SystemExit("Give flow log files to follow or --kinesis_stream")
+    detector = RejectDetector(args.threshold, args.window,
+                              src_ips=args.src_ips.split(',') if args.src_ips else None)
+
+    notifier = None
+    with open_report_writer(args.alerts, ALERT_FIELDS) as alert_log:
+
+        def log_alert(alert):
+            alert_log.write_row(alert)
+            alert_log.flush()
+
+        sinks = [print_alert, log_alert]
+        if args.notify:
+            from notifier import Notifier
+            notifier = Notifier()
+            sinks.append(lambda alert: notifier.send(
+                f"REJECT burst {alert['srcAddr']} -> {alert['dstAddr']}:{alert['dstPort']}",
+                json.dumps(alert, indent=2)))
+        try:
+            count = run_detector(lines, detector, sinks)
+        except KeyboardInterrupt:
+            count = None
+        finally:
+            if notifier is not None:
+                notifier.close()
+    print(f"Stopped; alerts written to {args.alerts}" if count is None else f"{count} alerts written to {args.alerts}")
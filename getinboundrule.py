@@ -1,68 +1,89 @@
-import boto3
-import csv
+from aws_clients import get_client
+from report_writers import write_report, peek_rows, ReportSourceError
+from sg_rules import iter_rules, iter_security_groups, RULE_ROW_FIELDS
+from rule_snapshots import RuleSnapshotStore, iter_rule_sets, snapshot_scope, DRIFT_FIELDS
 
-# Replace with your desired SG Group IDs
+# Replace with your desired SG Group IDs, or ['all'] to sweep every group
 sg_group_ids = ['sg-0e8395d957c1caa7d']  # Example SG IDs
+vpc_id = None  # Restrict the 'all' sweep to one VPC
 output_file = 'ibound_Sg_rules.csv'
+snapshot_db = 'sg_rule_snapshots.db'  # Versioned rule snapshots for drift checks; None to disable
+drift_file = 'sg_rule_drift.csv'  # Rules added, removed or modified since the previous snapshot
 
-# Initialize Boto3 EC2 client
-ec2 = boto3.client('ec2')
+aws_region = None  # Default region from the AWS config; the EC2 client is created on first use
+
+def iter_sg_rules(sg_ids, vpc_id=None, directions=('Inbound', 'Outbound')):
+    """Yields normalized inbound and egress rules for the given SG group IDs, or for every group with ['all']."""
+    if sg_ids == ['all'] or sg_ids == 'all':
+        sg_ids = None
+    return iter_rules(get_client('ec2', aws_region), sg_ids, vpc_id, directions)
+
+def iter_sg_rule_sets(sg_ids, vpc_id=None):
+    """Yields (group_id, group_name, vpc_id, rules) per SG from one bulk describe_security_groups sweep."""
+    if sg_ids == ['all'] or sg_ids == 'all':
+        sg_ids = None
+    return iter_rule_sets(iter_security_groups(get_client('ec2', aws_region), sg_ids, vpc_id))
+
+def check_drift(sg_ids, vpc_id=None, rule_sets=None, db=None, filename=None):
+    """
+    Store a snapshot of the SGs' rules and write the rules changed since the previous snapshot of the same SGs.
+    Only groups whose rule set digest changed are expanded. Returns the number of changed rules (None on the first run).
+    """
+    all_groups = sg_ids == ['all'] or sg_ids == 'all'
+    scope = snapshot_scope(aws_region, vpc_id, None if all_groups else sg_ids)
+    filename = filename or drift_file
+    with RuleSnapshotStore(db or snapshot_db) as store:
+        snapshot_id = store.save(rule_sets if rule_sets is not None else iter_sg_rule_sets(sg_ids, vpc_id), scope)
+        previous = store.previous(snapshot_id)
+        if previous is None:
+            print(f"Snapshot {snapshot_id} stored; no earlier snapshot of these SGs to compare with")
+            return None
+        count = write_report(store.diff(previous, snapshot_id), filename, DRIFT_FIELDS)
+    print(f"{count} rules changed since snapshot {previous}; drift written to {filename}")
+    return count
+
+def iter_inbound_rules(sg_ids):
+    """Yields inbound rules for the given SG group IDs one at a time."""
+    for rule in iter_sg_rules(sg_ids, directions=('Inbound',)):
+        yield rule.to_row()
 
 def fetch_inbound_rules(sg_ids):
     """Fetches inbound rules for the given SG group IDs."""
     try:
-        response = ec2.describe_security_groups(GroupIds=sg_ids)
-        inbound_rules = []
-        
-        for sg in response['SecurityGroups']:
-            group_id = sg['GroupId']
-            group_name = sg.get('GroupName', '')
-            
-            for permission in sg['IpPermissions']:
-                # Extract protocol, port range, and CIDR blocks
-                protocol = permission.get('IpProtocol', 'N/A')
-                from_port = permission.get('FromPort', 'All')  # 'All' if no port range
-                to_port = permission.get('ToPort', 'All')
-                
-                # Extract CIDR ranges
-                for ip_range in permission.get('IpRanges', []):
-                    cidr = ip_range.get('CidrIp', 'N/A')
-                    description = ip_range.get('Description', 'N/A')
-                    
-                    # Append the extracted data
-                    inbound_rules.append({
-                        'SecurityGroupID': group_id,
-                        'GroupName': group_name,
-                        'Type': 'Inbound',
-                        'Protocol': protocol,
-                        'PortRange': f"{from_port}-{to_port}" if from_port != 'All' else "All",
-                        'SourceCIDR': cidr,
-                        'Description': description
-                    })
-                    
-        return inbound_rules
+        return list(iter_inbound_rules(sg_ids))
     except Exception as e:
         print(f"Error fetching security group rules: {e}")
         return []
 
 def save_to_csv(data, filename):
-    """Saves the inbound rules to a CSV file."""
-    if not data:
+    """
+    Saves the rules (a list or iterator of rows) to a CSV, JSON Lines, Parquet or Arrow file (by extension).
+    The file is only replaced once every row has been fetched and written.
+    """
+    try:
+        first, data = peek_rows(data)
+    except Exception as e:
+        print(f"Error fetching security group rules: {e}")
+        return
+    if first is None:
         print("No data to save.")
         return
-    
+
     try:
-        keys = ['SecurityGroupID', 'GroupName', 'Type', 'Protocol', 'PortRange', 'SourceCIDR', 'Description']
-        with open(filename, 'w', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=keys)
-            writer.writeheader()
-            writer.writerows(data)
-        
+        write_report(data, filename, RULE_ROW_FIELDS)
         print(f"Data successfully saved to {filename}")
+    except ReportSourceError as e:
+        print(f"Error fetching security group rules: {e}; {filename} was left unchanged")
     except Exception as e:
-        print(f"Error saving to CSV: {e}")
+        print(f"Error saving report: {e}")
 
 if __name__ == "__main__":
-    print("Fetching inbound rules for the specified security groups...")
-    inbound_data = fetch_inbound_rules(sg_group_ids)
-    save_to_csv(inbound_data, output_file)
+    print("Fetching inbound and egress rules for the specified security groups...")
+    if snapshot_db:
+        # One sweep feeds both the export and the snapshot
+        rule_sets = list(iter_sg_rule_sets(sg_group_ids, vpc_id))
+        save_to_csv((rule.to_row() for _, _, _, rules in rule_sets for rule in rules), output_file)
+        check_drift(sg_group_ids, vpc_id, rule_sets)
+    else:
+        # Rules stream from the API pages straight into the writer
+        save_to_csv((rule.to_row() for rule in iter_sg_rules(sg_group_ids, vpc_id)), output_file)
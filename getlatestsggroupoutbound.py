@@ -1,76 +1,73 @@
-import boto3
-import csv
 from datetime import datetime, timedelta
-import json
 import sys, os
+from aws_clients import get_client
+from report_writers import write_report, peek_rows
+from cloudtrail_lookup import TokenBucket, iter_lookup_events, LOOKUP_EVENTS_TPS
+from cloudtrail_cache import iter_cached_events
+from cloudtrail_parser import iter_rule_changes, CHANGE_ROW_FIELDS
 
-# Initialize the EC2 client
-ec2_client = boto3.client('ec2', region_name='us-east-1')  # Replace 'your-region' with the appropriate AWS region
+# AWS region; clients are created lazily on first use
+aws_region = 'us-east-1'  # Replace 'your-region' with the appropriate AWS region
 
 # Parent Security Group ID
 security_group_id = 'sg-0e8395d957c1caa7d'  # Replace with your security group ID
 
+# Local CloudTrail event store; set to None to always query the API
+cache_db = 'sg_changes_cache.db'
+
 # Calculate the time range for the last two days
 end_time = datetime.utcnow()
 start_time = end_time - timedelta(days=2)
 
-# Function to get the security group change logs
-def get_security_group_changes():
-    try:
-        # Use the CloudTrail client to filter security group changes
-        cloudtrail_client = boto3.client('cloudtrail', region_name='us-east-1')
+# Function to stream the security group change logs
+def iter_security_group_changes():
+    # Use the CloudTrail client to filter security group changes
+    cloudtrail_client = get_client('cloudtrail', aws_region)
 
-        # Filter events related to security group changes
-        response = cloudtrail_client.lookup_events(
-            LookupAttributes=[
-                {'AttributeKey': 'ResourceName', 'AttributeValue': security_group_id}
-            ],
-            StartTime=start_time,
-            EndTime=end_time
-        )
-
-        events = response['Events']
-        changes = []
+    # Filter events related to security group changes, following every page
+    if cache_db:
+        events = (event for _, event in iter_cached_events(cache_db, cloudtrail_client, [security_group_id], start_time, end_time))
+    else:
+        rate_limiter = TokenBucket(LOOKUP_EVENTS_TPS)
+        events = iter_lookup_events(cloudtrail_client, security_group_id, start_time, end_time, rate_limiter)
 
-        for event in events:
-            event_detail = event['CloudTrailEvent']
-            event_time = event['EventTime']
-            event_name = event['EventName']
-            changes.append({
-                'EventTime': event_time,
-                'EventName': event_name,
-                'Details': event_detail
-            })
-            # Filter for security group details
-            # if 'requestParameters' in  event_detail['requestParameters'] and 'groupId' in event_detail['requestParameters']:
-            #     group_id = event_detail['requestParameters']['groupId']
-            #     if group_id == security_group_id:
-            #         #ip_permissions = event_detail['requestParameters'].get('ipPermissions', {})
-            #         event_group_id= event_detail['requestParameters']['ipPermissions']
-            #         print(event_group_id)
-            #         changes.append({
-            #             'EventTime': event_time,
-            #             'EventName': event_name,
-            #             'GroupId': group_id
-            #             #'IpPermissions': json.dumps(ip_permissions)
-            #         })
+    # One row per rule added, removed or modified; other events are skipped undecoded
+    for rule_change in iter_rule_changes(events):
+        yield rule_change.to_row()
+        # Filter for security group details
+        # if 'requestParameters' in  event_detail['requestParameters'] and 'groupId' in event_detail['requestParameters']:
+        #     group_id = event_detail['requestParameters']['groupId']
+        #     if group_id == security_group_id:
+        #         #ip_permissions = event_detail['requestParameters'].get('ipPermissions', {})
+        #         event_group_id= event_detail['requestParameters']['ipPermissions']
+        #         print(event_group_id)
+        #         changes.append({
+        #             'EventTime': event_time,
+        #             'EventName': event_name,
+        #             'GroupId': group_id
+        #             #'IpPermissions': json.dumps(ip_permissions)
+        #         })
+        
+        # if 'requestParameters' in event_detail and 'ipPermissions' in event_detail['requestParameters']:
+        #     ip_permissions = event_detail['requestParameters']['ipPermissions']['items']
             
-            # if 'requestParameters' in event_detail and 'ipPermissions' in event_detail['requestParameters']:
-            #     ip_permissions = event_detail['requestParameters']['ipPermissions']['items']
-                
-            #     # Iterate through the ipPermissions
-            #     for permission in ip_permissions:
-            #         group_items = permission.get('groups', {}).get('items', [])
-            #         for group in group_items:
-            #             # Append each group's details
-            #             changes.append({
-            #                 "groupId": group.get("groupId"),
-            #                 "description": group.get("description"),
-            #                 "ipProtocol": permission.get("ipProtocol"),
-            #                 "fromPort": permission.get("fromPort"),
-            #                 "toPort": permission.get("toPort")
-            #             })
-        return changes
+        #     # Iterate through the ipPermissions
+        #     for permission in ip_permissions:
+        #         group_items = permission.get('groups', {}).get('items', [])
+        #         for group in group_items:
+        #             # Append each group's details
+        #             changes.append({
+        #                 "groupId": group.get("groupId"),
+        #                 "description": group.get("description"),
+        #                 "ipProtocol": permission.get("ipProtocol"),
+        #                 "fromPort": permission.get("fromPort"),
+        #                 "toPort": permission.get("toPort")
+        #             })
+
+# Function to get the security group change logs
+def get_security_group_changes():
+    try:
+        return list(iter_security_group_changes())
 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -82,18 +79,19 @@ def get_security_group_changes():
 def write_to_csv(changes):
     csv_file = 'outbound_rules_sg.csv'
 
-    with open(csv_file, mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['EventTime', 'EventName', 'Details'])
-        writer.writeheader()
-        writer.writerows(changes)
+    count = write_report(changes, csv_file, CHANGE_ROW_FIELDS)
 
-    print(f"Security group changes have been written to {csv_file}")
+    print(f"{count} security group changes have been written to {csv_file}")
+    return count
 
 # Main execution
 if __name__ == "__main__":
-    changes = get_security_group_changes()
+    try:
+        first, changes = peek_rows(iter_security_group_changes())
 
-    if changes:
-        write_to_csv(changes)
-    else:
-        print("No changes found for the specified security group in the last two days.")
+        if first is not None:
+            write_to_csv(changes)
+        else:
+            print("No changes found for the specified security group in the last two days.")
+    except Exception as e:
+        print(f"Error fetching security group changes: {e}")
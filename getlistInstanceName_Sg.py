@@ -1,5 +1,7 @@
-import boto3
-import csv
+from report_writers import write_report, peek_rows, ReportSourceError
+from fanout import iter_fanout
+from aws_clients import get_client, list_regions, DEFAULT_ROLE_NAME
+from instrumentation import timed
 import sys
 import argparse
 
@@ -9,6 +11,8 @@ import argparse
 
 output_file = 'ec2_instance_sg_details.csv'
 aws_regions = ['us-east-1']  # List of AWS regions to search
+max_workers = 16  # Parallel (account, region) scans
+OUTPUT_MODES = ['per_sg', 'requested', 'instance']
 
 
 def get_arguments():
@@ -20,84 +24,176 @@ def get_arguments():
         required=True, 
         help="Comma-separated list of Security Group IDs (e.g., sg-1234abcd,sg-5678efgh)"
     )
+    parser.add_argument(
+        '--regions',
+        type=str,
+        default=','.join(aws_regions),
+        help="Comma-separated list of regions, or 'all' for every enabled region"
+    )
+    parser.add_argument(
+        '--accounts',
+        type=str,
+        help="Comma-separated list of account IDs to scan by assuming --role_name (default: current account)"
+    )
+    parser.add_argument(
+        '--role_name',
+        type=str,
+        default=DEFAULT_ROLE_NAME,
+        help="Role to assume in each account listed in --accounts"
+    )
+    parser.add_argument(
+        '--output_mode',
+        choices=OUTPUT_MODES,
+        default='per_sg',
+        help="per_sg: one row per attached SG; requested: only rows for --sg_ids; "
+             "instance: one row per instance with its SGs joined by ';'"
+    )
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=max_workers,
+        help="Number of (account, region) pairs scanned in parallel"
+    )
     
     return parser.parse_args()
 
-def get_ec2_instances(sg_ids, regions):
+def resolve_targets(regions, accounts=None, role_name=DEFAULT_ROLE_NAME):
+    """Expands regions ('all' or a list) and accounts into (account_id, region) pairs."""
+    targets = []
+    for account_id in accounts or [None]:
+        account_regions = list_regions(account_id, role_name) if regions == 'all' else regions
+        targets.extend((account_id, region) for region in account_regions)
+    return targets
+
+class InstanceRecord:
+    """Compact view of one EC2 instance: tags parsed once and its attached SGs."""
+
+    __slots__ = ('instance_id', 'private_ip', 'nic_count', 'region', 'account_id', 'tags', 'security_groups')
+
+    def __init__(self, instance, region, account_id='N/A'):
+        self.instance_id = instance.get('InstanceId', 'N/A')
+        self.private_ip = instance.get('PrivateIpAddress', 'N/A')
+        self.nic_count = len(instance.get('NetworkInterfaces', []))
+        self.region = region
+        self.account_id = account_id
+        self.tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+        # SG ID -> SG name, in attachment order
+        self.security_groups = {
+            sg.get('GroupId', 'N/A'): sg.get('GroupName', 'N/A') for sg in instance.get('SecurityGroups', [])
+        }
+
+    @property
+    def name(self):
+        return self.tags.get('Name', 'N/A')
+
+    def _row(self, sg_id, sg_name):
+        return {
+            'InstanceName': self.name,
+            'InstanceID': self.instance_id,
+            'PrivateIPAddress': self.private_ip,
+            'NIC_Count': self.nic_count,
+            'SG_GroupID': sg_id,
+            'SG_GroupName': sg_name,
+            'Region': self.region,
+            'AccountID': self.account_id
+        }
+
+    def rows(self, output_mode='per_sg', sg_ids=None):
+        """
+        Returns the report rows for this instance:
+        per_sg    - one row per attached SG (the original layout)
+        requested - one row per attached SG that is in sg_ids
+        instance  - a single row with the attached SG IDs and names joined by ';'
+        """
+        if output_mode == 'instance':
+            return [self._row(';'.join(self.security_groups), ';'.join(self.security_groups.values()))]
+        if output_mode == 'requested':
+            return [self._row(sg_id, sg_name) for sg_id, sg_name in self.security_groups.items() if sg_id in sg_ids]
+        return [self._row(sg_id, sg_name) for sg_id, sg_name in self.security_groups.items()]
+
+@timed('inventory.region_instances')
+def iter_region_instances(sg_ids, region, account_id=None, role_name=DEFAULT_ROLE_NAME):
+    """Yields an InstanceRecord per instance in the given SG Group IDs in one account and region, page by page."""
+    print(f"Checking region: {region}" + (f" in account {account_id}" if account_id else ""))
+    ec2 = get_client('ec2', region, account_id, role_name)
+
+    # Describe instances with filters for the given SG group IDs
+    paginator = ec2.get_paginator('describe_instances')
+    pages = paginator.paginate(
+        Filters=[
+            {'Name': 'instance.group-id', 'Values': sg_ids}
+        ]
+    )
+
+    for page in pages:
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                yield InstanceRecord(instance, region, reservation.get('OwnerId', account_id or 'N/A'))
+
+def iter_instance_records(sg_ids, regions, accounts=None, role_name=DEFAULT_ROLE_NAME, max_workers=max_workers):
+    """Yields InstanceRecords for the given SG Group IDs across accounts and regions, scanned in parallel."""
+    targets = resolve_targets(regions, accounts, role_name)
+
+    def scan(target):
+        account_id, region = target
+        return iter_region_instances(sg_ids, region, account_id, role_name)
+
+    def describe(target):
+        account_id, region = target
+        return f"region {region}" + (f" in account {account_id}" if account_id else "")
+
+    for _, record in iter_fanout(scan, targets, max_workers=max_workers, describe=describe):
+        yield record
+
+def iter_ec2_instances(sg_ids, regions, accounts=None, role_name=DEFAULT_ROLE_NAME, max_workers=max_workers,
+                       output_mode='per_sg'):
+    """Yields EC2 instance details for the given SG Group IDs across accounts and regions, scanned in parallel."""
+    requested = set(sg_ids)
+    for record in iter_instance_records(sg_ids, regions, accounts, role_name, max_workers):
+        yield from record.rows(output_mode, requested)
+
+def get_ec2_instances(sg_ids, regions, **kwargs):
     """Fetches EC2 instance details for the given SG Group IDs across regions."""
 
     instance_data = []
 
     try:
-        for region in regions:
-            print(f"Checking region: {region}")
-            ec2 = boto3.client('ec2', region_name=region)
-
-            # Describe instances with filters for the given SG group IDs
-            response = ec2.describe_instances(
-                Filters=[
-                    {'Name': 'instance.group-id', 'Values': sg_ids}
-                ]
-            )
-
-            for reservation in response['Reservations']:
-                for instance in reservation['Instances']:
-                    # Extract instance details
-                    instance_id = instance.get('InstanceId', 'N/A')
-                    private_ip = instance.get('PrivateIpAddress', 'N/A')
-                    nic_count = len(instance.get('NetworkInterfaces', []))
-                    region_name = region
-                    
-                    # Extract Security Group Details
-                    security_groups = instance.get('SecurityGroups', [])
-                    for sg in security_groups:
-                        sg_id = sg.get('GroupId', 'N/A')
-                        sg_name = sg.get('GroupName', 'N/A')
-
-                        # Extract instance name from Tags
-                        tags = instance.get('Tags', [])
-                        instance_name = 'N/A'
-                        for tag in tags:
-                            if tag['Key'] == 'Name':
-                                instance_name = tag['Value']
-                                break
-                        
-                        # Append data to the list
-                        instance_data.append({
-                            'InstanceName': instance_name,
-                            'InstanceID': instance_id,
-                            'PrivateIPAddress': private_ip,
-                            'NIC_Count': nic_count,
-                            'SG_GroupID': sg_id,
-                            'SG_GroupName': sg_name,
-                            'Region': region_name
-                        })
-
+        for row in iter_ec2_instances(sg_ids, regions, **kwargs):
+            instance_data.append(row)
     except Exception as e:
         print(f"Error fetching EC2 instance details: {e}")
     
     return instance_data
 
 def save_to_csv(data, filename):
-    """Saves the collected instance data to a CSV file."""
-    if not data:
+    """
+    Saves the collected instance data (a list or iterator) to a CSV, JSON Lines, Parquet or Arrow file (by extension).
+    The file is only replaced once every row has been fetched and written.
+    """
+    try:
+        first, data = peek_rows(data)
+    except Exception as e:
+        print(f"Error fetching EC2 instance details: {e}")
+        return
+    if first is None:
         print("No data to save.")
         return
-    
+
     try:
-        keys = ['InstanceName', 'InstanceID', 'PrivateIPAddress', 'NIC_Count', 'SG_GroupID', 'SG_GroupName', 'Region']
-        with open(filename, 'w', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=keys)
-            writer.writeheader()
-            writer.writerows(data)
-        
+        keys = ['InstanceName', 'InstanceID', 'PrivateIPAddress', 'NIC_Count', 'SG_GroupID', 'SG_GroupName', 'Region', 'AccountID']
+        write_report(data, filename, keys)
         print(f"Data successfully saved to {filename}")
+    except ReportSourceError as e:
+        print(f"Error fetching EC2 instance details: {e}; {filename} was left unchanged")
     except Exception as e:
-        print(f"Error saving to CSV: {e}")
+        print(f"Error saving report: {e}")
 
 if __name__ == "__main__":
     print("Fetching EC2 instances for the specified security groups...")
     args = get_arguments()
     sg_ids = args.sg_ids.split(',')
-    instance_details = get_ec2_instances(sg_ids, aws_regions)
-    save_to_csv(instance_details, output_file)
+    regions = 'all' if args.regions == 'all' else args.regions.split(',')
+    accounts = args.accounts.split(',') if args.accounts else None
+    # Rows stream from the API responses straight into the writer
+    rows = iter_ec2_instances(sg_ids, regions, accounts, args.role_name, args.max_workers, args.output_mode)
+    save_to_csv(rows, output_file)
@@ -0,0 +1,198 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrumentation import span
+
+# Logs Insights allows 30 concurrent queries per account and region by
+# default; leave headroom for other users of the account.
+MAX_CONCURRENT_QUERIES = 20
+QUERY_DEADLINE = 600  # seconds for the whole batch
+INITIAL_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 10
+MAX_QUERY_ROWS = 10000  # Insights never returns more rows than this per query
+
+
+class InsightsQuery:
+    """One Logs Insights query over a log group and time range, plus its outcome."""
+
+    def __init__(self, log_group_name, query_string, start_time, end_time, limit=100):
+        self.log_group_name = log_group_name
+        self.query_string = query_string
+        self.start_time = int(start_time)
+        self.end_time = int(end_time)
+        self.limit = limit
+        self.query_id = None
+        self.status = 'Pending'
+        self.results = []
+        self.statistics = {}
+
+    @property
+    def truncated(self):
+        """True when the query returned as many rows as its limit, so rows may be missing."""
+        return self.status == 'Complete' and len(self.results) >= self.limit
+
+    def split(self):
+        """Returns two queries covering the two halves of this query's time range."""
+        # startTime and endTime are both inclusive, so the halves must not share a second
+        middle = (self.start_time + self.end_time) // 2
+        return [
+            InsightsQuery(self.log_group_name, self.query_string, self.start_time, middle, self.limit),
+            InsightsQuery(self.log_group_name, self.query_string, middle + 1, self.end_time, self.limit)
+        ]
+
+    def __repr__(self):
+        return (f"InsightsQuery({self.log_group_name!r}, {self.start_time}-{self.end_time}, "
+                f"status={self.status!r}, rows={len(self.results)})")
+
+
+def _is_limit_exceeded(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') == 'LimitExceededException'
+
+
+def _run_query(logs_client, query, deadline, initial_poll, max_poll):
+    """Starts query, polls it with exponential backoff and stops it if the deadline passes."""
+    # start_query is rejected while the account is at its concurrency quota
+    with span('insights.start_query'):
+        _start_query(logs_client, query, deadline, initial_poll, max_poll)
+    if query.query_id is None:
+        return query
+
+    with span('insights.wait'):
+        return _wait_for_query(logs_client, query, deadline, initial_poll, max_poll)
+
+
+def _start_query(logs_client, query, deadline, initial_poll, max_poll):
+    """Starts query, backing off while the concurrency quota is exhausted; sets status 'Timeout' at the deadline."""
+    delay = initial_poll
+    while query.query_id is None:
+        if time.monotonic() >= deadline:
+            query.status = 'Timeout'
+            return
+        try:
+            response = logs_client.start_query(
+                logGroupName=query.log_group_name,
+                startTime=query.start_time,
+                endTime=query.end_time,
+                queryString=query.query_string,
+                limit=query.limit
+            )
+            query.query_id = response['queryId']
+        except Exception as e:
+            if not _is_limit_exceeded(e):
+                raise
+            time.sleep(min(delay, max(0, deadline - time.monotonic())))
+            delay = min(delay * 2, max_poll)
+
+
+def _wait_for_query(logs_client, query, deadline, initial_poll, max_poll):
+    """Polls a started query with exponential backoff and stops it if the deadline passes."""
+    delay = initial_poll
+    while True:
+        response = logs_client.get_query_results(queryId=query.query_id)
+        query.status = response['status']
+        if query.status in ('Complete', 'Failed', 'Cancelled', 'Timeout'):
+            query.results = response.get('results', [])
+            query.statistics = response.get('statistics', {})
+            return query
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            try:
+                logs_client.stop_query(queryId=query.query_id)
+            except Exception as e:
+                print(f"Error stopping query {query.query_id}: {e}")
+            query.status = 'Timeout'
+            return query
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_poll)
+
+
+def iter_queries(logs_client, queries, max_concurrent=MAX_CONCURRENT_QUERIES, deadline=QUERY_DEADLINE,
+                 initial_poll=INITIAL_POLL_INTERVAL, max_poll=MAX_POLL_INTERVAL, deadline_at=None):
+    """
+    Runs Insights queries concurrently and yields each one as it finishes.
+
+    At most max_concurrent queries are in flight at once, and every query
+    still running when the shared deadline passes is cancelled with
+    stop_query and reported with status 'Timeout'. deadline is in seconds
+    from now; deadline_at, a time.monotonic() value, overrides it.
+    """
+    queries = list(queries)
+    if not queries:
+        return
+    if deadline_at is None:
+        deadline_at = time.monotonic() + deadline
+    lock = threading.Lock()
+
+    def run(query):
+        try:
+            return _run_query(logs_client, query, deadline_at, initial_poll, max_poll)
+        except Exception as e:
+            with lock:
+                print(f"Error querying log group {query.log_group_name}: {e}")
+            query.status = 'Failed'
+            return query
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrent, len(queries)))) as executor:
+        futures = [executor.submit(run, query) for query in queries]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def run_queries(logs_client, queries, **kwargs):
+    """Runs Insights queries concurrently and returns them once all have finished."""
+    return list(iter_queries(logs_client, queries, **kwargs))
+
+
+def run_split_queries(logs_client, queries, deadline=QUERY_DEADLINE, **kwargs):
+    """
+    Runs queries and recursively bisects the time range of any that hit its row limit.
+
+    Each round of split queries runs concurrently through iter_queries, and
+    all rounds share one deadline, so slices that have not finished when it
+    passes come back with status 'Timeout'. Returns every finished leaf
+    query; a query that is still truncated over a single second cannot be
+    split further and is reported.
+    """
+    kwargs['deadline_at'] = kwargs.get('deadline_at') or time.monotonic() + deadline
+    finished = []
+    pending = list(queries)
+    while pending:
+        next_round = []
+        for query in iter_queries(logs_client, pending, **kwargs):
+            if not query.truncated:
+                finished.append(query)
+            elif query.end_time > query.start_time:
+                next_round.extend(query.split())
+            else:
+                print(f"Warning: {query.log_group_name} still returns {len(query.results)} rows "
+                      f"for the single second {query.start_time}; results are truncated")
+                finished.append(query)
+        if next_round:
+            print(f"Splitting {len(next_round) // 2} truncated queries into {len(next_round)} time slices")
+        pending = next_round
+    return finished
+
+
+def merge_query_results(queries, count_field='count(*)'):
+    """
+    Merges the results of split queries, de-duplicating identical rows.
+
+    Rows carrying count_field (stats queries) are keyed by their other fields
+    and their counts summed; other rows are kept once each.
+    """
+    merged = {}
+    for query in queries:
+        if query.status != 'Complete':
+            continue
+        for row in query.results:
+            key = tuple((field['field'], field.get('value')) for field in row
+                        if field['field'] != count_field)
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = [dict(field) for field in row]
+                continue
+            for field, new_field in zip(existing, row):
+                if field['field'] == count_field:
+                    field['value'] = str(int(field['value']) + int(new_field['value']))
+    return list(merged.values())
@@ -0,0 +1,257 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from functools import wraps
+
+# Set SG_AUDIT_METRICS to a .json or .prom (Prometheus textfile) path to record a run summary.
+# While disabled, spans are a shared no-op object and timed functions add one flag check.
+METRICS_FILE = os.environ.get('SG_AUDIT_METRICS')
+enabled = bool(METRICS_FILE)
+_CO_GENERATOR = 0x20  # inspect.CO_GENERATOR, without importing inspect
+
+_lock = threading.Lock()
+_spans = {}  # name -> [runs, seconds, max seconds, items]
+_api = {}  # (service, operation) -> {'calls': ..., 'attempts': ..., ...}
+_started = time.time()
+_throttle_codes = frozenset()
+_atexit_registered = False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_span(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    """Context manager timing one stage; a no-op unless instrumentation is enabled."""
+    return _Span(name) if enabled else _NULL_SPAN
+
+
+def record_span(name, seconds, items=0):
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        stats[3] += items
+
+
+def _timed_iter(name, iterator):
+    """Re-yields iterator, timing only the time spent producing items (inclusive of nested stages)."""
+    seconds, items = 0.0, 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            items += 1
+            yield item
+    finally:
+        iterator.close()
+        record_span(name, seconds, items)
+
+
+def timed(name):
+    """
+    Decorator recording each call of a function as a span. For generator
+    functions the span covers the time spent producing items, and the
+    number of items is recorded too.
+    """
+    def decorate(func):
+        if func.__code__.co_flags & _CO_GENERATOR:
+            @wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not enabled:
+                    return func(*args, **kwargs)
+                return _timed_iter(name, func(*args, **kwargs))
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _api_stats(service, operation):
+    stats = _api.get((service, operation))
+    if stats is None:
+        stats = _api[(service, operation)] = {
+            'calls': 0, 'attempts': 0, 'throttles': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0
+        }
+    return stats
+
+
+def _before_call(model=None, context=None, **kwargs):
+    if context is not None and model is not None:
+        context['sg_audit_call'] = (model.service_model.service_name, model.name, time.perf_counter())
+
+
+def _finish_call(context, error):
+    started = context.get('sg_audit_call') if context is not None else None
+    if started is None:
+        return
+    service, operation, start = started
+    with _lock:
+        stats = _api_stats(service, operation)
+        stats['calls'] += 1
+        stats['seconds'] += time.perf_counter() - start
+        if error:
+            stats['errors'] += 1
+
+
+def _after_call(context=None, http_response=None, parsed=None, **kwargs):
+    # after-call-error only fires on transport failures; API errors arrive here as HTTP errors
+    status = getattr(http_response, 'status_code', None)
+    _finish_call(context, (status is not None and status >= 300) or bool(parsed and 'Error' in parsed))
+
+
+def _after_call_error(context=None, **kwargs):
+    _finish_call(context, True)
+
+
+def _on_attempt(response=None, operation=None, **kwargs):
+    """needs-retry hook: runs once per HTTP attempt; never alters retries."""
+    if operation is None:
+        return None
+    http_response, parsed = response if response is not None else (None, None)
+    length = 0
+    if http_response is not None:
+        header = http_response.headers.get('content-length')
+        if header and header.isdigit():
+            length = int(header)
+        elif not operation.has_streaming_output:
+            # Non-streaming bodies are already read; streaming ones must not be consumed here
+            length = len(http_response.content or b'')
+    code = parsed.get('Error', {}).get('Code') if parsed else None
+    with _lock:
+        stats = _api_stats(operation.service_model.service_name, operation.name)
+        stats['attempts'] += 1
+        stats['bytes'] += length
+        if code in _throttle_codes:
+            stats['throttles'] += 1
+    return None
+
+
+def instrument_client(client, throttle_codes=()):
+    """Registers the API call, attempt, throttle and byte counters on a botocore client."""
+    global _throttle_codes
+    if not enabled:
+        return
+    _throttle_codes = _throttle_codes | frozenset(throttle_codes)
+    events = client.meta.events
+    events.register('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('after-call-error', _after_call_error)
+    events.register('needs-retry', _on_attempt)
+
+
+def enable(path=None):
+    """Turns instrumentation on; the summary is written to path (or SG_AUDIT_METRICS) at exit."""
+    global enabled, METRICS_FILE, _atexit_registered
+    enabled = True
+    METRICS_FILE = path or METRICS_FILE
+    if METRICS_FILE and not _atexit_registered:
+        atexit.register(write_summary)
+        _atexit_registered = True
+
+
+def summary():
+    """Returns the run summary: stage spans and per-operation API counters."""
+    with _lock:
+        spans = {
+            name: {'runs': runs, 'seconds': round(seconds, 6), 'max_seconds': round(longest, 6), 'items': items}
+            for name, (runs, seconds, longest, items) in sorted(_spans.items())
+        }
+        api = {}
+        for (service, operation), stats in sorted(_api.items()):
+            api[f"{service}.{operation}"] = dict(
+                stats, retries=max(stats['attempts'] - stats['calls'], 0), seconds=round(stats['seconds'], 6)
+            )
+    return {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(_started)),
+        'duration_seconds': round(time.time() - _started, 3),
+        'argv': sys.argv,
+        'spans': spans,
+        'api': api,
+    }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus(data):
+    """Formats a summary() in the Prometheus text exposition format (for the node_exporter textfile collector)."""
+    lines = [
+        '# TYPE sg_audit_run_duration_seconds gauge',
+        f"sg_audit_run_duration_seconds {data['duration_seconds']}",
+    ]
+    span_metrics = [('span_seconds_total', 'seconds'), ('span_runs_total', 'runs'), ('span_items_total', 'items')]
+    for metric, key in span_metrics:
+        lines.append(f"# TYPE sg_audit_{metric} counter")
+        lines.extend(f'sg_audit_{metric}{{span="{_label(name)}"}} {stats[key]}' for name, stats in data['spans'].items())
+    api_metrics = [('api_calls_total', 'calls'), ('api_attempts_total', 'attempts'), ('api_retries_total', 'retries'),
+                   ('api_throttles_total', 'throttles'), ('api_errors_total', 'errors'),
+                   ('api_response_bytes_total', 'bytes'), ('api_seconds_total', 'seconds')]
+    for metric, key in api_metrics:
+        lines.append(f"# TYPE sg_audit_{metric} counter")
+        for name, stats in data['api'].items():
+            service, _, operation = name.partition('.')
+            lines.append(f'sg_audit_{metric}{{service="{_label(service)}",operation="{_label(operation)}"}} {stats[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_summary(path=None):
+    """Writes the run summary as JSON, or as a Prometheus textfile when path ends in .prom."""
+    path = path or METRICS_FILE
+    if not path:
+        return
+    data = summary()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        if path.endswith('.prom'):
+            f.write(to_prometheus(data))
+        else:
+            json.dump(data, f, indent=2, default=str)
+    # Textfile collectors must never see a half-written file
+    os.replace(tmp_path, path)
+
+
+if enabled:
+    enable()
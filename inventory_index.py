@@ -0,0 +1,179 @@
+import json
+import os
+import time
+from instrumentation import timed
+
+# Filter values are capped at 200 per filter in EC2 Describe* calls
+FILTER_BATCH_SIZE = 200
+DEFAULT_TTL = 900  # seconds before the cached inventory is rebuilt
+
+
+class InventoryEntry:
+    """What one private IP belongs to: its ENI, instance, Name tag, SGs and subnet."""
+
+    __slots__ = ('ip', 'eni_id', 'instance_id', 'name', 'sg_ids', 'subnet_id', 'vpc_id')
+
+    def __init__(self, ip, eni_id=None, instance_id=None, name=None, sg_ids=(), subnet_id=None, vpc_id=None):
+        self.ip = ip
+        self.eni_id = eni_id
+        self.instance_id = instance_id
+        self.name = name
+        self.sg_ids = tuple(sg_ids)
+        self.subnet_id = subnet_id
+        self.vpc_id = vpc_id
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def _interface_entries(interface):
+    """Yields an InventoryEntry for every private IPv4 and IPv6 address of an ENI."""
+    attachment = interface.get('Attachment') or {}
+    common = {
+        'eni_id': interface.get('NetworkInterfaceId'),
+        'instance_id': attachment.get('InstanceId'),
+        'sg_ids': [group['GroupId'] for group in interface.get('Groups', [])],
+        'subnet_id': interface.get('SubnetId'),
+        'vpc_id': interface.get('VpcId'),
+    }
+    for address in interface.get('PrivateIpAddresses', []):
+        yield InventoryEntry(address['PrivateIpAddress'], **common)
+    for address in interface.get('Ipv6Addresses', []):
+        yield InventoryEntry(address['Ipv6Address'], **common)
+
+
+class InventoryIndex:
+    """
+    Inverted index from private IP to ENI, instance, Name tag, SGs and subnet.
+
+    Built from one paginated describe_network_interfaces sweep plus one
+    describe_instances sweep for Name tags, cached as JSON at cache_path and
+    rebuilt after ttl seconds. IPs missing from the cache are looked up in
+    batches rather than one API call each.
+    """
+
+    def __init__(self, cache_path='inventory_index.json', ttl=DEFAULT_TTL):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.built_at = 0
+        self.entries = {}
+        self.missing = set()  # IPs already looked up and not found
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, ip):
+        return self.entries.get(ip)
+
+    @property
+    def expired(self):
+        return time.time() - self.built_at > self.ttl
+
+    def load(self):
+        """Loads the cache file; returns False when it is absent or unreadable."""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+            self.built_at = data['built_at']
+            self.entries = {entry['ip']: InventoryEntry.from_dict(entry) for entry in data['entries']}
+            self.missing = set(data.get('missing', []))
+            return True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable inventory cache {self.cache_path}: {e}")
+            return False
+
+    def save(self):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'built_at': self.built_at,
+                'entries': [entry.to_dict() for entry in self.entries.values()],
+                'missing': sorted(self.missing)
+            }, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _instance_names(self, ec2_client, instance_ids=None):
+        """Returns instance ID -> Name tag, for all instances or only instance_ids."""
+        paginator = ec2_client.get_paginator('describe_instances')
+        if instance_ids is None:
+            batches = [{}]
+        else:
+            instance_ids = sorted(instance_ids)
+            batches = [
+                {'Filters': [{'Name': 'instance-id', 'Values': instance_ids[i:i + FILTER_BATCH_SIZE]}]}
+                for i in range(0, len(instance_ids), FILTER_BATCH_SIZE)
+            ]
+        names = {}
+        for kwargs in batches:
+            for page in paginator.paginate(**kwargs):
+                for reservation in page['Reservations']:
+                    for instance in reservation['Instances']:
+                        tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+                        names[instance['InstanceId']] = tags.get('Name', 'N/A')
+        return names
+
+    def _add_interfaces(self, interfaces, names):
+        for interface in interfaces:
+            for entry in _interface_entries(interface):
+                entry.name = names.get(entry.instance_id)
+                self.entries[entry.ip] = entry
+                self.missing.discard(entry.ip)
+
+    @timed('inventory_index.build')
+    def build(self, ec2_client):
+        """Rebuilds the whole index from bulk ENI and instance sweeps and saves it."""
+        names = self._instance_names(ec2_client)
+        self.entries = {}
+        self.missing = set()
+        paginator = ec2_client.get_paginator('describe_network_interfaces')
+        for page in paginator.paginate():
+            self._add_interfaces(page['NetworkInterfaces'], names)
+        self.built_at = time.time()
+        self.save()
+        print(f"Inventory index built: {len(self.entries)} IPs")
+
+    def ensure_fresh(self, ec2_client):
+        """Loads the cache, rebuilding it when it is missing or older than the TTL."""
+        if not self.load() or self.expired:
+            self.build(ec2_client)
+
+    @timed('inventory_index.refresh_missing')
+    def refresh_missing(self, ec2_client, ips):
+        """Looks up IPs not yet in the index with batched ENI queries and merges them in."""
+        unknown = sorted({ip for ip in ips if ip and ip not in self.entries and ip not in self.missing})
+        if not unknown:
+            return 0
+        paginator = ec2_client.get_paginator('describe_network_interfaces')
+        interfaces = []
+        for i in range(0, len(unknown), FILTER_BATCH_SIZE):
+            batch = unknown[i:i + FILTER_BATCH_SIZE]
+            for page in paginator.paginate(Filters=[{'Name': 'addresses.private-ip-address', 'Values': batch}]):
+                interfaces.extend(page['NetworkInterfaces'])
+
+        instance_ids = {(interface.get('Attachment') or {}).get('InstanceId') for interface in interfaces}
+        instance_ids.discard(None)
+        names = self._instance_names(ec2_client, instance_ids) if instance_ids else {}
+        before = len(self.entries)
+        self._add_interfaces(interfaces, names)
+        self.missing.update(ip for ip in unknown if ip not in self.entries)
+        self.save()
+        return len(self.entries) - before
+
+    def enrich(self, row, prefixes=(('src', 'srcAddr'), ('dst', 'dstAddr'))):
+        """Returns a copy of a flow row dict with instance, name, SG and subnet columns per address."""
+        enriched = dict(row)
+        for prefix, field in prefixes:
+            entry = self.entries.get(row.get(field))
+            enriched[f'{prefix}InstanceId'] = entry.instance_id if entry else None
+            enriched[f'{prefix}InstanceName'] = entry.name if entry else None
+            enriched[f'{prefix}SGs'] = ';'.join(entry.sg_ids) if entry else None
+            enriched[f'{prefix}Subnet'] = entry.subnet_id if entry else None
+        return enriched
@@ -1,15 +1,22 @@
-import boto3
-import csv
 import json
 from datetime import datetime, timedelta
+from aws_clients import get_client
+from cloudtrail_lookup import TokenBucket, iter_lookup_events, iter_lookup_events_parallel, LOOKUP_EVENTS_TPS
+from cloudtrail_cache import iter_cached_events
+from cloudtrail_parser import to_change_record
+from cloudtrail_archive import iter_archive_changes, iter_unique_changes
+import sg_state
+from report_writers import write_report, peek_rows
+from instrumentation import timed
 
 # AWS configuration
 aws_region = "us-east-1"  # Update with your AWS region
 parent_sg_ids = ["sg-081eaa2ddb056954c","sg-03dc1e65602297291"]  # Replace with your parent security group IDs
 output_csv = "Modify_security_group_changes.csv"
-
-# Initialize boto3 clients
-cloudtrail_client = boto3.client('cloudtrail', region_name=aws_region)
+max_workers = 4  # Parallel CloudTrail lookups, all sharing the 2 TPS limit
+cache_db = "sg_changes_cache.db"  # Local CloudTrail event store; set to None to always query the API
+archive_paths = None  # Local CloudTrail archive files/dirs to scan instead of calling LookupEvents
+full_state = False  # Fill Before/After State with the group's whole rule set, rebuilt from a snapshot
 
 # Time range (last 24 hours)
 end_time = datetime.utcnow()
@@ -17,100 +24,119 @@ start_time = end_time - timedelta(hours=24)
 
 def get_sg_changes_from_cloudtrail(sg_id):
     """Fetch security group changes from CloudTrail."""
-    response = cloudtrail_client.lookup_events(
-        LookupAttributes=[
-            {"AttributeKey": "ResourceName", "AttributeValue": sg_id}
-        ],
-        StartTime=start_time,
-        EndTime=end_time,
-        MaxResults=50
-    )
+    cloudtrail_client = get_client('cloudtrail', aws_region)
+    if cache_db:
+        events = (event for _, event in iter_cached_events(cache_db, cloudtrail_client, [sg_id], start_time, end_time))
+    else:
+        events = iter_lookup_events(cloudtrail_client, sg_id, start_time, end_time, TokenBucket(LOOKUP_EVENTS_TPS))
     changes = []
-    for event in response.get("Events", []):
-        details = json.loads(event["CloudTrailEvent"])
-        request_params = details.get("requestParameters", {})
-        if request_params:
-            changes.append({
-                "EventTime": event.get("EventTime"),
-                "EventName": event.get("EventName"),
-                "RequestParameters": request_params,
-                "UserIdentity": details.get("userIdentity", {}).get("arn", "N/A"),
-                "SourceIPAddress": details.get("sourceIPAddress", "N/A"),
-            })
+    for event in events:
+        change = to_change_record(event)
+        if change:
+            changes.append(change)
     return changes
 
-def analyze_changes(changes):
-    """Analyze changes and extract before and after states."""
-    analyzed_changes = []
+def iter_sg_changes(sg_ids):
+    """Yields (sg_id, change) pairs for all SGs, fetched in parallel (or scanned from archive_paths)."""
+    if archive_paths:
+        # Archive pairs list a change under its peer groups too; LookupEvents reports it once
+        pairs = iter_archive_changes(archive_paths, sg_ids, start_time, end_time)
+        for change in iter_unique_changes(pairs):
+            yield change["RuleChanges"][0].rule.group_id, change
+        return
+    cloudtrail_client = get_client('cloudtrail', aws_region)
+    if cache_db:
+        events = iter_cached_events(cache_db, cloudtrail_client, sg_ids, start_time, end_time, max_workers)
+    else:
+        events = iter_lookup_events_parallel(cloudtrail_client, sg_ids, start_time, end_time,
+                                             max_workers=max_workers)
+    for sg_id, event in events:
+        change = to_change_record(event)
+        if change:
+            yield sg_id, change
+
+def _rule_state(rule):
+    return {"Port": rule.port_range, "Protocol": rule.protocol, "CIDR": rule.peer}
+
+def _group_state(rules):
+    return [dict(_rule_state(rule), Direction=rule.direction) for rule in rules]
+
+def build_state_index(changes):
+    """Rebuilds every changed group's rule history from a snapshot taken now and the changes."""
+    rule_changes = [rule_change for change in changes for rule_change in change["RuleChanges"]]
+    sg_ids = {rule_change.rule.group_id for rule_change in rule_changes}
+    return sg_state.build_state_index(get_client('ec2', aws_region), sorted(sg_ids), rule_changes)
+
+@timed('changes.analyze')
+def iter_analyzed_changes(changes, state_index=None):
+    """
+    Analyze changes one at a time and yield their before and after states, one row per rule.
+
+    Without state_index the states hold only the changed rule; with a
+    sg_state.SecurityGroupStateIndex they hold the group's whole rule set.
+    """
     for change in changes:
-        event_name = change["EventName"]
-        params = change["RequestParameters"]
-        
-        if event_name in ["AuthorizeSecurityGroupIngress", "RevokeSecurityGroupIngress"]:
-            for permission in params.get("ipPermissions", []):
-                for ip_range in permission.get("ipRanges", []):
-                    cidr = ip_range.get("cidrIp", "N/A")
-                    port = permission.get("fromPort", "N/A")
-                    protocol = permission.get("ipProtocol", "N/A")
-                    if event_name == "AuthorizeSecurityGroupIngress":
-                        analyzed_changes.append({
-                            "EventTime": change["EventTime"],
-                            "EventName": event_name,
-                            "User": change["UserIdentity"],
-                            "CIDR": cidr,
-                            "Port": port,
-                            "Protocol": protocol,
-                            "ChangeType": "Added",
-                            "BeforeState": None,
-                            "AfterState": {"Port": port, "Protocol": protocol, "CIDR": cidr}
-                        })
-                    elif event_name == "RevokeSecurityGroupIngress":
-                        analyzed_changes.append({
-                            "EventTime": change["EventTime"],
-                            "EventName": event_name,
-                            "User": change["UserIdentity"],
-                            "CIDR": cidr,
-                            "Port": port,
-                            "Protocol": protocol,
-                            "ChangeType": "Removed",
-                            "BeforeState": {"Port": port, "Protocol": protocol, "CIDR": cidr},
-                            "AfterState": None
-                        })
-    return analyzed_changes
+        for rule_change in change["RuleChanges"]:
+            rule = rule_change.rule
+            if state_index is not None:
+                before_state = _group_state(state_index.rules_before(rule.group_id, change["EventTime"]))
+                after_state = _group_state(state_index.rules_at(rule.group_id, change["EventTime"]))
+            elif rule_change.change_type == "Removed":
+                before_state, after_state = _rule_state(rule), None
+            else:
+                before_state, after_state = None, _rule_state(rule)
+            yield {
+                "EventTime": change["EventTime"],
+                "EventName": change["EventName"],
+                "User": change["UserIdentity"],
+                "CIDR": rule.peer,
+                "Port": rule.port_range,
+                "Protocol": rule.protocol,
+                "ChangeType": rule_change.change_type,
+                "BeforeState": before_state,
+                "AfterState": after_state,
+                "GroupId": rule.group_id,
+                "Direction": rule.direction,
+                "RuleId": rule_change.rule_id,
+            }
 
-def write_to_csv(events):
-    """Write events to a CSV file."""
-    with open(output_csv, mode='w', newline='') as csv_file:
-        csv_writer = csv.writer(csv_file)
-        # Write the header
-        csv_writer.writerow([
-            "Event Time", "Event Name", "User", "CIDR", "Port", "Protocol",
-            "Change Type", "Before State", "After State"
-        ])
+def analyze_changes(changes, state_index=None):
+    """Analyze changes and extract before and after states."""
+    return list(iter_analyzed_changes(changes, state_index))
+
+REPORT_FIELDS = [
+    "Event Time", "Event Name", "User", "CIDR", "Port", "Protocol",
+    "Change Type", "Before State", "After State", "Security Group", "Direction", "Rule ID"
+]
 
-        for event in events:
-            csv_writer.writerow([
-                event["EventTime"], event["EventName"], event["User"],
-                event["CIDR"], event["Port"], event["Protocol"],
-                event["ChangeType"], json.dumps(event["BeforeState"]),
-                json.dumps(event["AfterState"])
-            ])
+def write_to_csv(events, filename=None):
+    """Write events to the report file (CSV, JSON Lines, Parquet or Arrow by extension)."""
+    rows = (
+        dict(zip(REPORT_FIELDS, [
+            event["EventTime"], event["EventName"], event["User"],
+            event["CIDR"], event["Port"], event["Protocol"],
+            event["ChangeType"], json.dumps(event["BeforeState"]),
+            json.dumps(event["AfterState"]), event["GroupId"],
+            event["Direction"], event["RuleId"]
+        ]))
+        for event in events
+    )
+    return write_report(rows, filename or output_csv, REPORT_FIELDS)
 
 if __name__ == "__main__":
-    all_changes = []
-    for sg_id in parent_sg_ids:
-        print(f"Fetching changes from CloudTrail for Security Group: {sg_id}...")
-        changes = get_sg_changes_from_cloudtrail(sg_id)
-        if changes:
-            print(f"Analyzing changes for Security Group: {sg_id}...")
-            analyzed_changes = analyze_changes(changes)
-            print("analyis logs")
-            print(analyze_changes)
-            all_changes.extend(analyzed_changes)
+    print(f"Fetching changes from CloudTrail for Security Groups: {', '.join(parent_sg_ids)}...")
+    # Changes stream from the CloudTrail pages through analysis into the writer
+    changes = (change for sg_id, change in iter_sg_changes(parent_sg_ids))
+    state_index = None
+    if full_state:
+        # The state index needs every change before the first row can be written
+        changes = list(changes)
+        state_index = build_state_index(changes)
+    first, analyzed_changes = peek_rows(iter_analyzed_changes(changes, state_index))
 
-    if all_changes:
+    if first is not None:
         print(f"Generating CSV report...")
-        write_to_csv(all_changes)
-        print(f"CSV report generated: {output_csv}")
+        count = write_to_csv(analyzed_changes)
+        print(f"CSV report generated: {output_csv} ({count} changes)")
     else:
         print("No changes detected for the provided Security Groups.")
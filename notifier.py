@@ -0,0 +1,156 @@
+import gzip
+import os
+import queue
+import smtplib
+import threading
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+# Mail settings come from the environment; nothing secret lives in the scripts.
+# For a local stand-in: python -m aiosmtpd -n -l localhost:8025 with
+# SG_AUDIT_SMTP_HOST=localhost SG_AUDIT_SMTP_PORT=8025 SG_AUDIT_SMTP_STARTTLS=0
+SMTP_HOST = os.environ.get('SG_AUDIT_SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SG_AUDIT_SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SG_AUDIT_SMTP_STARTTLS', '1') != '0'
+SMTP_USER = os.environ.get('SG_AUDIT_SMTP_USER')
+SMTP_PASSWORD = os.environ.get('SG_AUDIT_SMTP_PASSWORD')  # an App Password when 2FA is enabled
+MAIL_FROM = os.environ.get('SG_AUDIT_MAIL_FROM', SMTP_USER)
+MAIL_TO = [address for address in os.environ.get('SG_AUDIT_MAIL_TO', '').split(',') if address]
+# Attachments larger than this are sent gzip-compressed
+COMPRESS_OVER = int(os.environ.get('SG_AUDIT_MAIL_COMPRESS_OVER', str(1024 * 1024)))
+DIGEST_PREVIEW_ROWS = 20
+_STOP = object()
+
+
+def build_message(sender, recipients, subject, body, attachments=(), compress_over=COMPRESS_OVER):
+    """Builds a MIME message with the given files attached, gzipping those over compress_over bytes."""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = ', '.join(recipients)
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    for path in attachments:
+        if not path or not os.path.exists(path):
+            print(f"Attachment not found or path is invalid: {path}")
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        filename = os.path.basename(path)
+        if compress_over is not None and len(data) > compress_over:
+            data, filename = gzip.compress(data), f"{filename}.gz"
+        msg.attach(MIMEApplication(data, Name=filename))
+        msg.get_payload()[-1]['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return msg
+
+
+class Notifier:
+    """
+    Sends mail from a background thread over one reused SMTP connection.
+
+    send() only queues the message, so callers never wait on the mail
+    server; close() (or leaving the with block) flushes the queue and
+    logs out. A dropped connection is reopened once per message.
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None, sender=None, recipients=None,
+                 starttls=None, compress_over=COMPRESS_OVER, timeout=30):
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.username = username if username is not None else SMTP_USER
+        self.password = password if password is not None else SMTP_PASSWORD
+        self.sender = sender or MAIL_FROM or self.username
+        self.recipients = list(recipients or MAIL_TO)
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.compress_over = compress_over
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self._server = None
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def _deliver(self, msg):
+        for attempt in range(2):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                if attempt:
+                    raise
+
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            try:
+                if msg is _STOP:
+                    return
+                self._deliver(msg)
+                self.sent += 1
+                print(f"Email sent successfully: {msg['Subject']}")
+            except Exception as e:
+                self.failed += 1
+                print(f"Failed to send email: {e}")
+            finally:
+                self._queue.task_done()
+
+    def send(self, subject, body, attachments=()):
+        """Queues one message to the configured recipients."""
+        if not self.recipients:
+            print("No email recipients configured (SG_AUDIT_MAIL_TO); skipping notification.")
+            return
+        msg = build_message(self.sender, self.recipients, subject, body, attachments, self.compress_over)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+            self._thread.start()
+        self._queue.put(msg)
+
+    def close(self):
+        """Waits for queued messages to be sent, then closes the SMTP connection."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except smtplib.SMTPException:
+                pass
+            self._server = None
+
+
+def format_digest(title, rows, fields, preview_rows=DIGEST_PREVIEW_ROWS):
+    """Returns a plain-text digest: a count line plus the first preview_rows rows."""
+    lines = [f"{title}: {len(rows)} results", ""]
+    for row in rows[:preview_rows]:
+        lines.append('  ' + ', '.join(f"{field}={row.get(field)}" for field in fields if row.get(field) is not None))
+    if len(rows) > preview_rows:
+        lines.append(f"  ... {len(rows) - preview_rows} more in the attachment")
+    return '\n'.join(lines)
+
+
+def send_digest(title, rows, fields, attachments=(), notifier=None):
+    """Sends one digest mail for rows, through notifier or a one-off Notifier from the environment."""
+    body = format_digest(title, rows, fields)
+    if notifier is not None:
+        notifier.send(title, body, attachments)
+        return
+    with Notifier() as one_off:
+        one_off.send(title, body, attachments)
@@ -0,0 +1,199 @@
+import csv
+import itertools
+import json
+import os
+from instrumentation import timed
+
+FORMATS = ['csv', 'jsonl', 'parquet', 'arrow']
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+}
+BATCH_SIZE = 65536  # rows per Parquet row group / Arrow record batch
+
+
+def detect_format(filename, default='csv'):
+    """Returns the output format implied by filename's extension."""
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower(), default)
+
+
+def _to_text(value):
+    """Renders a value the way csv.DictWriter would, but JSON-encodes containers."""
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+class ReportWriter:
+    """Base class for streaming report writers; rows are dicts keyed by fieldnames."""
+
+    def __init__(self, filename, fieldnames):
+        self.filename = filename
+        self.fieldnames = list(fieldnames)
+        self.row_count = 0
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def write_row(self, row):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvReportWriter(ReportWriter):
+    def __init__(self, filename, fieldnames):
+        super().__init__(filename, fieldnames)
+        self._file = open(filename, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write_row(self, row):
+        self._writer.writerow(row)
+        self.row_count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonLinesReportWriter(ReportWriter):
+    def __init__(self, filename, fieldnames):
+        super().__init__(filename, fieldnames)
+        self._file = open(filename, 'w')
+
+    def write_row(self, row):
+        record = {name: row.get(name) for name in self.fieldnames}
+        self._file.write(json.dumps(record, default=str))
+        self._file.write('\n')
+        self.row_count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowReportWriter(ReportWriter):
+    """
+    Writes Parquet or Arrow IPC files in batches of batch_size rows.
+
+    Parquet columns are dictionary-encoded strings, which keeps repeated
+    values such as SG IDs, regions and protocols small on disk. Arrow IPC
+    files cannot replace a dictionary between batches, so they get plain
+    string columns.
+    """
+
+    def __init__(self, filename, fieldnames, fmt='parquet', batch_size=BATCH_SIZE):
+        # pyarrow is optional and slow to import, so only load it when it is needed
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc as pa_ipc
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(f"pyarrow is required to write {fmt} reports")
+        super().__init__(filename, fieldnames)
+        self._pa = pa
+        self.batch_size = batch_size
+        self._dictionary = fmt == 'parquet'
+        column_type = pa.dictionary(pa.int32(), pa.string()) if self._dictionary else pa.string()
+        self.schema = pa.schema([(name, column_type) for name in self.fieldnames])
+        if fmt == 'parquet':
+            self._writer = pq.ParquetWriter(filename, self.schema, use_dictionary=True, compression='zstd')
+        else:
+            self._writer = pa_ipc.new_file(filename, self.schema)
+        self._columns = {name: [] for name in self.fieldnames}
+
+    def write_row(self, row):
+        for name, column in self._columns.items():
+            column.append(_to_text(row.get(name)))
+        self.row_count += 1
+        if len(self._columns[self.fieldnames[0]]) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._columns[self.fieldnames[0]]:
+            return
+        pa = self._pa
+        arrays = [pa.array(self._columns[name], type=pa.string()) for name in self.fieldnames]
+        if self._dictionary:
+            arrays = [array.dictionary_encode() for array in arrays]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._columns = {name: [] for name in self.fieldnames}
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_report_writer(filename, fieldnames, fmt=None, batch_size=BATCH_SIZE):
+    """Opens a streaming writer for filename, picking the format from its extension unless fmt is given."""
+    fmt = fmt or detect_format(filename)
+    if fmt == 'csv':
+        return CsvReportWriter(filename, fieldnames)
+    if fmt == 'jsonl':
+        return JsonLinesReportWriter(filename, fieldnames)
+    if fmt in ('parquet', 'arrow'):
+        return ArrowReportWriter(filename, fieldnames, fmt=fmt, batch_size=batch_size)
+    raise ValueError(f"Unsupported report format: {fmt} (expected one of {', '.join(FORMATS)})")
+
+
+def peek_rows(rows):
+    """Returns (first_row, rows) with rows still yielding first_row; first_row is None when empty."""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return None, iter(())
+    return first, itertools.chain([first], rows)
+
+
+class ReportSourceError(Exception):
+    """Raised by write_report when producing the rows (e.g. the API calls behind them) failed."""
+
+
+def _source_rows(rows):
+    try:
+        yield from rows
+    except Exception as e:
+        raise ReportSourceError(str(e)) from e
+
+
+@timed('report.write')
+def write_report(rows, filename, fieldnames, fmt=None):
+    """
+    Writes rows (an iterable of dicts) to filename and returns the number written.
+
+    Rows go to filename + '.tmp', which only replaces filename once every
+    row is written, so a failure midway never leaves a truncated report in
+    place of the last complete one.
+    """
+    tmp_filename = filename + '.tmp'
+    try:
+        with open_report_writer(tmp_filename, fieldnames, fmt or detect_format(filename)) as writer:
+            writer.write_rows(_source_rows(rows))
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename, filename)
+    return writer.row_count
@@ -0,0 +1,270 @@
+import argparse
+import csv
+import ipaddress
+from collections import defaultdict
+from report_writers import write_report
+from sg_rules import (
+    SecurityGroupRule, PEER_CIDR, PEER_CIDR_IPV6, PEER_PREFIX_LIST, PEER_SECURITY_GROUP
+)
+
+# Flow logs report IANA protocol numbers, SG rules mostly use names
+PROTOCOL_NUMBERS = {'tcp': '6', 'udp': '17', 'icmp': '1', 'icmpv6': '58', '-1': '-1'}
+ALL_PORTS = (0, 65535)
+
+
+def protocol_number(protocol):
+    """Returns the IANA protocol number (as a string) for a rule or flow protocol."""
+    protocol = str(protocol).lower()
+    return PROTOCOL_NUMBERS.get(protocol, protocol)
+
+
+class PortIntervalTree:
+    """Static centered interval tree over inclusive (low, high, value) port ranges."""
+
+    __slots__ = ('center', 'by_low', 'by_high', 'left', 'right')
+
+    def __init__(self, intervals):
+        lows = sorted(interval[0] for interval in intervals)
+        self.center = lows[len(lows) // 2]
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_low = sorted(here, key=lambda interval: interval[0])
+        self.by_high = sorted(here, key=lambda interval: interval[1], reverse=True)
+        self.left = PortIntervalTree(left) if left else None
+        self.right = PortIntervalTree(right) if right else None
+
+    def stab(self, point):
+        """Yields the values of every interval containing point."""
+        node = self
+        while node is not None:
+            if point < node.center:
+                for low, _, value in node.by_low:
+                    if low > point:
+                        break
+                    yield value
+                node = node.left
+            else:
+                for _, high, value in node.by_high:
+                    if high < point:
+                        break
+                    yield value
+                node = node.right if point > node.center else None
+
+
+class _PortRangeSet:
+    """Per-protocol port ranges collected while building, frozen into interval trees."""
+
+    __slots__ = ('pending', 'trees')
+
+    def __init__(self):
+        self.pending = defaultdict(list)
+        self.trees = None
+
+    def add(self, protocol, low, high, rule):
+        self.pending[protocol].append((low, high, rule))
+
+    def freeze(self):
+        self.trees = {protocol: PortIntervalTree(intervals) for protocol, intervals in self.pending.items()}
+        self.pending = None
+
+    def match(self, protocol, port):
+        for key in (protocol, '-1') if protocol != '-1' else ('-1',):
+            tree = self.trees.get(key)
+            if tree is not None:
+                yield from tree.stab(port)
+
+
+class CidrTrie:
+    """Binary radix trie over CIDR prefixes; a lookup walks at most 32 (or 128) bits."""
+
+    def __init__(self, max_bits):
+        self.max_bits = max_bits
+        self.root = [None, None, None]  # [zero child, one child, payload]
+
+    def payload(self, network, factory):
+        """Returns the payload stored at network, creating it with factory() if needed."""
+        node = self.root
+        bits = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (bits >> (self.max_bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            node[2] = factory()
+        return node[2]
+
+    def iter_payloads(self, address=None):
+        """Yields payloads of every prefix containing address, or of all prefixes when address is None."""
+        if address is None:
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node[2] is not None:
+                    yield node[2]
+                stack.extend(child for child in node[:2] if child is not None)
+            return
+        node = self.root
+        bits = int(address)
+        for i in range(self.max_bits + 1):
+            if node[2] is not None:
+                yield node[2]
+            if i == self.max_bits:
+                break
+            node = node[(bits >> (self.max_bits - 1 - i)) & 1]
+            if node is None:
+                break
+
+
+class RuleIndex:
+    """
+    Index over normalized SG rules of one direction for fast flow matching.
+
+    Peers are stored in CIDR tries (IPv4/IPv6) or by referenced SG ID, and
+    each peer holds per-protocol port interval trees, so a flow lookup costs
+    one trie walk plus logarithmic interval stabs.
+    """
+
+    def __init__(self, rules, direction='Inbound', prefix_lists=None):
+        self.direction = direction
+        self.tries = {4: CidrTrie(32), 6: CidrTrie(128)}
+        self.by_sg = defaultdict(_PortRangeSet)
+        self.rule_count = 0
+        self.unresolved = []
+
+        for rule in rules:
+            if rule.direction != direction:
+                continue
+            if rule.peer_type == PEER_SECURITY_GROUP:
+                self._add(self.by_sg[rule.peer], rule)
+            elif rule.peer_type in (PEER_CIDR, PEER_CIDR_IPV6):
+                self._add_cidr(rule.peer, rule)
+            elif rule.peer_type == PEER_PREFIX_LIST and prefix_lists and rule.peer in prefix_lists:
+                for cidr in prefix_lists[rule.peer]:
+                    self._add_cidr(cidr, rule)
+            else:
+                self.unresolved.append(rule)
+
+        for trie in self.tries.values():
+            for ranges in trie.iter_payloads():
+                ranges.freeze()
+        for ranges in self.by_sg.values():
+            ranges.freeze()
+
+    def _add_cidr(self, cidr, rule):
+        network = ipaddress.ip_network(cidr, strict=False)
+        self._add(self.tries[network.version].payload(network, _PortRangeSet), rule)
+
+    def _add(self, ranges, rule):
+        protocol = protocol_number(rule.protocol)
+        # ICMP rules carry type/code rather than ports, which flow logs don't record
+        if rule.from_port is None or protocol in ('1', '58'):
+            low, high = ALL_PORTS
+        else:
+            low, high = rule.from_port, rule.to_port
+        ranges.add(protocol, low, high, rule)
+        self.rule_count += 1
+
+    def match(self, src, dst, port, protocol, src_sgs=(), dst_sgs=None):
+        """
+        Returns the rules that allow a flow.
+
+        For an Inbound index the peer is matched against src (or src_sgs for SG
+        references) and, when dst_sgs is given, only rules of dst's groups count;
+        an Outbound index swaps the roles of the two ends.
+        """
+        if self.direction == 'Inbound':
+            peer_address, peer_sgs, owner_sgs = src, src_sgs, dst_sgs
+        else:
+            peer_address, peer_sgs, owner_sgs = dst, dst_sgs or (), src_sgs or None
+        protocol = protocol_number(protocol)
+        port = int(port) if port not in (None, '', '-') else 0
+
+        matches = []
+        address = ipaddress.ip_address(peer_address)
+        for ranges in self.tries[address.version].iter_payloads(address):
+            matches.extend(ranges.match(protocol, port))
+        for sg_id in peer_sgs:
+            ranges = self.by_sg.get(sg_id)
+            if ranges is not None:
+                matches.extend(ranges.match(protocol, port))
+
+        if owner_sgs is not None:
+            matches = [rule for rule in matches if rule.group_id in owner_sgs]
+        return matches
+
+
+def _lookup_sgs(ip_to_sgs, ip):
+    if ip_to_sgs is None:
+        return None
+    if callable(ip_to_sgs):
+        return ip_to_sgs(ip)
+    return ip_to_sgs.get(ip, ())
+
+
+def annotate_flows(rows, index, ip_to_sgs=None):
+    """
+    Yields flow rows (dicts with srcAddr, dstAddr, dstPort, protocol) with
+    Verdict ('allowed by' / 'not allowed by') and AllowedBy columns added.
+
+    ip_to_sgs maps an IP to its SG IDs (dict or callable); without it the
+    destination's groups are unknown and any rule matching the flow counts.
+    """
+    for row in rows:
+        src, dst = row['srcAddr'], row['dstAddr']
+        src_sgs = _lookup_sgs(ip_to_sgs, src) or ()
+        dst_sgs = _lookup_sgs(ip_to_sgs, dst)
+        try:
+            rules = index.match(src, dst, row.get('dstPort'), row.get('protocol'), src_sgs, dst_sgs)
+        except ValueError:
+            rules = []
+        annotated = dict(row)
+        annotated['Verdict'] = 'allowed by' if rules else 'not allowed by'
+        annotated['AllowedBy'] = ';'.join(sorted({
+            f"{rule.group_id}:{rule.protocol}:{rule.port_range}:{rule.peer}" for rule in rules
+        }))
+        yield annotated
+
+
+def load_rules_csv(filename):
+    """Loads normalized rules from a getinboundrule.py report."""
+    with open(filename, newline='') as csvfile:
+        return [SecurityGroupRule.from_row(row) for row in csv.DictReader(csvfile)]
+
+
+def load_ip_to_sgs_csv(filename):
+    """Loads IP -> SG IDs from a getlistInstanceName_Sg.py report."""
+    ip_to_sgs = defaultdict(set)
+    with open(filename, newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            ip_to_sgs[row['PrivateIPAddress']].update(row['SG_GroupID'].split(';'))
+    return ip_to_sgs
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="Annotate REJECTed flows with the SG rules that allow them.")
+    parser.add_argument('--rules', required=True, help="Rules report written by getinboundrule.py")
+    parser.add_argument('--flows', required=True, help="Flow results CSV (srcAddr, dstAddr, dstPort, protocol)")
+    parser.add_argument('--instances', help="Instance report from getlistInstanceName_Sg.py for IP -> SG lookups")
+    parser.add_argument('--output', default='vpc_flow_results_annotated.csv', help="Output file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    index = RuleIndex(load_rules_csv(args.rules))
+    ip_to_sgs = load_ip_to_sgs_csv(args.instances) if args.instances else None
+    print(f"Indexed {index.rule_count} inbound rules ({len(index.unresolved)} unresolved prefix-list rules)")
+
+    with open(args.flows, newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        fieldnames = reader.fieldnames + ['Verdict', 'AllowedBy']
+        count = write_report(annotate_flows(reader, index, ip_to_sgs), args.output, fieldnames)
+    print(f"{count} flows annotated in {args.output}")
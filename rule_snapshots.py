@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+from instrumentation import timed
+from report_writers import write_report
+from sg_rules import SecurityGroupRule, RULE_ROW_FIELDS, iter_group_rules
+
+DRIFT_FIELDS = ['ChangeType'] + RULE_ROW_FIELDS + ['PreviousProtocol', 'PreviousPortRange', 'PreviousDescription']
+# Rule fields that make up a rule set's content (group ID, name and VPC are kept in the manifest)
+RULE_CONTENT = ('direction', 'protocol', 'from_port', 'to_port', 'peer_type', 'peer', 'description')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rule_sets (
+    digest TEXT PRIMARY KEY,
+    rules TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS manifests (
+    digest TEXT PRIMARY KEY,
+    groups TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    scope TEXT NOT NULL,
+    manifest TEXT NOT NULL REFERENCES manifests (digest),
+    group_count INTEGER NOT NULL,
+    rule_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_scope ON snapshots (scope, snapshot_id);
+"""
+
+
+def _digest(payload):
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def canonical_rules(rules):
+    """Returns the rule set's canonical JSON: sorted content tuples, so equal sets hash equally."""
+    content = sorted(
+        [['' if value is None else value for value in (getattr(rule, name) for name in RULE_CONTENT)]
+         for rule in rules],
+        key=lambda values: [str(value) for value in values]
+    )
+    return json.dumps(content, separators=(',', ':'))
+
+
+def _load_rules(payload, group_id, group_name, vpc_id):
+    rules = []
+    for direction, protocol, from_port, to_port, peer_type, peer, description in json.loads(payload):
+        rules.append(SecurityGroupRule(group_id, group_name, vpc_id, direction, protocol,
+                                       None if from_port == '' else from_port, None if to_port == '' else to_port,
+                                       peer_type, peer, description))
+    return rules
+
+
+def iter_rule_sets(security_groups):
+    """Yields (group_id, group_name, vpc_id, rules) for describe_security_groups entries."""
+    for sg in security_groups:
+        yield sg['GroupId'], sg.get('GroupName', ''), sg.get('VpcId'), list(iter_group_rules(sg))
+
+
+def diff_rule_sets(old_rules, new_rules):
+    """
+    Yields (change_type, old_rule, new_rule). Rules equal in content are
+    unchanged; a removed and an added rule with the same direction and peer
+    pair up as 'Modified' (ports, protocol or description changed); the
+    rest are 'Added' or 'Removed'.
+    """
+    old_by_content = {canonical_rules([rule]): rule for rule in old_rules}
+    new_by_content = {canonical_rules([rule]): rule for rule in new_rules}
+    removed = [old_by_content[key] for key in sorted(set(old_by_content) - set(new_by_content))]
+    added = [new_by_content[key] for key in sorted(set(new_by_content) - set(old_by_content))]
+
+    candidates = {}
+    for rule in added:
+        candidates.setdefault((rule.direction, rule.peer_type, rule.peer), []).append(rule)
+    for rule in removed:
+        matches = candidates.get((rule.direction, rule.peer_type, rule.peer))
+        if matches:
+            yield 'Modified', rule, matches.pop(0)
+        else:
+            yield 'Removed', rule, None
+    for matches in candidates.values():
+        for rule in matches:
+            yield 'Added', None, rule
+
+
+def drift_row(change_type, old_rule, new_rule):
+    row = (new_rule or old_rule).to_row()
+    row['ChangeType'] = change_type
+    if change_type == 'Modified':
+        row['PreviousProtocol'] = old_rule.protocol
+        row['PreviousPortRange'] = old_rule.port_range
+        row['PreviousDescription'] = old_rule.description
+    return row
+
+
+class RuleSnapshotStore:
+    """
+    Versioned, content-addressed snapshots of SG rule sets in SQLite.
+
+    Each group's normalized rule set is stored once under its SHA-256
+    digest; a snapshot is a manifest of group -> (digest, name, VPC), itself
+    stored under its digest, so an unchanged nightly snapshot adds one row.
+    Diffs compare manifest digests, then group digests, and only load the
+    rule sets of the groups whose digest changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @timed('rule_snapshots.save')
+    def save(self, rule_sets, scope='', created=None):
+        """Stores (group_id, group_name, vpc_id, rules) tuples as a new snapshot; returns its ID."""
+        groups = {}
+        new_rule_sets = {}
+        rule_count = 0
+        for group_id, group_name, vpc_id, rules in rule_sets:
+            payload = canonical_rules(rules)
+            digest = _digest(payload)
+            new_rule_sets[digest] = payload
+            groups[group_id] = [digest, group_name, vpc_id]
+            rule_count += len(rules)
+        manifest = json.dumps(groups, sort_keys=True, separators=(',', ':'))
+        manifest_digest = _digest(manifest)
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO rule_sets (digest, rules) VALUES (?, ?)",
+                                  new_rule_sets.items())
+            self.conn.execute("INSERT OR IGNORE INTO manifests (digest, groups) VALUES (?, ?)",
+                              (manifest_digest, manifest))
+            cursor = self.conn.execute(
+                "INSERT INTO snapshots (created, scope, manifest, group_count, rule_count) VALUES (?, ?, ?, ?, ?)",
+                (created or time.time(), scope, manifest_digest, len(groups), rule_count)
+            )
+        return cursor.lastrowid
+
+    def snapshots(self, scope=None):
+        """Returns (snapshot_id, created, scope, manifest digest, groups, rules) tuples, oldest first."""
+        query = "SELECT snapshot_id, created, scope, manifest, group_count, rule_count FROM snapshots"
+        if scope is None:
+            return self.conn.execute(query + " ORDER BY snapshot_id").fetchall()
+        return self.conn.execute(query + " WHERE scope = ? ORDER BY snapshot_id", (scope,)).fetchall()
+
+    def previous(self, snapshot_id):
+        """ID of the snapshot of the same scope taken before snapshot_id, or None."""
+        row = self.conn.execute(
+            "SELECT snapshot_id FROM snapshots WHERE scope = (SELECT scope FROM snapshots WHERE snapshot_id = ?)"
+            " AND snapshot_id < ? ORDER BY snapshot_id DESC LIMIT 1", (snapshot_id, snapshot_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _manifest(self, snapshot_id):
+        row = self.conn.execute("SELECT manifest FROM snapshots WHERE snapshot_id = ?", (snapshot_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No snapshot {snapshot_id} in {self.path}")
+        return row[0]
+
+    def _groups(self, manifest_digest):
+        row = self.conn.execute("SELECT groups FROM manifests WHERE digest = ?", (manifest_digest,)).fetchone()
+        return json.loads(row[0])
+
+    def _rule_set_payloads(self, digests):
+        payloads = {}
+        digests = list(digests)
+        for i in range(0, len(digests), 500):  # stay under SQLite's bound-parameter limit
+            batch = digests[i:i + 500]
+            payloads.update(self.conn.execute(
+                f"SELECT digest, rules FROM rule_sets WHERE digest IN ({','.join('?' * len(batch))})", batch
+            ))
+        return payloads
+
+    def rules(self, snapshot_id, group_ids=None):
+        """Returns group ID -> rules of a snapshot (only group_ids when given)."""
+        groups = self._groups(self._manifest(snapshot_id))
+        if group_ids is not None:
+            groups = {group_id: groups[group_id] for group_id in group_ids if group_id in groups}
+        payloads = self._rule_set_payloads({digest for digest, _, _ in groups.values()})
+        return {
+            group_id: _load_rules(payloads[digest], group_id, group_name, vpc_id)
+            for group_id, (digest, group_name, vpc_id) in groups.items()
+        }
+
+    def changed_groups(self, old_id, new_id):
+        """Group IDs whose rule set digest differs between two snapshots (added and deleted groups included)."""
+        old_manifest, new_manifest = self._manifest(old_id), self._manifest(new_id)
+        if old_manifest == new_manifest:
+            return []
+        old_groups, new_groups = self._groups(old_manifest), self._groups(new_manifest)
+        return sorted(
+            group_id for group_id in set(old_groups) | set(new_groups)
+            if (old_groups.get(group_id) or [None])[0] != (new_groups.get(group_id) or [None])[0]
+        )
+
+    @timed('rule_snapshots.diff')
+    def diff(self, old_id, new_id):
+        """Yields drift rows (DRIFT_FIELDS) for the rules added, removed and modified from old_id to new_id."""
+        changed = self.changed_groups(old_id, new_id)
+        if not changed:
+            return
+        old_rules, new_rules = self.rules(old_id, changed), self.rules(new_id, changed)
+        for group_id in changed:
+            for change_type, old_rule, new_rule in diff_rule_sets(old_rules.get(group_id, []),
+                                                                  new_rules.get(group_id, [])):
+                yield drift_row(change_type, old_rule, new_rule)
+
+    def prune(self, keep=30):
+        """Keeps the newest `keep` snapshots per scope and drops manifests and rule sets no longer used."""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM snapshots WHERE snapshot_id NOT IN (SELECT snapshot_id FROM ("
+                " SELECT snapshot_id, ROW_NUMBER() OVER (PARTITION BY scope ORDER BY snapshot_id DESC) AS age"
+                " FROM snapshots) WHERE age <= ?)", (keep,)
+            )
+            self.conn.execute("DELETE FROM manifests WHERE digest NOT IN (SELECT manifest FROM snapshots)")
+            used = set()
+            for (groups,) in self.conn.execute("SELECT groups FROM manifests"):
+                used.update(digest for digest, _, _ in json.loads(groups).values())
+            unused = [(digest,) for (digest,) in self.conn.execute("SELECT digest FROM rule_sets")
+                      if digest not in used]
+            self.conn.executemany("DELETE FROM rule_sets WHERE digest = ?", unused)
+        return len(unused)
+
+
+def snapshot_scope(region=None, vpc_id=None, sg_ids=None):
+    """Scope label of a sweep; drift is only measured between snapshots of the same scope."""
+    groups = ','.join(sorted(sg_ids)) if sg_ids else 'all'
+    return f"{region or 'default'}|{vpc_id or '*'}|{groups}"
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="List stored SG rule snapshots or diff two of them.")
+    parser.add_argument('--db', type=str, default='sg_rule_snapshots.db', help="Snapshot database")
+    parser.add_argument('--list', action='store_true', help="List the stored snapshots")
+    parser.add_argument('--diff', type=int, nargs='+', metavar='ID',
+                        help="Diff snapshot OLD NEW, or NEW against the previous snapshot of its scope")
+    parser.add_argument('--prune', type=int, metavar='KEEP', help="Keep only the newest KEEP snapshots per scope")
+    parser.add_argument('--output', type=str, default='sg_rule_drift.csv',
+                        help="Drift report (.csv, .jsonl, .parquet or .arrow)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    with RuleSnapshotStore(args.db) as store:
+        if args.list:
+            for snapshot_id, created, scope, manifest, groups, rules in store.snapshots():
+                print(f"{snapshot_id:>6} {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(created))} "
+                      f"{scope} {groups} groups, {rules} rules, manifest {manifest[:12]}")
+        if args.diff:
+            new_id = args.diff[-1]
+            old_id = args.diff[0] if len(args.diff) > 1 else store.previous(new_id)
+            if old_id is None:
+                raise SystemExit(f"Snapshot {new_id} has no earlier snapshot of the same scope")
+            count = write_report(store.diff(old_id, new_id), args.output, DRIFT_FIELDS)
+            print(f"{count} rule changes from snapshot {old_id} to {new_id} written to {args.output}")
+        if args.prune is not None:
+            print(f"{store.prune(args.prune)} unused rule sets removed")
@@ -0,0 +1,384 @@
+import argparse
+from collections import defaultdict, deque
+from instrumentation import timed
+from report_writers import write_report
+from rule_index import protocol_number
+from sg_rules import PEER_SECURITY_GROUP, iter_group_rules, iter_security_groups
+
+BLAST_RADIUS_FIELDS = ['SourceGroupId', 'AffectedGroupId', 'GroupName', 'VpcId', 'Depth', 'Via', 'Relation',
+                       'InstanceCount', 'Instances']
+REACH_FIELDS = ['TargetGroupId', 'Port', 'Protocol', 'SourceGroupId', 'GroupName', 'Depth', 'InstanceCount',
+                'Instances']
+NO_PORT_PROTOCOLS = ('1', '58')  # ICMP rules carry type/code rather than ports
+
+
+def allows(rule, protocol=None, port=None):
+    """True when rule covers protocol (a name or number; None = any) and port (None = any)."""
+    rule_protocol = protocol_number(rule.protocol)
+    if protocol is not None and rule_protocol != '-1' and rule_protocol != protocol_number(protocol):
+        return False
+    if port is None or rule.from_port is None or rule_protocol in NO_PORT_PROTOCOLS:
+        return True
+    return rule.from_port <= int(port) <= rule.to_port
+
+
+def _bit_indexes(bits):
+    """Positions of the set bits of a Python int bitset."""
+    return [i for i, bit in enumerate(reversed(bin(bits))) if bit == '1']
+
+
+def members_from_inventory(inventory_index):
+    """Maps SG ID -> instance IDs (ENI IDs for unattached interfaces) from an InventoryIndex."""
+    members = defaultdict(set)
+    for entry in inventory_index.entries.values():
+        for sg_id in entry.sg_ids:
+            members[sg_id].add(entry.instance_id or entry.eni_id)
+    return members
+
+
+class SecurityGroupGraph:
+    """
+    Graph of SG-to-SG references: an edge src -> dst means an inbound rule
+    of dst admits members of src, so src's instances can reach dst's.
+    Egress rules referencing a group are kept as dependencies for blast
+    radius but not as edges (egress is allow-all for most groups).
+
+    Transitive queries are memoized. Closures come from per-direction
+    tables of strongly connected components with Python int bitsets,
+    built lazily in one pass over the graph; per-query results are cached
+    and, when a rule change touches a group, only the cached results that
+    include that group are dropped (the closure tables are rebuilt on
+    next use).
+    """
+
+    def __init__(self, security_groups=(), members=None):
+        self.names = {}
+        self.vpcs = {}
+        self.rules = defaultdict(dict)  # owner -> rule key -> SG-referencing rule
+        self.sources = defaultdict(lambda: defaultdict(list))  # dst -> src -> inbound rules of dst
+        self.reaches = defaultdict(set)  # src -> dsts
+        self.referrers = defaultdict(lambda: defaultdict(int))  # peer -> owner -> referencing rule count
+        self.members = members if members is not None else {}
+        self.stale = set()  # groups with changes that could not be applied from the event alone
+        self._caches = defaultdict(dict)  # query name -> key -> result
+        self._watchers = defaultdict(set)  # group -> (query name, key) of cached results including it
+        self._tables = {}  # 'forward'/'reverse' -> (node -> bit, bit -> node, node -> closure bits)
+        for sg in security_groups:
+            self.add_group(sg)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_group(self, sg):
+        """Adds (or replaces) one describe_security_groups entry."""
+        group_id = sg['GroupId']
+        self.names[group_id] = sg.get('GroupName', '')
+        self.vpcs[group_id] = sg.get('VpcId')
+        self.set_group_rules(group_id, iter_group_rules(sg))
+
+    def set_group_rules(self, group_id, rules):
+        """Replaces group_id's SG-referencing rules (other rules are ignored) and invalidates what changed."""
+        new = {rule.key: rule for rule in rules if rule.peer_type == PEER_SECURITY_GROUP}
+        old = self.rules.get(group_id, {})
+        for key in set(old) - set(new):
+            self.remove_rule(old[key])
+        for key in set(new) - set(old):
+            self.add_rule(new[key])
+
+    def add_rule(self, rule):
+        group_id, peer = rule.group_id, rule.peer
+        if rule.key in self.rules[group_id]:
+            return
+        self.rules[group_id][rule.key] = rule
+        self.referrers[peer][group_id] += 1
+        if rule.direction == 'Inbound':
+            self.sources[group_id][peer].append(rule)
+            self.reaches[peer].add(group_id)
+        self.invalidate([group_id, peer])
+
+    def remove_rule(self, rule):
+        group_id, peer = rule.group_id, rule.peer
+        if self.rules.get(group_id, {}).pop(rule.key, None) is None:
+            return
+        self.referrers[peer][group_id] -= 1
+        if not self.referrers[peer][group_id]:
+            del self.referrers[peer][group_id]
+        if rule.direction == 'Inbound':
+            edge_rules = self.sources[group_id][peer]
+            edge_rules[:] = [existing for existing in edge_rules if existing.key != rule.key]
+            if not edge_rules:
+                del self.sources[group_id][peer]
+                self.reaches[peer].discard(group_id)
+        self.invalidate([group_id, peer])
+
+    def invalidate(self, group_ids):
+        """Drops the cached results that include any of group_ids, and the closure tables."""
+        self._tables.clear()
+        for group_id in group_ids:
+            for name, key in self._watchers.pop(group_id, ()):
+                self._caches[name].pop(key, None)
+
+    def _remember(self, name, key, result, group_ids):
+        self._caches[name][key] = result
+        for group_id in group_ids:
+            self._watchers[group_id].add((name, key))
+        return result
+
+    def apply_changes(self, changes):
+        """
+        Applies cloudtrail_parser RuleChanges. Authorizes and content-carrying
+        revokes of SG-referencing rules update the graph directly; revokes by
+        rule ID and ModifySecurityGroupRules calls (whose previous rule is
+        unknown) mark the group stale for refresh(). Returns the changes applied.
+        """
+        applied = 0
+        for change in changes:
+            rule = change.rule
+            if not rule.group_id:
+                continue
+            if change.change_type == 'Modified' or not rule.peer_type or not rule.direction:
+                self.stale.add(rule.group_id)
+                self.invalidate([rule.group_id])
+                continue
+            if rule.peer_type != PEER_SECURITY_GROUP:
+                continue
+            if change.change_type == 'Added':
+                self.add_rule(rule)
+            else:
+                self.remove_rule(rule)
+            applied += 1
+        return applied
+
+    @timed('sg_graph.refresh')
+    def refresh(self, ec2_client, group_ids=None):
+        """Re-describes group_ids (default: the stale groups); groups no longer found lose their rules."""
+        group_ids = set(self.stale if group_ids is None else group_ids)
+        if not group_ids:
+            return 0
+        found = set()
+        for sg in iter_security_groups(ec2_client, sorted(group_ids)):
+            self.add_group(sg)
+            found.add(sg['GroupId'])
+        for group_id in group_ids - found:
+            self.set_group_rules(group_id, [])
+        self.stale -= group_ids
+        return len(found)
+
+    def _closure_table(self, direction):
+        """
+        Returns (node -> bit, bit -> node, node -> closure bitset) for 'forward' (what
+        a node's members can reach) or 'reverse' (what can reach a node).
+        Strongly connected components are found with an iterative Tarjan
+        walk, which emits them sinks first, so each component's closure is
+        its successors' closures OR-ed together.
+        """
+        table = self._tables.get(direction)
+        if table is not None:
+            return table
+        if direction == 'forward':
+            graph = {node: targets for node, targets in self.reaches.items() if targets}
+        else:
+            graph = {node: set(sources) for node, sources in self.sources.items() if sources}
+        nodes = set(graph)
+        for targets in graph.values():
+            nodes.update(targets)
+        names = sorted(nodes)
+        index = {node: i for i, node in enumerate(names)}
+
+        order, low, on_stack, stack, closures = {}, {}, set(), [], {}
+        counter = 0
+        for root in index:
+            if root in order:
+                continue
+            work = [(root, iter(graph.get(root, ())))]
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, successors = work[-1]
+                for successor in successors:
+                    if successor not in order:
+                        order[successor] = low[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(graph.get(successor, ()))))
+                        break
+                    if successor in on_stack:
+                        low[node] = min(low[node], order[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == order[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        bits = 0
+                        for member in component:
+                            for successor in graph.get(member, ()):
+                                # Successors outside the component are finished already
+                                bits |= (1 << index[successor]) | closures.get(successor, 0)
+                        for member in component:
+                            closures[member] = bits
+        table = self._tables[direction] = (index, names, closures)
+        return table
+
+    def _closure(self, direction, group_id):
+        _, names, closures = self._closure_table(direction)
+        return frozenset(names[i] for i in _bit_indexes(closures.get(group_id, 0)))
+
+    def downstream(self, group_id):
+        """Groups whose instances group_id's instances can reach, directly or through other groups."""
+        cached = self._caches['downstream'].get(group_id)
+        if cached is None:
+            cached = self._closure('forward', group_id)
+            self._remember('downstream', group_id, cached, cached | {group_id})
+        return cached
+
+    def direct_sources(self, group_id, port=None, protocol='tcp'):
+        """Groups admitted by group_id's inbound rules on port/protocol (None = any)."""
+        return frozenset(
+            source for source, rules in self.sources.get(group_id, {}).items()
+            if any(allows(rule, protocol, port) for rule in rules)
+        )
+
+    def upstream(self, group_id, port=None, protocol='tcp'):
+        """
+        Groups whose instances can reach group_id on port/protocol: the direct
+        sources on that port, plus every group that can reach one of those
+        sources on any port (a path through other instances).
+        """
+        key = (group_id, port, protocol_number(protocol) if protocol else None)
+        cached = self._caches['upstream'].get(key)
+        if cached is None:
+            direct = self.direct_sources(group_id, port, protocol)
+            result = set(direct)
+            for source in direct:
+                result |= self._closure('reverse', source)
+            cached = frozenset(result)
+            self._remember('upstream', key, cached, cached | {group_id})
+        return cached
+
+    def instances(self, group_ids):
+        found = set()
+        for group_id in group_ids:
+            found.update(self.members.get(group_id, ()))
+        return found
+
+    def instances_reaching(self, group_id, port=None, protocol='tcp', transitive=False):
+        """Instances that can reach group_id's instances on port, directly or (transitive) via hops."""
+        sources = self.upstream(group_id, port, protocol) if transitive else self.direct_sources(
+            group_id, port, protocol)
+        return self.instances(sources)
+
+    @timed('sg_graph.blast_radius')
+    def blast_radius(self, group_id):
+        """
+        What a change to group_id (its rules or its members) can affect:
+        group -> (depth, via group, relation). Groups reached through
+        inbound references are followed transitively; groups whose egress
+        rules reference group_id are direct dependents only.
+        """
+        cached = self._caches['blast_radius'].get(group_id)
+        if cached is not None:
+            return cached
+        affected = {group_id: (0, None, 'self')}
+        queue = deque([group_id])
+        while queue:
+            node = queue.popleft()
+            depth = affected[node][0]
+            for target in sorted(self.reaches.get(node, ())):
+                if target not in affected:
+                    affected[target] = (depth + 1, node, 'inbound reference' if depth == 0 else 'transitive')
+                    queue.append(target)
+        for owner in sorted(self.referrers.get(group_id, ())):
+            if owner not in affected:
+                affected[owner] = (1, group_id, 'egress reference')
+        return self._remember('blast_radius', group_id, affected, affected)
+
+    @timed('sg_graph.blast_radius_sizes')
+    def blast_radius_sizes(self):
+        """
+        Number of other groups each group's changes can reach (transitively), for
+        every group at once. A group in a reference cycle reaches itself, but
+        is not counted, as blast_radius does not count it as affected.
+        """
+        index, _, closures = self._closure_table('forward')
+        sizes = {group_id: bin(closures.get(group_id, 0) & ~(1 << bit)).count('1') for group_id, bit in index.items()}
+        for group_id in self.names:
+            sizes.setdefault(group_id, 0)
+        return sizes
+
+    def blast_radius_rows(self, group_id):
+        for affected_id, (depth, via, relation) in sorted(self.blast_radius(group_id).items(),
+                                                          key=lambda item: (item[1][0], item[0])):
+            members = sorted(self.members.get(affected_id, ()))
+            yield {
+                'SourceGroupId': group_id, 'AffectedGroupId': affected_id,
+                'GroupName': self.names.get(affected_id, ''), 'VpcId': self.vpcs.get(affected_id),
+                'Depth': depth, 'Via': via, 'Relation': relation,
+                'InstanceCount': len(members), 'Instances': ';'.join(members),
+            }
+
+    def reach_rows(self, group_id, port=None, protocol='tcp', transitive=False):
+        direct = self.direct_sources(group_id, port, protocol)
+        sources = self.upstream(group_id, port, protocol) if transitive else direct
+        for source in sorted(sources):
+            members = sorted(self.members.get(source, ()))
+            yield {
+                'TargetGroupId': group_id, 'Port': 'All' if port is None else port, 'Protocol': protocol,
+                'SourceGroupId': source, 'GroupName': self.names.get(source, ''),
+                'Depth': 1 if source in direct else 'transitive',
+                'InstanceCount': len(members), 'Instances': ';'.join(members),
+            }
+
+
+@timed('sg_graph.build')
+def build_graph(ec2_client, vpc_id=None, inventory_index=None):
+    """Builds the graph from one bulk describe_security_groups sweep (optionally of one VPC)."""
+    members = members_from_inventory(inventory_index) if inventory_index is not None else None
+    graph = SecurityGroupGraph(iter_security_groups(ec2_client, vpc_id=vpc_id), members)
+    print(f"SG graph built: {len(graph.names)} groups, "
+          f"{sum(len(targets) for targets in graph.reaches.values())} reference edges")
+    return graph
+
+
+def get_arguments():
+    """Parses command-line arguments."""
+    parser = argparse.ArgumentParser(description="Resolve SG-to-SG references: blast radius and reachability.")
+    parser.add_argument('--sg_ids', type=str, required=True, help="Comma-separated security group IDs")
+    parser.add_argument('--region', type=str, default=None, help="AWS region (default: the configured one)")
+    parser.add_argument('--vpc_id', type=str, default=None, help="Only sweep groups in this VPC")
+    parser.add_argument('--port', type=int, default=None,
+                        help="Report what can reach the SGs on this port instead of their blast radius")
+    parser.add_argument('--protocol', type=str, default='tcp', help="Protocol for --port (default: tcp)")
+    parser.add_argument('--transitive', action='store_true', help="With --port, include multi-hop sources")
+    parser.add_argument('--output', type=str, default='sg_blast_radius.csv',
+                        help="Output file (.csv, .jsonl, .parquet or .arrow)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from aws_clients import get_client
+    from inventory_index import InventoryIndex
+
+    args = get_arguments()
+    ec2_client = get_client('ec2', args.region)
+    inventory = InventoryIndex(f"inventory_index_{args.region or 'default'}.json")
+    inventory.ensure_fresh(ec2_client)
+    graph = build_graph(ec2_client, args.vpc_id, inventory)
+    sg_ids = args.sg_ids.split(',')
+    if args.port is not None:
+        rows = (row for sg_id in sg_ids for row in graph.reach_rows(sg_id, args.port, args.protocol, args.transitive))
+        count = write_report(rows, args.output, REACH_FIELDS)
+    else:
+        count = write_report((row for sg_id in sg_ids for row in graph.blast_radius_rows(sg_id)),
+                             args.output, BLAST_RADIUS_FIELDS)
+    print(f"{count} rows written to {args.output}")
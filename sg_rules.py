@@ -0,0 +1,231 @@
+import re
+from collections import namedtuple
+from instrumentation import timed
+
+# Filter values are capped at 200 per filter in EC2 Describe* calls
+GROUP_ID_BATCH_SIZE = 200
+PAGE_SIZE = 1000
+
+PEER_CIDR = 'cidr'
+PEER_CIDR_IPV6 = 'cidr_ipv6'
+PEER_PREFIX_LIST = 'prefix_list'
+PEER_SECURITY_GROUP = 'security_group'
+
+_RuleBase = namedtuple('SecurityGroupRule', [
+    'group_id', 'group_name', 'vpc_id', 'direction', 'protocol',
+    'from_port', 'to_port', 'peer_type', 'peer', 'description'
+])
+
+
+class SecurityGroupRule(_RuleBase):
+    """
+    One normalized SG rule: a single protocol/port range and a single peer.
+
+    direction is 'Inbound' or 'Outbound'; protocol is the EC2 IpProtocol
+    string ('-1' for all traffic); from_port/to_port are None when the rule
+    covers all ports. peer is a CIDR, prefix list ID or SG ID per peer_type.
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """Identity of the rule, ignoring group name, VPC and description."""
+        return (self.group_id, self.direction, self.protocol, self.from_port, self.to_port,
+                self.peer_type, self.peer)
+
+    @property
+    def port_range(self):
+        """'All', or 'from-to' with an open bound as 'All' (e.g. '8-All' for ICMP type 8, any code)."""
+        if self.from_port is None and self.to_port is None:
+            return 'All'
+        return f"{_format_bound(self.from_port)}-{_format_bound(self.to_port)}"
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds a rule back from a to_row() report row (e.g. a getinboundrule.py CSV line)."""
+        from_port, to_port = parse_port_range(row.get('PortRange'))
+        return cls(row['SecurityGroupID'], row.get('GroupName', ''), row.get('VpcId') or None,
+                   row.get('Type', 'Inbound'), normalize_protocol(row.get('Protocol')), from_port, to_port,
+                   row.get('PeerType') or PEER_CIDR, row.get('SourceCIDR'), row.get('Description') or 'N/A')
+
+    def to_row(self):
+        """Returns the rule as a report row, keeping the original getinboundrule.py columns first."""
+        return {
+            'SecurityGroupID': self.group_id,
+            'GroupName': self.group_name,
+            'Type': self.direction,
+            'Protocol': self.protocol,
+            'PortRange': self.port_range,
+            'SourceCIDR': self.peer,
+            'Description': self.description,
+            'PeerType': self.peer_type,
+            'VpcId': self.vpc_id
+        }
+
+
+RULE_ROW_FIELDS = ['SecurityGroupID', 'GroupName', 'Type', 'Protocol', 'PortRange', 'SourceCIDR',
+                   'Description', 'PeerType', 'VpcId']
+
+
+def normalize_protocol(protocol):
+    """Returns the EC2 IpProtocol string in lower case, with 'all'/None mapped to '-1'."""
+    if protocol is None:
+        return '-1'
+    protocol = str(protocol).lower()
+    return '-1' if protocol == 'all' else protocol
+
+
+def normalize_port(port):
+    """Returns the port as an int, or None for 'all ports' (missing or -1)."""
+    if port is None or port == '' or int(port) == -1:
+        return None
+    return int(port)
+
+
+def _format_bound(port):
+    return 'All' if port is None else port
+
+
+def _parse_bound(value):
+    try:
+        return normalize_port(value)
+    except ValueError:  # 'All', and older reports' 'None'
+        return None
+
+
+def parse_port_range(port_range):
+    """
+    Parses a port_range string back into (from_port, to_port). Non-numeric
+    bounds mean 'all'; '-1' bounds (as in older reports) are accepted too.
+    """
+    if port_range in ('All', '', None):
+        return None, None
+    match = re.fullmatch(r'\s*(-?\w+)\s*-\s*(-?\w+)\s*', str(port_range))
+    if match is None:
+        port = _parse_bound(str(port_range).strip())
+        return port, port
+    return _parse_bound(match.group(1)), _parse_bound(match.group(2))
+
+
+def iter_permission_rules(group_id, group_name, vpc_id, direction, permission):
+    """Yields one SecurityGroupRule per peer of a describe_security_groups IpPermission."""
+    protocol = normalize_protocol(permission.get('IpProtocol'))
+    from_port = normalize_port(permission.get('FromPort'))
+    to_port = normalize_port(permission.get('ToPort'))
+    if protocol == '-1':
+        from_port = to_port = None
+
+    def rule(peer_type, peer, description):
+        return SecurityGroupRule(group_id, group_name, vpc_id, direction, protocol,
+                                 from_port, to_port, peer_type, peer, description or 'N/A')
+
+    for ip_range in permission.get('IpRanges', []):
+        yield rule(PEER_CIDR, ip_range.get('CidrIp'), ip_range.get('Description'))
+    for ip_range in permission.get('Ipv6Ranges', []):
+        yield rule(PEER_CIDR_IPV6, ip_range.get('CidrIpv6'), ip_range.get('Description'))
+    for prefix_list in permission.get('PrefixListIds', []):
+        yield rule(PEER_PREFIX_LIST, prefix_list.get('PrefixListId'), prefix_list.get('Description'))
+    for pair in permission.get('UserIdGroupPairs', []):
+        yield rule(PEER_SECURITY_GROUP, pair.get('GroupId'), pair.get('Description'))
+
+
+# Field names of describe_security_group_rules entries (and, with ReferencedGroupId, of
+# ModifySecurityGroupRules requests) for rule_from_spec
+DESCRIBE_RULE_KEYS = {
+    'rule_id': 'SecurityGroupRuleId', 'protocol': 'IpProtocol', 'from': 'FromPort', 'to': 'ToPort',
+    'description': 'Description', 'cidr': 'CidrIpv4', 'cidr_ipv6': 'CidrIpv6', 'prefix_list': 'PrefixListId',
+    'group': 'ReferencedGroupInfo',
+}
+
+
+def rule_from_spec(group_id, direction, spec, keys=DESCRIBE_RULE_KEYS):
+    """
+    Returns (rule_id, rule) for a flat single-peer rule such as a
+    describe_security_group_rules entry; keys maps the field names.
+    rule is None when the spec names no peer.
+    """
+    permission = {
+        'IpProtocol': spec.get(keys['protocol']),
+        'FromPort': spec.get(keys['from']),
+        'ToPort': spec.get(keys['to'])
+    }
+    description = spec.get(keys['description'])
+    referenced = spec.get(keys['group'])
+    if isinstance(referenced, dict):
+        referenced = referenced.get('GroupId') or referenced.get('groupId')
+    if spec.get(keys['cidr']):
+        permission['IpRanges'] = [{'CidrIp': spec[keys['cidr']], 'Description': description}]
+    elif spec.get(keys['cidr_ipv6']):
+        permission['Ipv6Ranges'] = [{'CidrIpv6': spec[keys['cidr_ipv6']], 'Description': description}]
+    elif spec.get(keys['prefix_list']):
+        permission['PrefixListIds'] = [{'PrefixListId': spec[keys['prefix_list']], 'Description': description}]
+    elif referenced:
+        permission['UserIdGroupPairs'] = [{'GroupId': referenced, 'Description': description}]
+    rules = list(iter_permission_rules(group_id, '', None, direction, permission))
+    return spec.get(keys['rule_id']), rules[0] if rules else None
+
+
+def iter_group_rules(sg, directions=('Inbound', 'Outbound')):
+    """Yields the normalized rules of one describe_security_groups entry."""
+    group_id = sg['GroupId']
+    group_name = sg.get('GroupName', '')
+    vpc_id = sg.get('VpcId')
+    if 'Inbound' in directions:
+        for permission in sg.get('IpPermissions', []):
+            yield from iter_permission_rules(group_id, group_name, vpc_id, 'Inbound', permission)
+    if 'Outbound' in directions:
+        for permission in sg.get('IpPermissionsEgress', []):
+            yield from iter_permission_rules(group_id, group_name, vpc_id, 'Outbound', permission)
+
+
+@timed('ec2.security_groups')
+def iter_security_groups(ec2_client, sg_ids=None, vpc_id=None):
+    """
+    Yields describe_security_groups entries, page by page.
+
+    With sg_ids the IDs are queried in batches of GROUP_ID_BATCH_SIZE; without
+    them every group (optionally only those in vpc_id) is swept in bulk.
+    """
+    paginator = ec2_client.get_paginator('describe_security_groups')
+    base_filters = [{'Name': 'vpc-id', 'Values': [vpc_id]}] if vpc_id else []
+
+    if sg_ids is None:
+        batches = [base_filters]
+    else:
+        sg_ids = list(dict.fromkeys(sg_ids))
+        batches = [
+            base_filters + [{'Name': 'group-id', 'Values': sg_ids[i:i + GROUP_ID_BATCH_SIZE]}]
+            for i in range(0, len(sg_ids), GROUP_ID_BATCH_SIZE)
+        ]
+
+    for filters in batches:
+        kwargs = {'PaginationConfig': {'PageSize': PAGE_SIZE}}
+        if filters:
+            kwargs['Filters'] = filters
+        for page in paginator.paginate(**kwargs):
+            yield from page['SecurityGroups']
+
+
+def iter_rules(ec2_client, sg_ids=None, vpc_id=None, directions=('Inbound', 'Outbound')):
+    """Yields normalized rules for sg_ids, or for every group (in vpc_id) when sg_ids is None."""
+    for sg in iter_security_groups(ec2_client, sg_ids, vpc_id):
+        yield from iter_group_rules(sg, directions)
+
+
+@timed('ec2.security_group_rules')
+def iter_security_group_rules(ec2_client, sg_ids):
+    """
+    Yields (rule_id, rule) for every rule of sg_ids from paginated
+    describe_security_group_rules calls, which unlike describe_security_groups
+    report each rule's SecurityGroupRuleId.
+    """
+    paginator = ec2_client.get_paginator('describe_security_group_rules')
+    sg_ids = list(dict.fromkeys(sg_ids))
+    for i in range(0, len(sg_ids), GROUP_ID_BATCH_SIZE):
+        filters = [{'Name': 'group-id', 'Values': sg_ids[i:i + GROUP_ID_BATCH_SIZE]}]
+        for page in paginator.paginate(Filters=filters, PaginationConfig={'PageSize': PAGE_SIZE}):
+            for spec in page['SecurityGroupRules']:
+                direction = 'Outbound' if spec.get('IsEgress') else 'Inbound'
+                rule_id, rule = rule_from_spec(spec['GroupId'], direction, spec)
+                if rule is not None:
+                    yield rule_id, rule
@@ -0,0 +1,193 @@
+import bisect
+from collections import defaultdict
+from datetime import datetime, timezone
+from sg_rules import iter_security_group_rules
+
+BEGINNING = float('-inf')
+
+
+def to_epoch(value):
+    """Converts a datetime (naive values are UTC), ISO-8601 string or epoch number to epoch seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class RuleSetHistory:
+    """
+    Every version of one SG's rule set.
+
+    states[i] is a frozenset of rule keys, valid from times[i] until
+    times[i + 1]; rules maps each key ever seen to its SecurityGroupRule.
+    Versions share their rule objects, so a lookup is one bisect.
+    """
+
+    __slots__ = ('group_id', 'times', 'states', 'rules')
+
+    def __init__(self, group_id, times, states, rules):
+        self.group_id = group_id
+        self.times = times
+        self.states = states
+        self.rules = rules
+
+    def keys_at(self, when):
+        """Rule keys in force at when, after every change made at that instant."""
+        return self.states[bisect.bisect_right(self.times, to_epoch(when)) - 1]
+
+    def keys_before(self, when):
+        """Rule keys in force just before when."""
+        return self.states[max(bisect.bisect_left(self.times, to_epoch(when)) - 1, 0)]
+
+    def rules_at(self, when):
+        return sorted((self.rules[key] for key in self.keys_at(when)), key=_sort_key)
+
+    def rules_before(self, when):
+        return sorted((self.rules[key] for key in self.keys_before(when)), key=_sort_key)
+
+
+def _sort_key(rule):
+    return tuple('' if value is None else str(value) for value in rule.key)
+
+
+class SecurityGroupStateIndex:
+    """
+    Point-in-time rule sets of many SGs, rebuilt from one snapshot plus CloudTrail deltas.
+
+    snapshot holds (rule_id, rule) pairs (as from iter_security_group_rules)
+    taken at snapshot_time; changes are cloudtrail_parser RuleChanges. Changes
+    before the snapshot are undone newest first and changes after it are
+    replayed oldest first. Changes that cannot be inverted because the event
+    does not carry the rule's content (a revoke by rule ID or a modify whose
+    earlier version is outside the window) are kept in unresolved.
+    """
+
+    def __init__(self, snapshot, snapshot_time, changes):
+        self.snapshot_time = to_epoch(snapshot_time)
+        self.histories = {}
+        self.unresolved = []
+
+        snapshot_by_group = defaultdict(list)
+        for rule_id, rule in snapshot:
+            snapshot_by_group[rule.group_id].append((rule_id, rule))
+        changes_by_group = defaultdict(list)
+        for change in changes:
+            if change.rule.group_id:
+                changes_by_group[change.rule.group_id].append((to_epoch(change.event_time), change))
+
+        for group_id in set(snapshot_by_group) | set(changes_by_group):
+            group_changes = sorted(changes_by_group.get(group_id, []), key=lambda item: item[0])
+            self.histories[group_id] = self._replay(group_id, snapshot_by_group.get(group_id, []), group_changes)
+
+    def _replay(self, group_id, snapshot, changes):
+        rules = {}
+        ids = {}  # rule ID -> key of that rule in the state being walked
+        state = set()
+        for rule_id, rule in snapshot:
+            rules[rule.key] = rule
+            state.add(rule.key)
+            if rule_id:
+                ids[rule_id] = rule.key
+
+        previous = self._previous_versions(changes)
+        earlier = [(time, change) for time, change in changes if time <= self.snapshot_time]
+        later = [(time, change) for time, change in changes if time > self.snapshot_time]
+
+        # Undo the changes before the snapshot: the state after each change is valid from its time
+        undone = []
+        snapshot_ids = dict(ids)
+        for time, change in reversed(earlier):
+            undone.append((time, frozenset(state)))
+            rule_id, before = change.rule_id, previous.get(id(change))
+            if change.change_type == 'Added':
+                state.discard(ids.pop(rule_id, None) or change.rule.key)
+            elif change.change_type == 'Removed':
+                rule = change.rule if change.rule.peer_type else before
+                self._add(rule, rule_id, state, rules, ids, change)
+            else:
+                state.discard(ids.pop(rule_id, None))
+                self._add(before, rule_id, state, rules, ids, change)
+
+        times = [BEGINNING] + [time for time, _ in reversed(undone)]
+        states = [frozenset(state)] + [keys for _, keys in reversed(undone)]
+
+        # Replay the changes after the snapshot
+        state, ids = set(states[-1]), snapshot_ids
+        for time, change in later:
+            rule_id = change.rule_id
+            if change.change_type == 'Added':
+                self._add(change.rule, rule_id, state, rules, ids, change)
+            elif change.change_type == 'Removed':
+                state.discard(ids.pop(rule_id, None) if rule_id else change.rule.key)
+            else:
+                old_key = ids.pop(rule_id, None)
+                state.discard(old_key)
+                direction = rules[old_key].direction if old_key else None
+                self._add(change.rule._replace(direction=direction) if direction else None,
+                          rule_id, state, rules, ids, change)
+            times.append(time)
+            states.append(frozenset(state))
+        return RuleSetHistory(group_id, times, states, rules)
+
+    def _add(self, rule, rule_id, state, rules, ids, change):
+        if rule is None:
+            self.unresolved.append(change)
+            return
+        rules.setdefault(rule.key, rule)
+        state.add(rule.key)
+        if rule_id:
+            ids[rule_id] = rule.key
+
+    @staticmethod
+    def _previous_versions(changes):
+        """
+        Maps id(change) -> the rule its rule ID named just before the change,
+        as far as the window's own events tell (needed to undo modifies and
+        revokes by rule ID).
+        """
+        by_rule_id = {}
+        previous = {}
+        for _, change in changes:
+            rule_id = change.rule_id
+            if not rule_id:
+                continue
+            before = by_rule_id.get(rule_id)
+            previous[id(change)] = before
+            if change.change_type == 'Added':
+                by_rule_id[rule_id] = change.rule
+            elif change.change_type == 'Removed':
+                by_rule_id.pop(rule_id, None)
+            elif before is not None:
+                by_rule_id[rule_id] = change.rule._replace(direction=before.direction)
+        return previous
+
+    def history(self, group_id):
+        return self.histories.get(group_id)
+
+    def rules_at(self, group_id, when):
+        """Returns the rules of group_id in force at when ([] for an unknown group)."""
+        history = self.histories.get(group_id)
+        return history.rules_at(when) if history else []
+
+    def rules_before(self, group_id, when):
+        history = self.histories.get(group_id)
+        return history.rules_before(when) if history else []
+
+    def diff(self, group_id, start, end):
+        """Returns (added, removed) rules of group_id between start and end."""
+        history = self.histories.get(group_id)
+        if history is None:
+            return [], []
+        before, after = history.keys_at(start), history.keys_at(end)
+        return ([history.rules[key] for key in after - before],
+                [history.rules[key] for key in before - after])
+
+
+def build_state_index(ec2_client, sg_ids, changes, snapshot_time=None):
+    """Takes a describe_security_group_rules snapshot of sg_ids and indexes it with changes."""
+    snapshot_time = snapshot_time or datetime.now(timezone.utc)
+    snapshot = list(iter_security_group_rules(ec2_client, sg_ids))
+    return SecurityGroupStateIndex(snapshot, snapshot_time, changes)
@@ -0,0 +1,322 @@
+"""
+sgaudit - one entry point for the security group audit scripts.
+
+Only argparse is imported at startup; each subcommand imports the script
+it drives (and through it boto3, email, csv, ...) when it actually runs.
+"""
+import argparse
+import os
+import re
+import sys
+
+WINDOW_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+def parse_window(value):
+    """Parses a look-back window such as '90m', '24h' or '2d' into a timedelta."""
+    from datetime import timedelta
+
+    match = re.fullmatch(r'(\d+)([mhd])', value.strip().lower())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid window {value!r}, expected e.g. 90m, 24h or 2d")
+    return timedelta(**{WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+
+
+def datetime_arg(value):
+    from datetime import datetime
+
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time {value!r}, expected ISO-8601 such as 2024-05-01T03:12")
+
+
+def split_list(value):
+    return [item for item in value.split(',') if item]
+
+
+def resolve_regions(args):
+    """Returns the regions to scan: [None] for the configured default, or the listed/all regions."""
+    if not args.regions:
+        return [None]
+    if args.regions == ['all']:
+        from aws_clients import list_regions
+        return list_regions()
+    return args.regions
+
+
+def output_path(args, default_stem, region=None, multi_region=False):
+    """Returns the output file: --output, or default_stem with the --format extension."""
+    path = args.output or f"{default_stem}.{args.format}"
+    if multi_region and region:
+        stem, ext = os.path.splitext(path)
+        path = f"{stem}_{region}{ext}"
+    return path
+
+
+def time_window(args):
+    """Returns the (start, end) of the look-back window as timezone-aware UTC datetimes."""
+    from datetime import datetime, timezone
+    end_time = datetime.now(timezone.utc)
+    return end_time - args.window, end_time
+
+
+def run_inventory(args):
+    import getlistInstanceName_Sg as inventory
+
+    regions = 'all' if args.regions == ['all'] else (args.regions or inventory.aws_regions)
+    rows = inventory.iter_ec2_instances(args.sg_ids, regions, args.accounts, args.role_name,
+                                        args.workers, args.output_mode)
+    inventory.save_to_csv(rows, output_path(args, 'ec2_instance_sg_details'))
+
+
+def run_rules(args):
+    import getinboundrule as rules
+    from aws_clients import get_client
+    from sg_rules import iter_rules
+
+    filename = output_path(args, 'ibound_Sg_rules')
+    stem, ext = os.path.splitext(filename)
+
+    def iter_rows():
+        for region in resolve_regions(args):
+            if not args.snapshot_db:
+                for rule in iter_rules(get_client('ec2', region), args.sg_ids, args.vpc_id):
+                    yield rule.to_row()
+                continue
+            # The export and the snapshot share one sweep
+            rules.aws_region = region
+            rule_sets = list(rules.iter_sg_rule_sets(args.sg_ids or 'all', args.vpc_id))
+            drift_file = f"{stem}_drift_{region}{ext}" if region else f"{stem}_drift{ext}"
+            rules.check_drift(args.sg_ids or 'all', args.vpc_id, rule_sets, args.snapshot_db, drift_file)
+            for _, _, _, group_rules in rule_sets:
+                for rule in group_rules:
+                    yield rule.to_row()
+
+    rules.save_to_csv(iter_rows(), filename)
+
+
+def run_drift(args):
+    import getinboundrule as rules
+
+    regions = resolve_regions(args)
+    for region in regions:
+        rules.aws_region = region
+        rules.check_drift(args.sg_ids or 'all', args.vpc_id, db=args.snapshot_db,
+                          filename=output_path(args, 'sg_rule_drift', region, len(regions) > 1))
+
+
+def run_changes(args):
+    import modify_sg_changes_v1 as changes
+    from report_writers import peek_rows
+
+    changes.start_time, changes.end_time = time_window(args)
+    changes.cache_db = None if args.no_cache else args.cache_db
+    changes.max_workers = args.workers
+    changes.archive_paths = args.archive
+
+    def iter_changes():
+        # Archives hold every region's events, so they are scanned once
+        for region in [None] if args.archive else resolve_regions(args):
+            # iter_sg_changes reads the module's region when it starts
+            changes.aws_region = region
+            events = (change for _, change in changes.iter_sg_changes(args.sg_ids))
+            state_index = None
+            if args.full_state:
+                events = list(events)
+                state_index = changes.build_state_index(events)
+            yield from changes.iter_analyzed_changes(events, state_index)
+
+    first, rows = peek_rows(iter_changes())
+    if first is None:
+        print("No changes detected for the provided Security Groups.")
+        return
+    filename = output_path(args, 'Modify_security_group_changes')
+    count = changes.write_to_csv(rows, filename)
+    print(f"Report generated: {filename} ({count} changes)")
+
+
+def run_state(args):
+    from datetime import datetime, timezone
+    from aws_clients import get_client
+    from cloudtrail_cache import iter_cached_events
+    from cloudtrail_lookup import iter_lookup_events_parallel
+    from cloudtrail_parser import parse_event
+    from report_writers import write_report
+    from sg_rules import RULE_ROW_FIELDS
+    from sg_state import build_state_index
+
+    # Every change between --at and now has to be undone from the current snapshot
+    at = args.at if args.at.tzinfo else args.at.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+
+    def iter_rows():
+        for region in resolve_regions(args):
+            cloudtrail = get_client('cloudtrail', region)
+            if args.no_cache:
+                events = iter_lookup_events_parallel(cloudtrail, args.sg_ids, at, now, max_workers=args.workers)
+            else:
+                events = iter_cached_events(args.cache_db, cloudtrail, args.sg_ids, at, now, args.workers)
+            rule_changes = [rule_change for _, event in events for rule_change in parse_event(event)]
+            index = build_state_index(get_client('ec2', region), args.sg_ids, rule_changes, now)
+            if index.unresolved:
+                print(f"{len(index.unresolved)} changes in {region or 'the default region'} could not be undone")
+            for sg_id in args.sg_ids:
+                for rule in index.rules_at(sg_id, at):
+                    yield rule.to_row()
+
+    filename = output_path(args, 'sg_rules_at')
+    count = write_report(iter_rows(), filename, RULE_ROW_FIELDS)
+    print(f"{count} rules in force at {at.isoformat()} written to {filename}")
+
+
+def run_flow_rejects(args):
+    import vpc_flow_reject_v4 as flows
+    from notifier import Notifier
+
+    start_time, end_time = time_window(args)
+    regions = resolve_regions(args)
+    flows.DIGEST_PER_SG = args.digest_per_sg
+    # One SMTP connection, drained in the background, for every region's digest
+    with Notifier() as notifier:
+        for region in regions:
+            flows.AWS_REGION = region
+            filename = output_path(args, 'vpc_flow_results', region, len(regions) > 1)
+            flows.find_rejects(args.sg_ids, args.log_groups, filename, start_time, end_time,
+                               notify=args.notify, notifier=notifier)
+
+
+def run_graph(args):
+    import sg_graph
+    from aws_clients import get_client
+    from inventory_index import InventoryIndex
+    from report_writers import write_report
+
+    def iter_rows():
+        for region in resolve_regions(args):
+            ec2_client = get_client('ec2', region)
+            inventory = InventoryIndex(f"inventory_index_{region or 'default'}.json")
+            inventory.ensure_fresh(ec2_client)
+            graph = sg_graph.build_graph(ec2_client, args.vpc_id, inventory)
+            for sg_id in args.sg_ids:
+                if args.port is None:
+                    yield from graph.blast_radius_rows(sg_id)
+                else:
+                    yield from graph.reach_rows(sg_id, args.port, args.protocol, args.transitive)
+
+    fields = sg_graph.BLAST_RADIUS_FIELDS if args.port is None else sg_graph.REACH_FIELDS
+    filename = output_path(args, 'sg_blast_radius' if args.port is None else 'sg_reachability')
+    count = write_report(iter_rows(), filename, fields)
+    print(f"{count} rows written to {filename}")
+
+
+def run_notify(args):
+    from notifier import Notifier
+
+    with Notifier() as notifier:
+        notifier.send(args.subject, "Please find the attached reports.", args.attachments)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='sgaudit', description="Security group audit toolkit.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    def options(workers=16):
+        # Each subcommand gets its own parent, so one subcommand's defaults never leak into another's
+        parent = argparse.ArgumentParser(add_help=False)
+        parent.add_argument('--regions', type=split_list, default=None,
+                            help="Comma-separated regions, or 'all' (default: the configured region)")
+        parent.add_argument('--output', help="Output file; the extension picks the format")
+        parent.add_argument('--format', choices=['csv', 'jsonl', 'parquet', 'arrow'], default='csv',
+                            help="Output format when --output is not given (default: csv)")
+        parent.add_argument('--workers', type=int, default=workers, help=f"Parallel workers (default: {workers})")
+        parent.add_argument('--metrics', metavar='PATH',
+                            help="Write stage timings and API call counts to PATH (.json, or .prom for Prometheus)")
+        return parent
+
+    sgs_required = argparse.ArgumentParser(add_help=False)
+    sgs_required.add_argument('--sg-ids', type=split_list, required=True,
+                              help="Comma-separated security group IDs")
+
+    def window(default):
+        parent = argparse.ArgumentParser(add_help=False)
+        parent.add_argument('--window', type=parse_window, default=parse_window(default),
+                            help=f"Look-back window such as 90m, 24h or 2d (default: {default})")
+        return parent
+
+    inventory = subparsers.add_parser('inventory', parents=[options(), sgs_required],
+                                      help="EC2 instances attached to the SGs")
+    inventory.add_argument('--accounts', type=split_list, help="Comma-separated account IDs to assume into")
+    inventory.add_argument('--role-name', default='OrganizationAccountAccessRole',
+                           help="Role assumed in each of --accounts")
+    inventory.add_argument('--output-mode', choices=['per_sg', 'requested', 'instance'], default='per_sg',
+                           help="Row layout (default: per_sg)")
+    inventory.set_defaults(handler=run_inventory)
+
+    rules = subparsers.add_parser('rules', parents=[options()], help="Inbound and egress rules of the SGs")
+    rules.add_argument('--sg-ids', type=split_list, default=None,
+                       help="Comma-separated security group IDs (default: every group)")
+    rules.add_argument('--vpc-id', help="Only sweep groups in this VPC")
+    rules.add_argument('--snapshot-db', help="Also store a rule snapshot here and report drift since the last one")
+    rules.set_defaults(handler=run_rules)
+
+    drift = subparsers.add_parser('drift', parents=[options()],
+                                  help="Rules added, removed or modified since the last snapshot")
+    drift.add_argument('--sg-ids', type=split_list, default=None,
+                       help="Comma-separated security group IDs (default: every group)")
+    drift.add_argument('--vpc-id', help="Only sweep groups in this VPC")
+    drift.add_argument('--snapshot-db', default='sg_rule_snapshots.db', help="Rule snapshot database")
+    drift.set_defaults(handler=run_drift)
+
+    changes = subparsers.add_parser('changes', parents=[options(workers=4), sgs_required, window('24h')],
+                                    help="SG rule changes recorded by CloudTrail")
+    changes.add_argument('--cache-db', default='sg_changes_cache.db', help="Local CloudTrail event cache")
+    changes.add_argument('--no-cache', action='store_true', help="Always query CloudTrail directly")
+    changes.add_argument('--archive', nargs='+', metavar='PATH',
+                         help="Scan local CloudTrail archive files/dirs instead of calling LookupEvents")
+    changes.add_argument('--full-state', action='store_true',
+                         help="Report each group's whole rule set before and after every change")
+    changes.set_defaults(handler=run_changes)
+
+    state = subparsers.add_parser('state', parents=[options(workers=4), sgs_required],
+                                  help="Rules the SGs had at a past time, rebuilt from CloudTrail")
+    state.add_argument('--at', type=datetime_arg, required=True,
+                       help="Point in time, ISO-8601 (UTC unless an offset is given)")
+    state.add_argument('--cache-db', default='sg_changes_cache.db', help="Local CloudTrail event cache")
+    state.add_argument('--no-cache', action='store_true', help="Always query CloudTrail directly")
+    state.set_defaults(handler=run_state)
+
+    flow_rejects = subparsers.add_parser('flow-rejects', parents=[options(), sgs_required, window('1h')],
+                                         help="REJECTed flows from the SGs' instances")
+    flow_rejects.add_argument('--log-groups', type=split_list, required=True,
+                              help="Comma-separated VPC flow log group names")
+    flow_rejects.add_argument('--notify', action='store_true', help="Email the results (SG_AUDIT_SMTP_* settings)")
+    flow_rejects.add_argument('--digest-per-sg', action='store_true', help="One email per SG instead of per run")
+    flow_rejects.set_defaults(handler=run_flow_rejects)
+
+    graph = subparsers.add_parser('graph', parents=[options(), sgs_required],
+                                  help="Blast radius of the SGs, or what can reach them on a port")
+    graph.add_argument('--vpc-id', help="Only sweep groups in this VPC")
+    graph.add_argument('--port', type=int, help="Report the groups/instances that can reach the SGs on this port")
+    graph.add_argument('--protocol', default='tcp', help="Protocol for --port (default: tcp)")
+    graph.add_argument('--transitive', action='store_true', help="With --port, include multi-hop sources")
+    graph.set_defaults(handler=run_graph)
+
+    notify = subparsers.add_parser('notify', help="Email report files in one message")
+    notify.add_argument('attachments', nargs='+', help="Report files to attach")
+    notify.add_argument('--subject', default="Security group audit reports", help="Email subject")
+    notify.set_defaults(handler=run_notify)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'metrics', None):
+        import instrumentation
+        instrumentation.enable(args.metrics)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
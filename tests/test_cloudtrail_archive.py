@@ -0,0 +1,54 @@
+import gzip
+import json
+
+import modify_sg_changes_v1
+from cloudtrail_archive import iter_archive_changes
+
+
+def authorize_record(event_id, event_time, group_id, peer_id):
+    return {
+        'eventID': event_id,
+        'eventTime': event_time,
+        'eventName': 'AuthorizeSecurityGroupIngress',
+        'userIdentity': {'arn': 'arn:aws:iam::123456789012:user/admin'},
+        'sourceIPAddress': '203.0.113.10',
+        'requestParameters': {
+            'groupId': group_id,
+            'ipPermissions': {'items': [{
+                'ipProtocol': 'tcp', 'fromPort': 443, 'toPort': 443,
+                'groups': {'items': [{'groupId': peer_id}]}
+            }]}
+        }
+    }
+
+
+def write_archive(path, *records):
+    with gzip.open(path, 'wt') as f:
+        json.dump({'Records': list(records)}, f)
+    return str(path)
+
+
+def test_peer_reference_is_reported_once(tmp_path, monkeypatch):
+    path = write_archive(tmp_path / 'trail.json.gz', authorize_record('e1', '2024-05-01T10:00:00Z', 'sg-a', 'sg-b'))
+    pairs = list(iter_archive_changes([path], ['sg-a', 'sg-b'], processes=1))
+    assert [sg_id for sg_id, _ in pairs] == ['sg-a', 'sg-b']
+
+    monkeypatch.setattr(modify_sg_changes_v1, 'archive_paths', [path])
+    monkeypatch.setattr(modify_sg_changes_v1, 'start_time', None)
+    monkeypatch.setattr(modify_sg_changes_v1, 'end_time', None)
+    changes = [change for _, change in modify_sg_changes_v1.iter_sg_changes(['sg-a', 'sg-b'])]
+    rows = list(modify_sg_changes_v1.iter_analyzed_changes(changes))
+    assert len(rows) == 1
+    assert rows[0]['GroupId'] == 'sg-a' and rows[0]['CIDR'] == 'sg-b'
+
+
+def test_batches_stream_in_delivery_order(tmp_path, monkeypatch):
+    import cloudtrail_archive
+
+    monkeypatch.setattr(cloudtrail_archive, 'FILES_PER_TASK', 2)
+    for hour in (3, 1, 4, 0, 2):
+        name = f"123456789012_CloudTrail_us-east-1_20240501T{hour:02d}05Z_abc{hour}.json.gz"
+        record = authorize_record(f"e{hour}", f"2024-05-01T{hour:02d}:00:00Z", 'sg-a', 'sg-b')
+        write_archive(tmp_path / name, record)
+    changes = iter_archive_changes([str(tmp_path)], ['sg-a'], processes=1)
+    assert [change['EventId'] for _, change in changes] == ['e0', 'e1', 'e2', 'e3', 'e4']
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from cloudtrail_cache import CloudTrailEventCache, DELIVERY_OVERLAP
+from fanout import FanoutError
+
+T0 = datetime(2024, 5, 1, tzinfo=timezone.utc)
+SG_ID = 'sg-0123456789abcdef0'
+
+
+@pytest.fixture
+def cache():
+    with CloudTrailEventCache(':memory:') as cache:
+        yield cache
+
+
+def test_overlapping_window_extends_range(cache):
+    cache.mark_synced(SG_ID, T0, T0 + timedelta(hours=2))
+    cache.mark_synced(SG_ID, T0 + timedelta(hours=1), T0 + timedelta(hours=3))
+    assert cache.synced_range(SG_ID) == (T0, T0 + timedelta(hours=3))
+
+
+def test_touching_window_extends_range(cache):
+    cache.mark_synced(SG_ID, T0, T0 + timedelta(hours=1))
+    cache.mark_synced(SG_ID, T0 + timedelta(hours=1), T0 + timedelta(hours=2))
+    assert cache.synced_range(SG_ID) == (T0, T0 + timedelta(hours=2))
+
+
+def test_later_disjoint_window_replaces_range(cache):
+    cache.mark_synced(SG_ID, T0, T0 + timedelta(hours=1))
+    cache.mark_synced(SG_ID, T0 + timedelta(hours=5), T0 + timedelta(hours=6))
+    assert cache.synced_range(SG_ID) == (T0 + timedelta(hours=5), T0 + timedelta(hours=6))
+    # The gap was never fetched, so a window spanning it starts from scratch
+    assert cache.delta_start(SG_ID, T0) == T0
+
+
+def test_earlier_disjoint_window_keeps_range(cache):
+    cache.mark_synced(SG_ID, T0 + timedelta(hours=5), T0 + timedelta(hours=6))
+    cache.mark_synced(SG_ID, T0, T0 + timedelta(hours=1))
+    assert cache.synced_range(SG_ID) == (T0 + timedelta(hours=5), T0 + timedelta(hours=6))
+
+
+def test_delta_start_resumes_before_synced_until(cache):
+    cache.mark_synced(SG_ID, T0, T0 + timedelta(hours=2))
+    assert cache.delta_start(SG_ID, T0) == T0 + timedelta(hours=2) - DELIVERY_OVERLAP
+    assert cache.delta_start(SG_ID, T0 + timedelta(hours=4)) == T0 + timedelta(hours=4)
+    naive = cache.delta_start(SG_ID, T0.replace(tzinfo=None))
+    assert naive == (T0 + timedelta(hours=2) - DELIVERY_OVERLAP).replace(tzinfo=None)
+
+
+def test_scopes_in_one_file_are_independent(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    with CloudTrailEventCache(path, 'acct/us-east-1') as us_east:
+        # A region that does not own the SG finds no events but still syncs it
+        us_east.mark_synced(SG_ID, T0, T0 + timedelta(hours=3))
+        us_east.conn.commit()
+    with CloudTrailEventCache(path, 'acct/eu-west-1') as eu_west:
+        assert eu_west.synced_range(SG_ID) is None
+        assert eu_west.delta_start(SG_ID, T0) == T0
+        eu_west.merge(SG_ID, [{'EventId': 'e1', 'EventTime': T0 + timedelta(hours=1)}])
+        assert [event['EventId'] for event in eu_west.iter_events(SG_ID, T0, T0 + timedelta(hours=3))] == ['e1']
+    with CloudTrailEventCache(path, 'acct/us-east-1') as us_east:
+        assert list(us_east.iter_events(SG_ID, T0, T0 + timedelta(hours=3))) == []
+
+
+def test_unscoped_cache_is_rebuilt(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / 'cache.db')
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE events (event_id TEXT, sg_id TEXT, event_time REAL, event_name TEXT, cloudtrail_event TEXT);
+        CREATE TABLE high_water (sg_id TEXT PRIMARY KEY, synced_from REAL, synced_until REAL);
+        INSERT INTO high_water VALUES ('sg-0123456789abcdef0', 0, 9999999999);
+    """)
+    conn.close()
+    with CloudTrailEventCache(path, 'acct/us-east-1') as cache:
+        assert cache.synced_range(SG_ID) is None
+
+
+def stubbed_cloudtrail():
+    session = pytest.importorskip('botocore.session')
+    from botocore.stub import Stubber
+
+    client = session.get_session().create_client(
+        'cloudtrail', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+    return client, Stubber(client)
+
+
+def expect_lookup(stubber, start_time, end_time, event_ids=()):
+    stubber.add_response(
+        'lookup_events',
+        {'Events': [{'EventId': event_id, 'EventName': 'RevokeSecurityGroupIngress', 'EventTime': start_time}
+                    for event_id in event_ids]},
+        {'LookupAttributes': [{'AttributeKey': 'ResourceName', 'AttributeValue': SG_ID}],
+         'StartTime': start_time, 'EndTime': end_time, 'MaxResults': 50}
+    )
+
+
+def test_sync_fetches_only_the_delta(cache):
+    client, stubber = stubbed_cloudtrail()
+    t1, t2 = T0 + timedelta(hours=2), T0 + timedelta(hours=3)
+    with stubber:
+        expect_lookup(stubber, T0, t1, ['e1'])
+        expect_lookup(stubber, t1 - DELIVERY_OVERLAP, t2, ['e1', 'e2'])
+        assert cache.sync(client, [SG_ID], T0, t1) == 1
+        assert cache.sync(client, [SG_ID], T0, t2) == 1
+        stubber.assert_no_pending_responses()
+    assert cache.synced_range(SG_ID) == (T0, t2)
+    assert [event['EventId'] for event in cache.iter_events(SG_ID, T0, t2)] == ['e2', 'e1']
+
+
+def test_sync_refetches_a_gap_between_windows(cache):
+    client, stubber = stubbed_cloudtrail()
+    t1, t2, t3 = (T0 + timedelta(hours=hours) for hours in (1, 5, 6))
+    with stubber:
+        expect_lookup(stubber, T0, t1)
+        expect_lookup(stubber, t2, t3)
+        # (t1, t2) was never fetched, so a window spanning it starts over
+        expect_lookup(stubber, T0, t3, ['e1'])
+        cache.sync(client, [SG_ID], T0, t1)
+        cache.sync(client, [SG_ID], t2, t3)
+        assert cache.synced_range(SG_ID) == (t2, t3)
+        assert cache.sync(client, [SG_ID], T0, t3) == 1
+        stubber.assert_no_pending_responses()
+    assert cache.synced_range(SG_ID) == (T0, t3)
+
+
+def test_failed_sync_raises_and_is_not_marked(cache):
+    client, stubber = stubbed_cloudtrail()
+    other_sg_id = 'sg-0fedcba9876543210'
+    t1 = T0 + timedelta(hours=1)
+    with stubber:
+        stubber.add_client_error('lookup_events', 'ThrottlingException', http_status_code=400)
+        stubber.add_response('lookup_events', {'Events': []}, {
+            'LookupAttributes': [{'AttributeKey': 'ResourceName', 'AttributeValue': other_sg_id}],
+            'StartTime': T0, 'EndTime': t1, 'MaxResults': 50
+        })
+        with pytest.raises(FanoutError) as raised:
+            cache.sync(client, [SG_ID, other_sg_id], T0, t1, max_workers=1)
+    assert list(raised.value.failures) == [SG_ID]
+    assert cache.synced_range(SG_ID) is None
+    assert cache.synced_range(other_sg_id) == (T0, t1)
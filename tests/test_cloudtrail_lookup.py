@@ -0,0 +1,81 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+botocore_session = pytest.importorskip('botocore.session')
+from botocore.stub import Stubber
+
+from cloudtrail_lookup import LOOKUP_PAGE_SIZE, TokenBucket, iter_lookup_events
+
+SG_ID = 'sg-0123456789abcdef0'
+END = datetime(2024, 5, 2, tzinfo=timezone.utc)
+START = END - timedelta(days=1)
+
+
+def cloudtrail_client():
+    return botocore_session.get_session().create_client(
+        'cloudtrail', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+
+
+def lookup_params(start_time=START, end_time=END, next_token=None):
+    params = {
+        'LookupAttributes': [{'AttributeKey': 'ResourceName', 'AttributeValue': SG_ID}],
+        'StartTime': start_time,
+        'EndTime': end_time,
+        'MaxResults': LOOKUP_PAGE_SIZE
+    }
+    if next_token:
+        params['NextToken'] = next_token
+    return params
+
+
+def events(*event_ids):
+    return [{'EventId': event_id, 'EventName': 'AuthorizeSecurityGroupIngress', 'EventTime': START}
+            for event_id in event_ids]
+
+
+def test_follows_next_token_until_the_last_page():
+    client = cloudtrail_client()
+    with Stubber(client) as stubber:
+        stubber.add_response('lookup_events', {'Events': events('e1', 'e2'), 'NextToken': 'page-2'},
+                             lookup_params())
+        stubber.add_response('lookup_events', {'Events': events('e3')}, lookup_params(next_token='page-2'))
+        found = [event['EventId'] for event in iter_lookup_events(client, SG_ID, START, END)]
+        stubber.assert_no_pending_responses()
+    assert found == ['e1', 'e2', 'e3']
+
+
+def test_acquires_a_token_per_page():
+    class CountingBucket:
+        acquired = 0
+
+        def acquire(self):
+            self.acquired += 1
+
+    client = cloudtrail_client()
+    bucket = CountingBucket()
+    with Stubber(client) as stubber:
+        stubber.add_response('lookup_events', {'Events': [], 'NextToken': 'page-2'}, lookup_params())
+        stubber.add_response('lookup_events', {'Events': []}, lookup_params(next_token='page-2'))
+        assert list(iter_lookup_events(client, SG_ID, START, END, bucket)) == []
+    assert bucket.acquired == 2
+
+
+def test_api_errors_propagate():
+    client = cloudtrail_client()
+    with Stubber(client) as stubber:
+        stubber.add_client_error('lookup_events', 'ThrottlingException', http_status_code=400)
+        with pytest.raises(client.exceptions.ClientError):
+            list(iter_lookup_events(client, SG_ID, START, END))
+
+
+def test_token_bucket_paces_calls_after_the_burst():
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # Two tokens are available at once; the other four arrive at 20 per second
+    assert time.monotonic() - started >= 4 / 20 - 0.02
+
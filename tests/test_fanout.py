@@ -0,0 +1,25 @@
+import pytest
+
+from fanout import FanoutError, iter_fanout
+
+
+def test_failed_worker_raises_after_the_others_finish():
+    def worker(item):
+        yield item
+        if item == 'b':
+            raise RuntimeError('throttled')
+        yield item.upper()
+
+    completed = []
+    results = []
+    with pytest.raises(FanoutError) as raised:
+        for item, result in iter_fanout(worker, ['a', 'b', 'c'], max_workers=2, on_complete=completed.append):
+            results.append(result)
+    assert sorted(results) == ['A', 'C', 'a', 'b', 'c']
+    assert sorted(completed) == ['a', 'c']
+    assert list(raised.value.failures) == ['b']
+    assert 'b: throttled' in str(raised.value)
+
+
+def test_all_workers_succeed():
+    assert sorted(iter_fanout(lambda item: [item * 2], [1, 2, 3])) == [(1, 2), (2, 4), (3, 6)]
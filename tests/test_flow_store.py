@@ -0,0 +1,21 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from flow_store import _parse_ints, _parse_times
+
+
+@pytest.mark.parametrize('values', [
+    [b'80', b'-', b'443', None],
+    ['80', '-', '443', None],
+])
+def test_parse_ints_keeps_values_next_to_placeholders(values):
+    assert _parse_ints(np.array(values, dtype=object), np.int32).tolist() == [80, 0, 443, 0]
+
+
+def test_parse_ints_bytes_array_with_placeholder():
+    assert _parse_ints(np.array([b'22', b'-']), np.uint16).tolist() == [22, 0]
+
+
+def test_parse_times_epoch_bytes_with_placeholder():
+    assert _parse_times(np.array([b'1700000000', b'-'])).tolist() == [1700000000, 0]
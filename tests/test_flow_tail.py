@@ -0,0 +1,94 @@
+import gzip
+import json
+
+import flow_tail
+
+
+class KinesisError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+def payload(*messages):
+    return gzip.compress(json.dumps({
+        'messageType': 'DATA_MESSAGE', 'logEvents': [{'message': message} for message in messages]
+    }).encode())
+
+
+class Paginator:
+    def __init__(self, shard_ids):
+        self.shard_ids = shard_ids
+
+    def paginate(self, StreamName):
+        yield {'Shards': [{'ShardId': shard_id} for shard_id in self.shard_ids()]}
+
+
+class ReshardingKinesis:
+    """shard-0 closes after one record and hands over to shard-1, which throttles and expires once."""
+
+    def __init__(self):
+        self.shards = ['shard-0']
+        self.iterator_requests = []
+        self.script = {
+            'shard-0': [{'Records': [self.record('0-1', 'a')], 'NextShardIterator': 'shard-0/2'},
+                        {'Records': [], 'ChildShards': [{'ShardId': 'shard-1'}]}],
+            'shard-1': [KinesisError('ProvisionedThroughputExceededException'),
+                        {'Records': [self.record('1-1', 'b')], 'NextShardIterator': 'shard-1/2'},
+                        KinesisError('ExpiredIteratorException'),
+                        {'Records': [self.record('1-2', 'c')]}],
+        }
+
+    @staticmethod
+    def record(sequence_number, message):
+        return {'SequenceNumber': sequence_number, 'Data': payload(message)}
+
+    def get_paginator(self, name):
+        return Paginator(lambda: self.shards)
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType, StartingSequenceNumber=None):
+        self.iterator_requests.append((ShardId, ShardIteratorType, StartingSequenceNumber))
+        return {'ShardIterator': f"{ShardId}/1"}
+
+    def get_records(self, ShardIterator, Limit):
+        step = self.script[ShardIterator.split('/')[0]].pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+def test_tail_kinesis_follows_reshards_and_survives_errors(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(flow_tail.time, 'sleep', sleeps.append)
+    kinesis = ReshardingKinesis()
+    assert list(flow_tail.tail_kinesis(kinesis, 'flows')) == ['a', 'b', 'c']
+    assert kinesis.iterator_requests == [
+        ('shard-0', 'LATEST', None),
+        ('shard-1', 'TRIM_HORIZON', None),
+        ('shard-1', 'AFTER_SEQUENCE_NUMBER', '1-1'),
+    ]
+    # Every round is paced, and the throttled one backs off for longer
+    assert len(sleeps) == 6
+    assert all(pause > 0 for pause in sleeps)
+    assert max(sleeps) >= 2 * flow_tail.GET_RECORDS_INTERVAL
+
+
+def flow_line(src, dst, port, end, action='REJECT'):
+    return f"2 123456789012 eni-1 {src} {dst} 40000 {port} 6 1 40 {end - 10} {end} {action} OK"
+
+
+def test_evicted_alerted_key_can_alert_again():
+    detector = flow_tail.RejectDetector(threshold=2, window=300, max_keys=10)
+    assert detector.feed(flow_line('10.0.0.1', '10.0.1.1', 22, 1000)) == []
+    assert len(detector.feed(flow_line('10.0.0.1', '10.0.1.1', 22, 1000))) == 1
+    # Many other keys, each counted more often, push the alerted key out
+    for i in range(20):
+        for _ in range(3):
+            detector.feed(flow_line(f"10.0.2.{i}", '10.0.1.1', 22, 1001))
+    hot = (b'10.0.0.1', b'10.0.1.1', b'22', b'6')
+    assert hot not in detector.counter.totals
+    assert hot not in detector.alerted
+    assert len(detector.alerted) <= len(detector.counter.totals)
+    # Once the other keys have expired it bursts again, and alerts again
+    assert detector.feed(flow_line('10.0.0.1', '10.0.1.1', 22, 1400)) == []
+    assert len(detector.feed(flow_line('10.0.0.1', '10.0.1.1', 22, 1400))) == 1
@@ -0,0 +1,34 @@
+import itertools
+import time
+
+from insights_scheduler import InsightsQuery, run_split_queries
+
+
+class TruncatingLogsClient:
+    """Fake Logs client whose queries always take `latency` seconds and fill their row limit."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self._ids = itertools.count()
+
+    def start_query(self, limit, **kwargs):
+        return {'queryId': f"{next(self._ids)}:{limit}"}
+
+    def get_query_results(self, queryId):
+        time.sleep(self.latency)
+        limit = int(queryId.split(':')[1])
+        return {'status': 'Complete', 'results': [[{'field': 'n', 'value': str(i)}] for i in range(limit)]}
+
+    def stop_query(self, queryId):
+        pass
+
+
+def test_split_rounds_share_one_deadline():
+    query = InsightsQuery('flow-logs', 'stats count(*)', 0, 2 ** 20, limit=2)
+    started = time.monotonic()
+    finished = run_split_queries(TruncatingLogsClient(latency=0.05), [query], deadline=0.3, initial_poll=0.01)
+    # Without a shared deadline every round would get a fresh 0.3 s and the
+    # split would run all the way down to single seconds
+    assert time.monotonic() - started < 1.5
+    assert any(q.status == 'Timeout' for q in finished)
+    assert sum(q.end_time - q.start_time + 1 for q in finished) == 2 ** 20 + 1
@@ -0,0 +1,50 @@
+import pytest
+
+botocore_session = pytest.importorskip('botocore.session')
+from botocore.awsrequest import AWSResponse
+
+import instrumentation
+
+DESCRIBE_OK = b'<DescribeInstancesResponse><reservationSet/></DescribeInstancesResponse>'
+UNAUTHORIZED = (b'<Response><Errors><Error><Code>UnauthorizedOperation</Code>'
+                b'<Message>denied</Message></Error></Errors></Response>')
+
+
+class RawBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+@pytest.fixture
+def ec2_client(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'enabled', True)
+    monkeypatch.setattr(instrumentation, '_api', {})
+    client = botocore_session.get_session().create_client(
+        'ec2', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing'
+    )
+    instrumentation.instrument_client(client)
+    return client
+
+
+def respond(client, responses):
+    """Answers each HTTP request with the next (status, body) instead of calling AWS."""
+    responses = iter(responses)
+
+    def send(request, **kwargs):
+        status, body = next(responses)
+        return AWSResponse(request.url, status, {}, RawBody(body))
+
+    client.meta.events.register('before-send', send)
+
+
+def test_http_api_errors_are_counted(ec2_client):
+    respond(ec2_client, [(200, DESCRIBE_OK), (403, UNAUTHORIZED)])
+    ec2_client.describe_instances()
+    with pytest.raises(ec2_client.exceptions.ClientError):
+        ec2_client.describe_instances()
+    stats = instrumentation.summary()['api']['ec2.DescribeInstances']
+    assert stats['calls'] == 2
+    assert stats['errors'] == 1
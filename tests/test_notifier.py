@@ -0,0 +1,73 @@
+import socket
+
+import pytest
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller
+
+import notifier
+import vpc_flow_reject_v4
+
+
+class Inbox:
+    """aiosmtpd handler that keeps every message and counts SMTP sessions."""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = Inbox()
+    controller = Controller(inbox, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    try:
+        yield controller, inbox
+    finally:
+        controller.stop()
+
+
+def local_notifier(controller):
+    return notifier.Notifier(host=controller.hostname, port=controller.port, username='', password='',
+                             sender='audit@example.com', recipients=['secops@example.com'], starttls=False)
+
+
+def test_notifier_reuses_one_connection(smtp_server, tmp_path):
+    controller, inbox = smtp_server
+    report = tmp_path / 'report.csv'
+    report.write_text('a,b\n1,2\n')
+    with local_notifier(controller) as mailer:
+        mailer.send('first', 'body', [str(report)])
+        mailer.send('second', 'body')
+    assert (mailer.sent, mailer.failed) == (2, 0)
+    assert inbox.sessions == 1
+    assert [envelope.rcpt_tos for envelope in inbox.messages] == [['secops@example.com']] * 2
+    assert b'filename="report.csv"' in inbox.messages[0].content
+
+
+def test_per_sg_digests_share_one_connection(smtp_server, tmp_path, monkeypatch):
+    controller, inbox = smtp_server
+    monkeypatch.setattr(vpc_flow_reject_v4, 'Notifier', lambda: local_notifier(controller))
+    monkeypatch.setattr(vpc_flow_reject_v4, 'DIGEST_PER_SG', True)
+    logs = [[{'field': 'srcAddr', 'value': ip}, {'field': 'count(*)', 'value': '3'}]
+            for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3')]
+    ip_to_sg = {'10.0.0.1': 'sg-a', '10.0.0.2': 'sg-b', '10.0.0.3': 'sg-c'}
+    vpc_flow_reject_v4.notify_rejects(logs, str(tmp_path / 'missing.csv'), ip_to_sg)
+    assert len(inbox.messages) == 3
+    assert inbox.sessions == 1
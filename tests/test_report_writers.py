@@ -0,0 +1,74 @@
+import csv
+import json
+
+import pytest
+
+from report_writers import ReportSourceError, open_report_writer, write_report
+
+FIELDS = ['SecurityGroupID', 'Region']
+
+
+def rows(count):
+    return ({'SecurityGroupID': f"sg-{i % 7}", 'Region': 'us-east-1'} for i in range(count))
+
+
+def test_csv_and_jsonl(tmp_path):
+    assert write_report(rows(3), str(tmp_path / 'r.csv'), FIELDS) == 3
+    with open(tmp_path / 'r.csv', newline='') as f:
+        assert [row['SecurityGroupID'] for row in csv.DictReader(f)] == ['sg-0', 'sg-1', 'sg-2']
+    write_report(rows(2), str(tmp_path / 'r.jsonl'), FIELDS)
+    with open(tmp_path / 'r.jsonl') as f:
+        assert [json.loads(line)['SecurityGroupID'] for line in f] == ['sg-0', 'sg-1']
+
+
+@pytest.mark.parametrize('extension', ['csv', 'jsonl'])
+def test_flush_makes_rows_readable_before_close(tmp_path, extension):
+    path = tmp_path / f"r.{extension}"
+    with open_report_writer(str(path), FIELDS) as writer:
+        writer.write_row({'SecurityGroupID': 'sg-0', 'Region': 'us-east-1'})
+        writer.flush()
+        assert 'sg-0' in path.read_text()
+
+
+@pytest.mark.parametrize('extension', ['arrow', 'parquet'])
+def test_arrow_formats_span_several_batches(tmp_path, extension):
+    pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    path = str(tmp_path / f"r.{extension}")
+    with open_report_writer(path, FIELDS, batch_size=10) as writer:
+        writer.write_rows(rows(25))
+    table = pyarrow.ipc.open_file(path).read_all() if extension == 'arrow' else pyarrow.parquet.read_table(path)
+    assert table.num_rows == 25
+    assert table.column('SecurityGroupID').to_pylist()[-1] == 'sg-3'
+
+
+def test_failed_source_keeps_the_previous_report(tmp_path):
+    path = tmp_path / 'r.csv'
+    write_report(rows(2), str(path), FIELDS)
+    previous = path.read_text()
+
+    def failing_rows():
+        yield from rows(1)
+        raise RuntimeError('throttled')
+
+    with pytest.raises(ReportSourceError, match='throttled'):
+        write_report(failing_rows(), str(path), FIELDS)
+    assert path.read_text() == previous
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['r.csv']
+
+
+def test_save_to_csv_reports_fetch_errors(tmp_path, capsys):
+    import getinboundrule
+
+    path = tmp_path / 'rules.csv'
+    path.write_text('complete\n')
+
+    def failing_rows():
+        yield {'GroupId': 'sg-1'}
+        raise RuntimeError('AccessDenied')
+
+    getinboundrule.save_to_csv(failing_rows(), str(path))
+    assert 'Error fetching security group rules: AccessDenied' in capsys.readouterr().out
+    assert path.read_text() == 'complete\n'
@@ -0,0 +1,21 @@
+from sg_graph import SecurityGroupGraph
+
+
+def group(group_id, admitted):
+    """describe_security_groups entry whose inbound rule admits the admitted groups."""
+    return {
+        'GroupId': group_id, 'GroupName': group_id, 'VpcId': 'vpc-1',
+        'IpPermissions': [{'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443,
+                           'UserIdGroupPairs': [{'GroupId': peer} for peer in admitted]}],
+        'IpPermissionsEgress': [],
+    }
+
+
+def test_blast_radius_sizes_agree_with_blast_radius_in_cycles():
+    graph = SecurityGroupGraph([group('sg-b', ['sg-c']), group('sg-c', ['sg-b']), group('sg-d', ['sg-b']),
+                                group('sg-e', [])])
+    sizes = graph.blast_radius_sizes()
+    assert sizes == {'sg-b': 2, 'sg-c': 2, 'sg-d': 0, 'sg-e': 0}
+    for group_id, size in sizes.items():
+        affected = [other for other in graph.blast_radius(group_id) if other != group_id]
+        assert size == len(affected)
@@ -0,0 +1,38 @@
+import pytest
+
+from sg_rules import SecurityGroupRule, iter_permission_rules, parse_port_range
+
+PERMISSIONS = [
+    {'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'IpRanges': [{'CidrIp': '10.0.0.0/8'}]},
+    {'IpProtocol': 'tcp', 'FromPort': 0, 'ToPort': 65535, 'UserIdGroupPairs': [{'GroupId': 'sg-0b'}]},
+    {'IpProtocol': '-1', 'IpRanges': [{'CidrIp': '0.0.0.0/0', 'Description': 'all traffic'}]},
+    {'IpProtocol': 'icmp', 'FromPort': 8, 'ToPort': -1, 'IpRanges': [{'CidrIp': '10.1.0.0/16'}]},
+    {'IpProtocol': 'icmp', 'FromPort': -1, 'ToPort': -1, 'Ipv6Ranges': [{'CidrIpv6': '::/0'}]},
+    {'IpProtocol': 'icmp', 'FromPort': 3, 'ToPort': 4, 'PrefixListIds': [{'PrefixListId': 'pl-1'}]},
+]
+
+
+@pytest.mark.parametrize('permission', PERMISSIONS)
+def test_rule_row_round_trip(permission):
+    for rule in iter_permission_rules('sg-0a', 'web', 'vpc-1', 'Inbound', permission):
+        assert 'None' not in rule.port_range
+        assert SecurityGroupRule.from_row(rule.to_row()) == rule
+
+
+@pytest.mark.parametrize('port_range, expected', [
+    ('All', (None, None)),
+    ('', (None, None)),
+    ('22-22', (22, 22)),
+    ('8-All', (8, None)),
+    ('8-None', (8, None)),
+    ('8--1', (8, None)),
+    ('-1--1', (None, None)),
+    ('80', (80, 80)),
+])
+def test_parse_port_range(port_range, expected):
+    assert parse_port_range(port_range) == expected
+
+
+def test_icmp_port_range_has_open_bound():
+    rule = next(iter_permission_rules('sg-0a', '', None, 'Inbound', PERMISSIONS[3]))
+    assert rule.port_range == '8-All'
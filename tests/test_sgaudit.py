@@ -0,0 +1,20 @@
+import pytest
+
+from sgaudit import build_parser
+
+
+@pytest.mark.parametrize('argv, workers', [
+    (['inventory', '--sg-ids', 'sg-1'], 16),
+    (['rules'], 16),
+    (['drift'], 16),
+    (['flow-rejects', '--sg-ids', 'sg-1', '--log-groups', 'flows'], 16),
+    (['graph', '--sg-ids', 'sg-1'], 16),
+    (['changes', '--sg-ids', 'sg-1'], 4),
+    (['state', '--sg-ids', 'sg-1', '--at', '2024-05-01T00:00'], 4),
+])
+def test_worker_defaults_are_per_subcommand(argv, workers):
+    assert build_parser().parse_args(argv).workers == workers
+
+
+def test_explicit_workers_win():
+    assert build_parser().parse_args(['changes', '--sg-ids', 'sg-1', '--workers', '2']).workers == 2
@@ -1,41 +1,69 @@
-import boto3
 import datetime
 import time
-import csv
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-import os
-from email import encoders
-
-# Initialize AWS clients
-ec2_client = boto3.client('ec2')
-logs_client = boto3.client('logs')
+from contextlib import nullcontext
+from aws_clients import get_client
+from flow_query import build_reject_queries
+from report_writers import write_report
+from insights_scheduler import InsightsQuery, run_split_queries, merge_query_results, MAX_QUERY_ROWS
+from inventory_index import InventoryIndex
+from notifier import Notifier, send_digest
+from flow_store import FlowStore, print_top
+from instrumentation import timed
+
+# AWS clients come from aws_clients.get_client and are created on first use
+AWS_REGION = None  # Default region from the AWS config
 SECURITY_GROUP_ID = "sg-0f88628462b1ae545"
+LOG_GROUP_NAMES = ["flgg-traditional-devtest"]  # Replace with your flow log group names
+LOOKBACK_HOURS = 1
+INVENTORY_CACHE = "inventory_index_{region}.json"  # Cached IP -> instance/SG/subnet index, per region
+_inventory_indexes = {}
+DIGEST_PER_SG = False  # One notification per SG instead of one per run
+TOP_N = 10  # Rows in the printed top ports/sources summary
+
+def get_inventory_index():
+    """
+    Return the cached IP -> instance/SG/subnet index, rebuilding it when older than its TTL.
+    """
+    index = _inventory_indexes.get(AWS_REGION)
+    if index is None:
+        index = InventoryIndex(INVENTORY_CACHE.format(region=AWS_REGION or 'default'))
+        index.ensure_fresh(get_client('ec2', AWS_REGION))
+        _inventory_indexes[AWS_REGION] = index
+    return index
 
 def get_instance_id_by_private_ip(private_ip):
     """
     Fetch the instance ID associated with the specified private IP.
     """
     try:
-        response = ec2_client.describe_instances(
-            Filters=[
-                {
-                    'Name': 'private-ip-address',
-                    'Values': [private_ip]
-                }
-            ]
-        )
-        
-        for reservation in response['Reservations']:
-            for instance in reservation['Instances']:
-                return instance['InstanceId']
-        return None
+        index = get_inventory_index()
+        index.refresh_missing(get_client('ec2', AWS_REGION), [private_ip])
+        entry = index.get(private_ip)
+        return entry.instance_id if entry else None
     except Exception as e:
         print(f"Error fetching instance ID: {e}")
         return None
 
+@timed('flow_rejects.enrich')
+def enrich_logs(logs):
+    """
+    Add instance, name tag, SG and subnet fields for srcAddr and dstAddr to each result row.
+    """
+    index = get_inventory_index()
+    addresses = set()
+    for log in logs:
+        for field in log:
+            if field['field'] in ('srcAddr', 'dstAddr'):
+                addresses.add(field.get('value'))
+    # One batched lookup for everything the cached sweep didn't cover
+    index.refresh_missing(get_client('ec2', AWS_REGION), addresses)
+
+    enriched_logs = []
+    for log in logs:
+        row = index.enrich({field['field']: field.get('value') for field in log})
+        enriched_logs.append([{'field': name, 'value': value} for name, value in row.items()])
+    return enriched_logs
+
 def query_logs_old(log_group_name, private_ip):
     """
     Query logs in a specified log group with a given private IP address.
@@ -49,7 +77,7 @@ def query_logs_old(log_group_name, private_ip):
         """
         
         # Start query
-        start_query_response = logs_client.start_query(
+        start_query_response = get_client('logs', AWS_REGION).start_query(
             logGroupName=log_group_name,
             startTime=int((datetime.datetime.now() - datetime.timedelta(hours=1)).timestamp()),
             endTime=int(datetime.datetime.now().timestamp()),
@@ -62,7 +90,7 @@ def query_logs_old(log_group_name, private_ip):
         
         # Wait for the query results
         while True:
-            response = logs_client.get_query_results(queryId=query_id)
+            response = get_client('logs', AWS_REGION).get_query_results(queryId=query_id)
             if response['status'] == 'Complete':
                 #print("Result")
                 #print(response['results'])
@@ -74,54 +102,45 @@ def query_logs_old(log_group_name, private_ip):
         print(f"Error querying logs: {e}")
         return []
     
+@timed('flow_rejects.query')
+def query_log_groups(log_group_names, private_ips, start_time=None, end_time=None):
+    """
+    Query several log groups concurrently for multiple private IP addresses.
+    """
+    end_time = end_time or datetime.datetime.now(datetime.timezone.utc)
+    start_time = start_time or end_time - datetime.timedelta(hours=LOOKBACK_HOURS)
+    # Large IP lists are split into batches, each run as its own query
+    ip_queries = build_reject_queries(private_ips)
+    print(f"{len(ip_queries)} query batches for {len(private_ips)} private IPs")
+
+    # Queries that hit the row limit are bisected in time until every slice is complete
+    queries = [
+        InsightsQuery(log_group_name, query, start_time.timestamp(), end_time.timestamp(), limit=MAX_QUERY_ROWS)
+        for log_group_name in log_group_names
+        for query in ip_queries
+    ]
+    finished = run_split_queries(get_client('logs', AWS_REGION), queries)
+    for log_group_name in log_group_names:
+        slices = [q for q in finished if q.log_group_name == log_group_name]
+        statuses = sorted({q.status for q in slices})
+        print(f"Query {'/'.join(statuses)} for {log_group_name}: "
+              f"{sum(len(q.results) for q in slices)} rows in {len(slices)} time slices")
+    return merge_query_results(finished)
+
 def query_logs(log_group_name, private_ips):
     """
     Query logs in a specified log group for multiple private IP addresses.
     """
     try:
-        # Build the filter condition for multiple private IPs
-        ip_filter = " or ".join([f"srcAddr = '{ip}'" for ip in private_ips])
-        
-        # Define the CloudWatch Insights Query
-        query = f"""
-        fields @timestamp, @message, @LogStream, @Log
-        | filter ({ip_filter}) and action = 'REJECT' and protocol != -1
-        | sort @timestamp desc
-        | stats count(*) by @timestamp, srcAddr, srcPort, dstAddr, dstPort, protocol
-        """
-        
-        # Start the query
-        start_query_response = logs_client.start_query(
-            logGroupName=log_group_name,
-            startTime=int((datetime.datetime.now() - datetime.timedelta(hours=1)).timestamp()),
-            endTime=int(datetime.datetime.now().timestamp()),
-            queryString=query,
-            limit=100
-        )
-        #print("my query")
-        #print(query)
-        query_id = start_query_response['queryId']
-        print(f"Query started with ID: {query_id}")
-        print ("query value")
-        print(query)
-        # Wait for the query results
-        while True:
-            response = logs_client.get_query_results(queryId=query_id)
-            if response['status'] == 'Complete':
-                print("Query complete")
-                return response['results']
-            elif response['status'] in ['Cancelled', 'Failed']:
-                print(f"Query {response['status']}")
-                return []
-            print("Waiting for query to complete...")
-            time.sleep(1)
-    
+        return query_log_groups([log_group_name], private_ips)
     except Exception as e:
         print(f"Error querying logs: {e}")
-        return []    
+        return []
+
+@timed('flow_rejects.fetch_private_ips')
 def fetch_instance_private_ips(security_group_id):
     try:
-        instances = ec2_client.describe_instances(
+        instances = get_client('ec2', AWS_REGION).describe_instances(
             Filters=[
                 {'Name': 'instance.group-id', 'Values': [security_group_id]}
             ]
@@ -133,100 +152,112 @@ def fetch_instance_private_ips(security_group_id):
         print(f"Error fetching instance private IPs: {e}")
         return [], []    
 
+def print_reject_summary(logs, top=TOP_N):
+    """
+    Print the most REJECTed destination ports and the noisiest sources, aggregated in a flow_store.FlowStore.
+    """
+    try:
+        store = FlowStore().add_query_results(logs)
+    except ImportError:  # no numpy: print the rows themselves
+        for log in logs:
+            print(log)
+        return
+    print_top(f"Top {top} REJECTed destination ports:", store.top_dst_ports(top), ['dstPort', 'protocol'])
+    print_top(f"Top {top} REJECTed sources:", store.top_sources(top), ['srcAddr'])
+
+@timed('flow_rejects.write')
 def write_logs_to_csv(logs, filename):
     try:
         if not logs:
             print("No logs to write.")
             return
 
-        with open(filename, 'w', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile)
-
-            # Write headers from the first log result
-            header = [field['field'] for field in logs[0]]
-            csv_writer.writerow(header)
-
-            # Write rows
-            for log in logs:
-                row = [field.get('value', '') for field in log]
-                csv_writer.writerow(row)
+        # Headers come from the first log result
+        header = [field['field'] for field in logs[0]]
+        rows = ({field['field']: field.get('value', '') for field in log} for log in logs)
+        write_report(rows, filename, header)
 
         print(f"Logs written to {filename}")
     except Exception as e:
-        print(f"Error writing logs to CSV: {e}")
+        print(f"Error writing logs to report: {e}")
 
-def send_email_with_attachment():
-    try:
-        smtp_server = "smtp.gmail.com"
-        port = 587
-        sender_email = "awscloudtrainers@gmail.com"
-        sender_password = "xxxx"  # Use an App Password if 2FA is enabled
-        recipient_email = "jaganrajagopalme@gmail.com"
-        subject = "CSV File Attachment"
-        body = "Please find the attached CSV file."
-        attachment_path = "vpc_flow_results.csv"
-        # Create the email object
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-
-        # Attach the email body
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Attach the file
-        if attachment_path and os.path.exists(attachment_path):
-            with open(attachment_path, 'rb') as attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment.read())
-            encoders.encode_base64(part)
-            part.add_header(
-                'Content-Disposition',
-                f'attachment; filename={os.path.basename(attachment_path)}'
-            )
-            msg.attach(part)
-        else:
-            print("Attachment not found or path is invalid.")
-
-        # Connect to the SMTP server and send the email
-        with smtplib.SMTP(smtp_server, port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
-
-        print("Email sent successfully!")
+def send_email_with_attachment(attachment_path="vpc_flow_results.csv", subject="CSV File Attachment",
+                               body="Please find the attached CSV file.", notifier=None):
+    """
+    Email the attachment through notifier (or a one-off notifier.Notifier).
+    SMTP settings, credentials and recipients come from the SG_AUDIT_* environment variables.
+    """
+    if notifier is not None:
+        notifier.send(subject, body, [attachment_path])
+        return
+    with Notifier() as one_off:
+        one_off.send(subject, body, [attachment_path])
+
+@timed('flow_rejects.notify')
+def notify_rejects(logs, csv_file, ip_to_sg=None, notifier=None):
+    """
+    Send one digest for the run, or one per SG when DIGEST_PER_SG is set, with the results attached.
+    """
+    rows = [{field['field']: field.get('value') for field in log} for log in logs]
+    fields = [field['field'] for field in logs[0]] if logs else []
+    if DIGEST_PER_SG and ip_to_sg:
+        by_sg = {}
+        for row in rows:
+            by_sg.setdefault(ip_to_sg.get(row.get('srcAddr'), 'unknown'), []).append(row)
+        digests = [(f"VPC flow REJECTs for {sg_id}", sg_rows) for sg_id, sg_rows in sorted(by_sg.items())]
+    else:
+        digests = [("VPC flow REJECTs", rows)]
+    # Without a notifier, open one here: one SMTP connection and login for all of the run's digests
+    with nullcontext(notifier) if notifier is not None else Notifier() as notifier:
+        for title, digest_rows in digests:
+            send_digest(title, digest_rows, fields, [csv_file], notifier)
 
+def find_rejects(security_group_ids, log_group_names, csv_file="vpc_flow_results.csv",
+                 start_time=None, end_time=None, notify=True, notifier=None):
+    """
+    Query the flow log groups for REJECTed traffic from the instances in the given SGs and write the results.
+    With notify, the results are mailed once per run (or per SG) after the report is written.
+    """
+    private_ips = []
+    ip_to_sg = {}
+    for security_group_id in security_group_ids:
+        sg_private_ips, instance_ids = fetch_instance_private_ips(security_group_id)
+        private_ips.extend(sg_private_ips)
+        ip_to_sg.update((ip, security_group_id) for ip in sg_private_ips)
+
+    # Query logs for the given private IP in the log group
+    try:
+        logs = query_log_groups(log_group_names, private_ips, start_time, end_time)
     except Exception as e:
-        print(f"Failed to send email: {e}")        
+        print(f"Error querying logs: {e}")
+        logs = []
+
+    if logs:
+        print("Query Results:")
+        try:
+            logs = enrich_logs(logs)
+        except Exception as e:
+            print(f"Error enriching logs with instance details: {e}")
+        write_logs_to_csv(logs, csv_file)
+        print_reject_summary(logs)
+        if notify:
+            print("preparing for sending mail...")
+            notify_rejects(logs, csv_file, ip_to_sg, notifier)
+    else:
+        print(f"No logs found for private IP {private_ips} in log groups {', '.join(log_group_names)}.")
+    return logs
+
 def main():
     # Input parameters
     #private_ip = "10.200.132.88"
-    log_group_name = "flgg-traditional-devtest"  # Replace with your log group name
-    private_ips, instance_ids = fetch_instance_private_ips(SECURITY_GROUP_ID)
     # Fetch instance ID using the private IP
-    #print ("value for private ips")
-    #print(private_ips)
     # instance_id = get_instance_id_by_private_ip(private_ips)
     # if not instance_id:
     #     print(f"No instance found for private IP: {private_ips}")
     #     return
 
     # print(f"Instance ID for private IP {private_ips}: {instance_id}")
-
-    # Query logs for the given private IP in the log group
-    logs = query_logs(log_group_name, private_ips)
-
-    if logs:
-        print("Query Results:")
-        csv_file = "vpc_flow_results.csv"
-        write_logs_to_csv(logs, csv_file)
-        for log in logs:
-            print(log)
-            #sending mail 
-            print("preparing for sending mail...")
-            send_email_with_attachment()
-    else:
-        print(f"No logs found for private IP {private_ips} in log group {log_group_name}.")
+    find_rejects([SECURITY_GROUP_ID], LOG_GROUP_NAMES)
 
 if __name__ == "__main__":
     main()